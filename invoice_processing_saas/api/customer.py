@@ -2,6 +2,9 @@
 # For license information, please see license.txt
 
 import frappe
+from invoice_processing_saas import quota
+from invoice_processing_saas.http_cache import conditional_get
+from invoice_processing_saas.identity import can_access_customer
 
 
 def after_customer_insert(doc, method):
@@ -77,20 +80,22 @@ def get_customer_stats(customer_name):
 	API endpoint to get customer statistics
 	"""
 	try:
-		customer = frappe.get_doc("SaaS Customer", customer_name)
-		
 		# Check permissions
-		if frappe.session.user != customer.email and not frappe.has_permission("SaaS Customer", "read", customer_name):
+		if not can_access_customer(customer_name, "SaaS Customer", "read", customer_name):
 			frappe.throw("Not permitted")
 			
-		return {
-			"current_usage": customer.current_usage or 0,
-			"usage_limit": customer.usage_limit or 0,
-			"total_processed": customer.total_processed or 0,
-			"subscription_status": customer.subscription_status,
-			"subscription_plan": customer.subscription_plan,
-			"trial_end_date": customer.trial_end_date
-		}
+		def build():
+			customer = frappe.get_doc("SaaS Customer", customer_name)
+			return {
+				"current_usage": quota.get_usage(customer.name),
+				"usage_limit": customer.usage_limit or 0,
+				"total_processed": customer.total_processed or 0,
+				"subscription_status": customer.subscription_status,
+				"subscription_plan": customer.subscription_plan,
+				"trial_end_date": customer.trial_end_date
+			}
+			
+		return conditional_get(customer_name, "customer_stats", build)
 		
 	except Exception as e:
 		frappe.log_error(f"Error getting customer stats: {str(e)}", "Customer API")
@@ -2,7 +2,14 @@
 # For license information, please see license.txt
 
 import frappe
-from frappe.utils import now
+from frappe.utils import cint
+from invoice_processing_saas import concurrency, event_log, job_rollup, job_state, quota
+from invoice_processing_saas.api_keys import resolve_api_key
+from invoice_processing_saas.identity import can_access_customer
+from invoice_processing_saas.rate_limit import rate_limited
+
+# Longest a wait_for_job_status call may block, in seconds
+STATUS_WAIT_TIMEOUT = 25
 
 
 def after_job_insert(doc, method):
@@ -10,15 +17,9 @@ def after_job_insert(doc, method):
 	Called after Processing Job document is inserted
 	"""
 	try:
-		# Log job creation
+		# Log job creation; the customer's last activity is tracked by the quota counters
 		frappe.logger().info(f"New processing job created: {doc.name} for customer {doc.customer}")
 		
-		# Update customer's last activity
-		if doc.customer:
-			customer = frappe.get_doc("SaaS Customer", doc.customer)
-			customer.last_activity = now()
-			customer.save(ignore_permissions=True)
-		
 	except Exception as e:
 		frappe.log_error(f"Error in after_job_insert: {str(e)}", "Processing API")
 
@@ -28,49 +29,34 @@ def on_job_update(doc, method):
 	Called when Processing Job document is updated
 	"""
 	try:
-		# Handle status changes
+		# Also runs on insert, when there is no previous version
+		job_rollup.record_change(doc, doc.get_doc_before_save())
+		
+		# Status changes made by saving the document get the same side effects
+		# as transitions applied through job_state
 		if doc.has_value_changed("processing_status"):
-			frappe.logger().info(f"Job {doc.name} status changed to {doc.processing_status}")
-			
-			# If job completed successfully, increment customer usage
-			if doc.processing_status == "Completed" and doc.customer:
-				customer = frappe.get_doc("SaaS Customer", doc.customer)
-				customer.increment_usage()
-				
-			# Send notification for failed jobs
-			elif doc.processing_status == "Failed":
-				_notify_job_failure(doc)
+			job_state.dispatch_side_effects(doc, doc.processing_status)
 		
 	except Exception as e:
 		frappe.log_error(f"Error in on_job_update: {str(e)}", "Processing API")
 
 
-def _notify_job_failure(job_doc):
+def on_job_trash(doc, method):
 	"""
-	Send notification for failed jobs
+	Called when Processing Job document is deleted
 	"""
 	try:
-		if job_doc.customer:
-			customer = frappe.get_doc("SaaS Customer", job_doc.customer)
-			
-			frappe.sendmail(
-				recipients=[customer.email],
-				subject="Processing Job Failed",
-				template="job_failure_notification",
-				args={
-					"customer_name": customer.customer_name,
-					"job_name": job_doc.name,
-					"file_name": job_doc.file_name,
-					"error_message": job_doc.error_message or "Unknown error",
-					"dashboard_url": f"{frappe.utils.get_url()}/dashboard"
-				}
-			)
-			
+		job_rollup.record_change(None, doc)
+		
+		if doc.processing_status == "Processing" and doc.customer:
+			concurrency.release_after_commit(doc.customer, doc.name)
+		
 	except Exception as e:
-		frappe.log_error(f"Error sending job failure notification: {str(e)}", "Processing API")
+		frappe.log_error(f"Error in on_job_trash: {str(e)}", "Processing API")
 
 
 @frappe.whitelist()
+@rate_limited()
 def create_job(file_name, file_url, customer_id=None, extraction_engine="GPT-4"):
 	"""
 	API endpoint for n8n to create processing jobs
@@ -82,26 +68,37 @@ def create_job(file_name, file_url, customer_id=None, extraction_engine="GPT-4")
 			if not api_key:
 				frappe.throw("API key required")
 				
-			customer_id = frappe.db.get_value("SaaS Customer", {"api_key": api_key}, "name")
-			if not customer_id:
+			identity = resolve_api_key(api_key)
+			if not identity:
 				frappe.throw("Invalid API key")
+			customer_id = identity.customer
 		
-		# Check customer quota
-		customer = frappe.get_doc("SaaS Customer", customer_id)
-		if not customer.check_usage_quota():
-			return {"error": "Quota exceeded"}
+		# Reserve customer quota
+		customer = frappe.db.get_value("SaaS Customer", customer_id,
+			["usage_limit", "overage_allowed"], as_dict=True)
+		if not customer:
+			frappe.throw("Customer not found")
+			
+		job_id = frappe.generate_hash(length=16)
+		quota.reserve(customer_id, job_id, customer.usage_limit, customer.overage_allowed)
 		
 		# Create processing job
 		job = frappe.get_doc({
 			"doctype": "Processing Job",
+			"job_id": job_id,
 			"customer": customer_id,
 			"file_name": file_name,
 			"file_url": file_url,
 			"extraction_engine": extraction_engine,
-			"processing_status": "Pending",
+			"processing_status": "Queued",
 			"created_via": "API"
 		})
-		job.insert(ignore_permissions=True)
+		
+		try:
+			job.insert(ignore_permissions=True)
+		except Exception:
+			quota.release(customer_id, job_id)
+			raise
 		
 		return {
 			"job_id": job.name,
@@ -115,22 +112,20 @@ def create_job(file_name, file_url, customer_id=None, extraction_engine="GPT-4")
 
 
 @frappe.whitelist()
+@rate_limited()
 def store_result(job_id, extracted_data, processing_time=None):
 	"""
 	API endpoint for n8n to store processing results
 	"""
 	try:
-		job = frappe.get_doc("Processing Job", job_id)
-		
-		# Update job with results
-		job.extracted_data = frappe.as_json(extracted_data) if extracted_data else "{}"
-		job.processing_status = "Completed"
-		job.completed_at = now()
+		result = {"extracted_data": frappe.as_json(extracted_data) if extracted_data else "{}"}
 		
+		# Jobs with a start time get their processing time from it
 		if processing_time:
-			job.processing_time = processing_time
+			result["processing_time"] = cint(processing_time)
 			
-		job.save(ignore_permissions=True)
+		# The results are written by the same conditional UPDATE that completes the job
+		job_state.transition(job_id, "Completed", result=result)
 		
 		return {
 			"status": "success",
@@ -143,26 +138,25 @@ def store_result(job_id, extracted_data, processing_time=None):
 
 
 @frappe.whitelist()
+@rate_limited()
 def update_job_status(job_id, status, error_message=None):
 	"""
 	API endpoint to update job status
 	"""
 	try:
-		job = frappe.get_doc("Processing Job", job_id)
+		# The job's own customer may update it; anyone else needs write on that job
+		customer = frappe.db.get_value("Processing Job", job_id, "customer")
+		if not customer:
+			frappe.throw(f"Processing Job {job_id} not found", frappe.DoesNotExistError)
+		if not can_access_customer(customer, "Processing Job", "write", job_id):
+			frappe.throw("Access denied", frappe.PermissionError)
 		
-		job.processing_status = status
-		
-		if error_message:
-			job.error_message = error_message
-			
-		if status in ["Completed", "Failed"]:
-			job.completed_at = now()
-			
-		job.save(ignore_permissions=True)
+		processing_status = job_state.transition(job_id, status, error_message=error_message)
 		
 		return {
 			"status": "success",
-			"message": f"Job status updated to {status}"
+			"message": f"Job status updated to {processing_status}",
+			"processing_status": processing_status
 		}
 		
 	except Exception as e:
@@ -176,18 +170,80 @@ def get_job_status(job_id):
 	API endpoint to get job status
 	"""
 	try:
-		job = frappe.get_doc("Processing Job", job_id)
+		return _get_job_status(job_id, include_extracted_data=True)
+		
+	except Exception as e:
+		frappe.log_error(f"Error getting job status: {str(e)}", "Processing API")
+		return {"error": str(e)}
+
+
+@frappe.whitelist()
+def wait_for_job_status(job_id, since_version=0, timeout=STATUS_WAIT_TIMEOUT):
+	"""
+	Long-poll API endpoint that returns once the job's status changes
+	Pass the version from the previous response; returns unchanged after the timeout
+	"""
+	try:
+		frappe.has_permission("Processing Job", "read", job_id, throw=True)
+		
+		timeout = min(max(cint(timeout), 0), STATUS_WAIT_TIMEOUT)
+		version = job_state.wait_for_status_change(job_id, cint(since_version), timeout)
+		
+		if version == cint(since_version):
+			return {"job_id": job_id, "changed": False, "version": version}
+		
+		return dict(_get_job_status(job_id), changed=True)
+		
+	except Exception as e:
+		frappe.log_error(f"Error waiting for job status: {str(e)}", "Processing API")
+		return {"error": str(e)}
+
+
+def _get_job_status(job_id, include_extracted_data=False):
+	"""Read a job's status fields without loading the document"""
+	fields = ["name", "processing_status", "file_name", "creation", "completed_at", "processing_time"]
+	if include_extracted_data:
+		fields.append("extracted_data")
+		
+	job = frappe.db.get_value("Processing Job", job_id, fields, as_dict=True)
+	if not job:
+		raise frappe.DoesNotExistError(f"Processing Job {job_id} not found")
+		
+	status = {
+		"job_id": job.name,
+		"status": job.processing_status,
+		"version": job_state.get_status_version(job.name),
+		"file_name": job.file_name,
+		"created_at": job.creation,
+		"completed_at": job.completed_at,
+		"processing_time": job.processing_time
+	}
+	
+	if include_extracted_data:
+		status["extracted_data"] = frappe.parse_json(job.extracted_data) if job.extracted_data else {}
+		
+	return status
+
+
+@frappe.whitelist()
+def get_job_timeline(job_id, limit=500):
+	"""
+	API endpoint to get the processing events logged for a job
+	"""
+	try:
+		# Accepts the n8n job ID or the job's name; events are logged under the job ID
+		job = frappe.db.get_value("Processing Job", {"job_id": job_id}, ["name", "job_id"], as_dict=True) \
+			or frappe.db.get_value("Processing Job", job_id, ["name", "job_id"], as_dict=True)
+		if not job:
+			frappe.throw(f"Processing Job {job_id} not found", frappe.DoesNotExistError)
+			
+		frappe.has_permission("Processing Job", "read", job.name, throw=True)
 		
 		return {
-			"job_id": job.name,
-			"status": job.processing_status,
-			"file_name": job.file_name,
-			"created_at": job.creation,
-			"completed_at": job.completed_at,
-			"processing_time": job.processing_time,
-			"extracted_data": frappe.parse_json(job.extracted_data) if job.extracted_data else {}
+			"job_id": job.job_id,
+			"events": event_log.get_job_timeline(job.job_id, limit=limit) if job.job_id else []
 		}
 		
 	except Exception as e:
-		frappe.log_error(f"Error getting job status: {str(e)}", "Processing API")
+		frappe.log_error(f"Error getting job timeline: {str(e)}", "Processing API")
 		return {"error": str(e)}
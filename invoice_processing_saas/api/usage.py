@@ -2,6 +2,10 @@
 # For license information, please see license.txt
 
 import frappe
+from invoice_processing_saas import quota
+from invoice_processing_saas.http_cache import conditional_get
+from invoice_processing_saas.identity import can_access_customer
+from invoice_processing_saas.notifications import queue_notification
 
 
 def on_usage_update(doc, method):
@@ -35,21 +39,19 @@ def on_usage_update(doc, method):
 
 def _send_usage_alert(usage_doc, percentage):
 	"""
-	Send usage alert email
+	Queue usage alert email
 	"""
 	try:
-		customer = frappe.get_doc("SaaS Customer", usage_doc.customer)
-		
 		subject = f"Usage Alert: {percentage}% of monthly quota used"
 		if percentage >= 100:
 			subject = "Monthly Quota Exceeded - Action Required"
 			
-		frappe.sendmail(
-			recipients=[customer.email],
-			subject=subject,
+		queue_notification(
+			usage_doc.customer,
 			template="usage_alert",
+			subject=subject,
+			dedupe_key=f"usage_alert:{percentage}",
 			args={
-				"customer_name": customer.customer_name,
 				"current_usage": usage_doc.current_usage,
 				"usage_limit": usage_doc.usage_limit,
 				"percentage": percentage,
@@ -57,10 +59,10 @@ def _send_usage_alert(usage_doc, percentage):
 			}
 		)
 		
-		frappe.logger().info(f"Sent {percentage}% usage alert to {customer.email}")
+		frappe.logger().info(f"Queued {percentage}% usage alert for {usage_doc.customer}")
 		
 	except Exception as e:
-		frappe.log_error(f"Error sending usage alert: {str(e)}", "Usage API")
+		frappe.log_error(f"Error queueing usage alert: {str(e)}", "Usage API")
 
 
 @frappe.whitelist()
@@ -69,19 +71,22 @@ def get_usage_stats(customer_name, period="current_month"):
 	API endpoint to get usage statistics
 	"""
 	try:
-		customer = frappe.get_doc("SaaS Customer", customer_name)
-		
 		# Check permissions
-		if frappe.session.user != customer.email and not frappe.has_permission("SaaS Customer", "read", customer_name):
+		if not can_access_customer(customer_name, "SaaS Customer", "read", customer_name):
 			frappe.throw("Not permitted")
 		
 		if period == "current_month":
-			return {
-				"current_usage": customer.current_usage or 0,
-				"usage_limit": customer.usage_limit or 0,
-				"usage_percentage": (customer.current_usage / customer.usage_limit * 100) if customer.usage_limit else 0,
-				"remaining_quota": max(0, (customer.usage_limit or 0) - (customer.current_usage or 0))
-			}
+			def build():
+				customer = frappe.db.get_value("SaaS Customer", customer_name, ["name", "usage_limit"], as_dict=True)
+				current_usage = quota.get_usage(customer.name)
+				return {
+					"current_usage": current_usage,
+					"usage_limit": customer.usage_limit or 0,
+					"usage_percentage": (current_usage / customer.usage_limit * 100) if customer.usage_limit else 0,
+					"remaining_quota": max(0, (customer.usage_limit or 0) - current_usage)
+				}
+			
+			return conditional_get(customer_name, "usage_stats", build, period)
 		
 		# Add more period options as needed
 		
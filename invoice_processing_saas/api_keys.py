@@ -0,0 +1,140 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# API key lookup for the auth hooks. The key itself is an encrypted Password
+# field and cannot be queried, so each customer also stores the key's first
+# characters in an indexed prefix column and an HMAC of the key. A lookup
+# fetches the customers with the key's prefix and compares hashes in
+# constant time. Resolved keys are kept in a bounded LRU in each worker
+# process, so steady-state API key auth costs no queries. The LRU is
+# invalidated through worker_cache when a key is rotated or its customer's
+# status or email changes. Callers that hold a customer's webhook secret
+# instead sign the request body with it (verify_webhook_signature).
+
+import hashlib
+import hmac
+import threading
+from collections import OrderedDict
+
+import frappe
+from frappe.utils.password import get_decrypted_password, get_encryption_key
+
+from invoice_processing_saas import worker_cache
+
+API_KEY_CHANNEL = "invoice_processing_saas:api_keys_invalidated"
+API_KEY_PREFIX_LENGTH = 8
+API_KEY_CACHE_SIZE = 1024
+WEBHOOK_SIGNATURE_PREFIX = "sha256="
+
+ACTIVE_STATUSES = ("Active", "Trial")
+
+_lru = OrderedDict()  # (site, key hash) -> identity
+_lru_lock = threading.Lock()
+
+
+def hash_api_key(api_key):
+	"""Get the keyed hash stored for an API key"""
+	return hmac.new(get_encryption_key().encode(), api_key.encode(), hashlib.sha256).hexdigest()
+
+
+def get_api_key_prefix(api_key):
+	"""Get the indexed lookup prefix of an API key"""
+	return api_key[:API_KEY_PREFIX_LENGTH]
+
+
+def resolve_api_key(api_key):
+	"""Get the customer, email and subscription_status an API key belongs to, or None"""
+	if not api_key:
+		return None
+
+	worker_cache.ensure_listener()
+
+	key_hash = hash_api_key(api_key)
+	cache_key = (frappe.local.site, key_hash)
+
+	with _lru_lock:
+		identity = _lru.get(cache_key)
+		if identity is not None:
+			_lru.move_to_end(cache_key)
+			return identity
+
+	identity = None
+	for row in frappe.get_all("SaaS Customer",
+		filters={"api_key_prefix": get_api_key_prefix(api_key)},
+		fields=["name", "email", "subscription_status", "api_key_hash"]):
+		if row.api_key_hash and hmac.compare_digest(row.api_key_hash, key_hash):
+			identity = frappe._dict(customer=row.name, email=row.email,
+				subscription_status=row.subscription_status)
+			break
+
+	# Unknown keys are not cached, so a newly issued key works at once
+	if identity is not None:
+		with _lru_lock:
+			_lru[cache_key] = identity
+			_lru.move_to_end(cache_key)
+			while len(_lru) > API_KEY_CACHE_SIZE:
+				_lru.popitem(last=False)
+
+	return identity
+
+
+def get_active_customer(api_key):
+	"""Get the identity of an API key whose customer has an active subscription, or None"""
+	identity = resolve_api_key(api_key)
+	if identity and identity.subscription_status in ACTIVE_STATUSES:
+		return identity
+	return None
+
+
+def verify_webhook_signature(customer, body, signature):
+	"""
+	Check a "sha256=<hex>" HMAC of the raw request body made with a customer's webhook secret
+	Returns False for unknown customers and customers without a secret
+	"""
+	if not customer or not signature or not signature.startswith(WEBHOOK_SIGNATURE_PREFIX):
+		return False
+
+	secret = get_decrypted_password("SaaS Customer", customer, "webhook_secret", raise_exception=False)
+	if not secret:
+		return False
+
+	expected = hmac.new(secret.encode(), body or b"", hashlib.sha256).hexdigest()
+	return hmac.compare_digest(expected, signature[len(WEBHOOK_SIGNATURE_PREFIX):])
+
+
+def invalidate_api_key_cache(doc, method=None):
+	"""
+	Doc event handler for SaaS Customer that drops cached lookups of its key
+	in every process when the key, status or email changes
+	"""
+	hashes = {doc.api_key_hash}
+
+	previous = doc.get_doc_before_save()
+	if previous:
+		if method != "on_trash" and not any(doc.has_value_changed(field)
+			for field in ("api_key_hash", "subscription_status", "email")):
+			return
+		hashes.add(previous.api_key_hash)
+
+	hashes = sorted(filter(None, hashes))
+	if hashes:
+		_drop_hashes(frappe.local.site, hashes)
+		worker_cache.publish(API_KEY_CHANNEL, hashes)
+
+
+def _drop_hashes(site, hashes):
+	with _lru_lock:
+		for key_hash in hashes:
+			_lru.pop((site, key_hash), None)
+
+
+def _on_invalidation(site, hashes):
+	if site is None:
+		# The listener failed, so forget every key
+		with _lru_lock:
+			_lru.clear()
+	else:
+		_drop_hashes(site, hashes or [])
+
+
+worker_cache.register(API_KEY_CHANNEL, _on_invalidation)
@@ -3,6 +3,9 @@
 
 import frappe
 
+from invoice_processing_saas.api_keys import get_active_customer
+from invoice_processing_saas.identity import get_session_customer_name
+
 
 def validate_auth_via_api_keys(api_key=None):
 	"""
@@ -16,13 +19,11 @@ def validate_auth_via_api_keys(api_key=None):
 			return False
 			
 		# Check if API key exists and is valid
-		customer = frappe.db.get_value("SaaS Customer", 
-			{"api_key": api_key, "subscription_status": ["in", ["Active", "Trial"]]}, 
-			["name", "email"])
+		customer = get_active_customer(api_key)
 			
 		if customer:
 			# Set user session for API requests
-			frappe.set_user(customer[1])
+			frappe.set_user(customer.email)
 			return True
 			
 		return False
@@ -37,11 +38,7 @@ def get_current_user_customer():
 	Get the current user's customer record
 	"""
 	try:
-		if frappe.session.user and frappe.session.user != "Guest":
-			customer = frappe.db.get_value("SaaS Customer", 
-				{"email": frappe.session.user}, "name")
-			return customer
-		return None
+		return get_session_customer_name()
 	except Exception as e:
 		frappe.log_error(f"Error getting current user customer: {str(e)}", "Auth")
 		return None
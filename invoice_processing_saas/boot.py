@@ -3,6 +3,8 @@
 
 import frappe
 
+from invoice_processing_saas.identity import get_session_customer
+
 
 def boot_session(bootinfo):
 	"""
@@ -12,16 +14,14 @@ def boot_session(bootinfo):
 	try:
 		if frappe.session.user and frappe.session.user != "Guest":
 			# Check if user is a SaaS customer
-			customer = frappe.db.get_value("SaaS Customer", 
-				{"email": frappe.session.user}, 
-				["name", "customer_name", "subscription_status", "subscription_plan"])
+			customer = get_session_customer()
 				
 			if customer:
 				bootinfo.saas_customer = {
-					"name": customer[0],
-					"customer_name": customer[1], 
-					"subscription_status": customer[2],
-					"subscription_plan": customer[3],
+					"name": customer.name,
+					"customer_name": customer.customer_name, 
+					"subscription_status": customer.subscription_status,
+					"subscription_plan": customer.subscription_plan,
 					"is_saas_customer": True
 				}
 			else:
@@ -0,0 +1,70 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("verify-hot-path-indexes")
+@pass_context
+def verify_hot_path_indexes(context):
+	"""Check with EXPLAIN that hot path queries use their indexes"""
+	from invoice_processing_saas.indexes import verify_hot_path_indexes
+
+	frappe.init(site=get_site(context))
+	frappe.connect()
+	try:
+		results = verify_hot_path_indexes()
+	finally:
+		frappe.destroy()
+
+	for result in results:
+		status = "OK" if result["ok"] else "UNUSED" if result["possible"] else "MISSING"
+		click.echo(f"{status:8} {result['path']}: expected {result['index']}, used {result['used']}")
+
+	if not all(result["ok"] for result in results):
+		raise click.ClickException("Some hot path queries do not use their indexes "
+			"(UNUSED: the index exists but the optimizer chose another plan)")
+
+
+@click.command("rebuild-job-rollups")
+@click.option("--customer", help="Only rebuild this SaaS Customer's rollups")
+@pass_context
+def rebuild_job_rollups(context, customer=None):
+	"""Regenerate the daily job rollups from Processing Job history"""
+	from invoice_processing_saas.job_rollup import rebuild_rollups
+
+	frappe.init(site=get_site(context))
+	frappe.connect()
+	try:
+		rebuild_rollups(customer)
+	finally:
+		frappe.destroy()
+
+	click.echo("Job rollups rebuilt")
+
+
+@click.command("check-import-time")
+@click.option("--budget-ms", type=float, help="Fail above this many milliseconds of cold import time")
+@click.option("--runs", type=int, default=3, help="Measure this many times and keep the fastest")
+@click.option("--top", type=int, default=10, help="Show this many of the slowest modules")
+def check_import_time(budget_ms=None, runs=3, top=10):
+	"""Measure the app's cold import time with python -X importtime and check it against the budget"""
+	from invoice_processing_saas.import_time import IMPORT_TIME_BUDGET_MS, measure_import_time
+
+	budget_ms = budget_ms or IMPORT_TIME_BUDGET_MS
+	try:
+		result = measure_import_time(runs)
+	except RuntimeError as e:
+		raise click.ClickException(str(e))
+
+	for module, self_ms, cumulative_ms in result["modules"][:top]:
+		click.echo(f"{self_ms:9.1f} ms self {cumulative_ms:9.1f} ms cumulative  {module}")
+	click.echo(f"Cold import time {result['total_ms']:.1f} ms, budget {budget_ms:.1f} ms")
+
+	if result["total_ms"] > budget_ms:
+		raise click.ClickException("App import time is over budget")
+
+
+commands = [verify_hot_path_indexes, rebuild_job_rollups, check_import_time]
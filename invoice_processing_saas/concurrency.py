@@ -0,0 +1,150 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Per-customer processing slots enforcing the plan's concurrent_processing.
+# Each customer has a sorted set in Redis of the jobs holding a slot, scored
+# by when their lease expires. A job takes a slot when it moves to
+# Processing and gives it back when it completes, fails or goes to retry;
+# a job that never reports back loses its slot once the lease expires, so
+# a stuck workflow cannot hold a customer's capacity forever. Slots are
+# taken by a Lua script so concurrent workers cannot exceed the limit. The
+# dispatcher only hands out jobs that get a slot (acquire); a job reported
+# as Processing is already running, so start gives it a slot even over the
+# limit, whether the status changes through job_state or a document save.
+
+import time
+
+import frappe
+from frappe.utils import cint
+
+from invoice_processing_saas.plan_catalog import get_plan
+
+PROCESSING_LEASE_TTL = 30 * 60  # seconds
+DEFAULT_CONCURRENT_PROCESSING = 1
+
+# KEYS: slots zset
+# ARGV: now, lease expiry, job name, limit
+# Returns 2 when the job already held a slot (lease renewed), 1 when it took one, 0 when none is free
+ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local result = 1
+if redis.call('ZSCORE', KEYS[1], ARGV[3]) then
+	result = 2
+elseif redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then
+	return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2]) - tonumber(ARGV[1])))
+return result
+"""
+
+_scripts = {}
+
+
+def acquire(customer, job_name, limit=None):
+	"""
+	Take a processing slot for a job, or renew its lease if it already has one
+	Returns True if the job holds a slot; the slot is given back if the transaction rolls back
+	"""
+	if limit is None:
+		limit = get_concurrency_limit(customer)
+	if limit <= 0:
+		return True
+
+	return bool(_acquire(customer, job_name, limit))
+
+
+def start(customer, job_name, limit=None):
+	"""
+	Give a job that has started processing a slot, occupying one over the limit if none is free
+	Returns True if this call took the slot, False if the job already held one
+	"""
+	if limit is None:
+		limit = get_concurrency_limit(customer)
+	if limit <= 0:
+		return False
+
+	result = _acquire(customer, job_name, limit)
+	if result == 0:
+		# n8n is already working on the file; sending it back to the queue would process it twice
+		frappe.logger().info(f"Job {job_name} started over {customer}'s concurrency limit")
+		occupy(customer, job_name)
+
+	return result != 2
+
+
+def occupy(customer, job_name):
+	"""
+	Give a job a processing slot even if the customer is at the limit
+	For jobs that are already running elsewhere; the customer gets no new slots until it is back under
+	"""
+	key = _slots_key(customer)
+	pipeline = frappe.cache().pipeline()
+	pipeline.zadd(key, {job_name: time.time() + PROCESSING_LEASE_TTL})
+	pipeline.expire(key, PROCESSING_LEASE_TTL)
+	pipeline.execute()
+
+	frappe.db.after_rollback.add(lambda: release(customer, job_name))
+
+
+def _acquire(customer, job_name, limit):
+	"""Run the acquire script; returns its result and gives a newly taken slot back on rollback"""
+	current_time = time.time()
+	result = _run_acquire([_slots_key(customer)],
+		[current_time, current_time + PROCESSING_LEASE_TTL, job_name, limit])
+
+	if result == 1:
+		frappe.db.after_rollback.add(lambda: release(customer, job_name))
+
+	return result
+
+
+def release(customer, job_name):
+	"""Give back a job's processing slot"""
+	frappe.cache().execute_command("ZREM", _slots_key(customer), job_name)
+
+
+def release_after_commit(customer, job_name):
+	"""Give back a job's processing slot once the current transaction commits"""
+	frappe.db.after_commit.add(lambda: release(customer, job_name))
+
+
+def get_active_jobs(customer):
+	"""Get the names of the jobs holding a customer's processing slots"""
+	jobs = frappe.cache().execute_command("ZRANGEBYSCORE", _slots_key(customer), time.time(), "+inf")
+	return [frappe.safe_decode(job) for job in jobs or []]
+
+
+def get_free_slots(customer, limit=None):
+	"""Get how many more of a customer's jobs can start processing, or None if unlimited"""
+	if limit is None:
+		limit = get_concurrency_limit(customer)
+	if limit <= 0:
+		return None
+
+	return max(0, limit - len(get_active_jobs(customer)))
+
+
+def get_concurrency_limit(customer, plan_name=None):
+	"""Get how many jobs a customer may have processing at once; 0 means no limit"""
+	if plan_name is None:
+		plan_name = frappe.db.get_value("SaaS Customer", customer, "subscription_plan")
+	if not plan_name:
+		return DEFAULT_CONCURRENT_PROCESSING
+
+	try:
+		return cint(get_plan(plan_name).concurrent_processing)
+	except frappe.DoesNotExistError:
+		return DEFAULT_CONCURRENT_PROCESSING
+
+
+def _run_acquire(keys, args):
+	"""Run the acquire script, registering it once per process"""
+	if "acquire" not in _scripts:
+		_scripts["acquire"] = frappe.cache().register_script(ACQUIRE_SCRIPT)
+
+	return cint(_scripts["acquire"](keys=keys, args=args, client=frappe.cache()))
+
+
+def _slots_key(customer):
+	return frappe.cache().make_key(f"invoice_processing_saas:concurrency:{customer}")
@@ -0,0 +1,33 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Bulk access to integration credentials. Password fields are stored
+# encrypted in the __Auth table, and get_decrypted_password reads one value
+# per query; background sweeps over thousands of integrations read them
+# for a whole batch with one query instead.
+
+import frappe
+from frappe.utils.password import decrypt
+
+
+def get_decrypted_passwords(doctype, names, fieldnames):
+	"""Get {name: {fieldname: value}} for the Password fields of a batch of documents"""
+	if not names:
+		return {}
+
+	rows = frappe.db.sql("""
+		SELECT `name`, `fieldname`, `password`
+		FROM `__Auth`
+		WHERE `doctype` = %(doctype)s AND `name` IN %(names)s AND `fieldname` IN %(fieldnames)s
+			AND `encrypted` = 1
+	""", {"doctype": doctype, "names": tuple(names), "fieldnames": tuple(fieldnames)}, as_dict=True)
+
+	passwords = {name: dict.fromkeys(fieldnames) for name in names}
+	for row in rows:
+		try:
+			passwords[row.name][row.fieldname] = decrypt(row.password)
+		except Exception:
+			# Encrypted with a different key; treat as missing
+			pass
+
+	return passwords
@@ -0,0 +1,314 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Weighted fair dispatching of queued Processing Jobs to n8n. Jobs waiting
+# for dispatch are Queued or Retry with no dispatched_at. Each run finds the
+# customers with waiting jobs and shares the run's budget between them by
+# stride scheduling: every customer has a virtual time in Redis that grows
+# by 1 / dispatch_weight for each job dispatched, and the customer with the
+# lowest virtual time goes next. Customers that were idle rejoin at the
+# lowest virtual time of the others, so a large backlog from one customer
+# cannot push everyone else's jobs behind it. A job is only dispatched if it
+# can take one of its customer's processing slots. Within a customer the
+# smallest files go first. Jobs are claimed, committed and then posted to
+# n8n in batches through http_client; a failed batch is released for the
+# next run. Each dispatch carries a lease (dispatch_lease_expires); a job
+# that n8n accepted but never moved to Processing, or that was claimed by a
+# worker that died before posting it, is released once its lease lapses so
+# it is dispatched again. Jobs n8n created itself have no lease and are
+# never released, since n8n is already working on their files.
+
+import heapq
+
+import frappe
+from frappe.utils import add_to_date, cint, now_datetime
+from redis.exceptions import LockError
+
+from invoice_processing_saas import concurrency, http_client
+from invoice_processing_saas.plan_catalog import get_plan
+
+DISPATCH_MAX_PER_RUN = 500
+DISPATCH_BATCH_SIZE = 50
+DISPATCH_LOCK_TIMEOUT = 5 * 60  # seconds
+VIRTUAL_TIME_TTL = 24 * 60 * 60  # seconds
+
+PENDING_STATUSES = ("Queued", "Retry")
+
+# Fields of each job posted to n8n
+DISPATCH_FIELDS = ["name", "job_id", "customer", "file_id", "file_name", "file_url", "file_size",
+	"file_type", "extraction_engine", "processing_status", "retry_count"]
+
+
+def dispatch_pending_jobs():
+	"""Dispatch waiting jobs to n8n; only one run at a time per site"""
+	cache = frappe.cache()
+	lock = cache.lock(cache.make_key("invoice_processing_saas:dispatcher:lock"), timeout=DISPATCH_LOCK_TIMEOUT)
+	if not lock.acquire(blocking=False):
+		return 0
+
+	try:
+		return _dispatch_pending_jobs()
+	finally:
+		try:
+			lock.release()
+		except LockError:
+			pass
+
+
+def _dispatch_pending_jobs():
+	release_stale_dispatches()
+
+	webhook_url = _get_dispatch_webhook_url()
+	if not webhook_url:
+		frappe.logger().info("n8n webhook base URL is not set; skipping job dispatch")
+		return 0
+
+	backlog = get_backlog()
+	if not backlog:
+		return 0
+
+	customers = _get_dispatch_customers(backlog)
+	order = schedule(customers, DISPATCH_MAX_PER_RUN)
+
+	jobs = _claim_jobs(order, customers)
+	dispatched = 0
+	for start in range(0, len(jobs), DISPATCH_BATCH_SIZE):
+		batch = jobs[start:start + DISPATCH_BATCH_SIZE]
+		if not _post_batch(webhook_url, batch):
+			# n8n is unreachable; release this batch and everything after it
+			_release_jobs(jobs[start:])
+			break
+		dispatched += len(batch)
+
+	return dispatched
+
+
+def release_stale_dispatches():
+	"""Return jobs whose dispatch lease lapsed before n8n started them to the waiting pool"""
+	stale = frappe.db.sql("""
+		SELECT name, customer
+		FROM `tabProcessing Job`
+		WHERE dispatch_lease_expires < %(now)s AND processing_status IN %(statuses)s
+	""", {"now": now_datetime(), "statuses": PENDING_STATUSES}, as_dict=True)
+
+	if stale:
+		frappe.logger().info(f"Releasing {len(stale)} jobs that were dispatched but never started")
+		_release_jobs(stale)
+
+	return len(stale)
+
+
+def get_backlog():
+	"""Get the number of jobs waiting for dispatch per customer"""
+	rows = frappe.db.sql("""
+		SELECT customer, COUNT(*) AS pending
+		FROM `tabProcessing Job`
+		WHERE dispatched_at IS NULL AND processing_status IN %(statuses)s AND customer IS NOT NULL
+		GROUP BY customer
+	""", {"statuses": PENDING_STATUSES}, as_dict=True)
+
+	return {row.customer: row.pending for row in rows}
+
+
+def schedule(customers, budget):
+	"""
+	Order up to budget dispatches between customers by their weights
+	customers maps a customer to a dict with weight and capacity
+	Returns the customers in dispatch order, one entry per job
+	"""
+	vtimes = _get_virtual_times(list(customers))
+
+	# Idle customers rejoin at the lowest virtual time of the others
+	known = [vtime for vtime in vtimes.values() if vtime is not None]
+	floor = min(known) if known else 0.0
+
+	heap = []
+	for customer, info in customers.items():
+		if info.capacity > 0:
+			vtime = vtimes.get(customer)
+			heapq.heappush(heap, (floor if vtime is None else max(vtime, floor), customer))
+
+	remaining = {customer: info.capacity for customer, info in customers.items()}
+	order = []
+	final_vtimes = {}
+
+	while heap and len(order) < budget:
+		vtime, customer = heapq.heappop(heap)
+		order.append(customer)
+		remaining[customer] -= 1
+
+		vtime += 1.0 / customers[customer].weight
+		final_vtimes[customer] = vtime
+		if remaining[customer] > 0:
+			heapq.heappush(heap, (vtime, customer))
+
+	_set_virtual_times(final_vtimes)
+	return order
+
+
+def _get_dispatch_customers(backlog):
+	"""Get the weight and dispatch capacity of each customer with waiting jobs"""
+	plans = dict(frappe.get_all("SaaS Customer",
+		filters={"name": ["in", list(backlog)]},
+		fields=["name", "subscription_plan"],
+		as_list=True))
+
+	customers = {}
+	for customer, pending in backlog.items():
+		plan = _get_plan_or_none(plans.get(customer))
+		limit = cint(plan.concurrent_processing) if plan else concurrency.DEFAULT_CONCURRENT_PROCESSING
+		free_slots = concurrency.get_free_slots(customer, limit)
+
+		customers[customer] = frappe._dict({
+			"weight": _get_dispatch_weight(plan),
+			"limit": limit,
+			"capacity": pending if free_slots is None else min(pending, free_slots)
+		})
+
+	return customers
+
+
+def _get_dispatch_weight(plan):
+	"""A plan without a dispatch weight gets one per concurrent processing slot"""
+	if not plan:
+		return 1
+	return max(1, cint(plan.dispatch_weight) or cint(plan.concurrent_processing))
+
+
+def _claim_jobs(order, customers):
+	"""
+	Take a processing slot for the next smallest jobs of each customer in dispatch
+	order and mark them dispatched
+	"""
+	counts = {}
+	for customer in order:
+		counts[customer] = counts.get(customer, 0) + 1
+
+	candidates = {customer: _get_waiting_jobs(customer, count) for customer, count in counts.items()}
+
+	jobs = []
+	for customer in order:
+		waiting = candidates[customer]
+		while waiting:
+			job = waiting.pop(0)
+			if concurrency.acquire(customer, job.name, customers[customer].limit):
+				jobs.append(job)
+				break
+			# The customer's slots filled up since the run started
+			waiting.clear()
+
+	if jobs:
+		current_time = now_datetime()
+		frappe.db.sql("""
+			UPDATE `tabProcessing Job`
+			SET dispatched_at = %(now)s, dispatch_lease_expires = %(lease_expires)s
+			WHERE name IN %(names)s AND dispatched_at IS NULL
+		""", {
+			"now": current_time,
+			"lease_expires": add_to_date(current_time, seconds=concurrency.PROCESSING_LEASE_TTL),
+			"names": [job.name for job in jobs]
+		})
+		frappe.db.commit()
+
+	return jobs
+
+
+def _get_waiting_jobs(customer, limit):
+	"""Get a customer's jobs waiting for dispatch, smallest files first"""
+	return frappe.db.sql(f"""
+		SELECT {", ".join(f"`{field}`" for field in DISPATCH_FIELDS)}
+		FROM `tabProcessing Job`
+		WHERE dispatched_at IS NULL AND customer = %(customer)s AND processing_status IN %(statuses)s
+		ORDER BY file_size ASC, creation ASC
+		LIMIT %(limit)s
+	""", {"customer": customer, "statuses": PENDING_STATUSES, "limit": limit}, as_dict=True)
+
+
+def _post_batch(webhook_url, batch):
+	"""Post a batch of jobs to n8n; returns whether n8n accepted it"""
+	payload = {"jobs": [{
+		"job_id": job.job_id,
+		"job_name": job.name,
+		"customer_id": job.customer,
+		"file_id": job.file_id,
+		"file_name": job.file_name,
+		"file_url": job.file_url,
+		"file_size": job.file_size,
+		"file_type": job.file_type,
+		"extraction_engine": job.extraction_engine,
+		"processing_status": job.processing_status,
+		"retry_count": job.retry_count
+	} for job in batch]}
+
+	try:
+		# Fails fast with CircuitOpenError while n8n is down
+		response = http_client.post("n8n", webhook_url, json=payload)
+		if response.status_code >= 300:
+			frappe.log_error(f"n8n rejected dispatch batch: {response.status_code} {response.text[:500]}",
+				"Job Dispatcher")
+			return False
+		return True
+
+	except http_client.CircuitOpenError:
+		# n8n has been failing; the next run tries again once the circuit lets it
+		return False
+
+	except Exception as e:
+		frappe.log_error(f"Error posting dispatch batch to n8n: {str(e)}", "Job Dispatcher")
+		return False
+
+
+def _release_jobs(jobs):
+	"""Return jobs to the waiting pool and give back their processing slots"""
+	# Only jobs that have not started since; a started job keeps its dispatch and its slot
+	values = {"names": [job.name for job in jobs], "statuses": PENDING_STATUSES}
+	released = set(frappe.db.sql("""
+		SELECT name FROM `tabProcessing Job`
+		WHERE name IN %(names)s AND processing_status IN %(statuses)s
+		FOR UPDATE
+	""", values, pluck=True))
+	if released:
+		frappe.db.sql("""
+			UPDATE `tabProcessing Job`
+			SET dispatched_at = NULL, dispatch_lease_expires = NULL
+			WHERE name IN %(names)s
+		""", {"names": list(released)})
+	frappe.db.commit()
+
+	for job in jobs:
+		if job.name in released:
+			concurrency.release(job.customer, job.name)
+
+
+def _get_plan_or_none(plan_name):
+	if not plan_name:
+		return None
+	try:
+		return get_plan(plan_name)
+	except frappe.DoesNotExistError:
+		return None
+
+
+def _get_dispatch_webhook_url():
+	base_url = frappe.db.get_single_value("Invoice Processing Settings", "n8n_webhook_base_url")
+	return f"{base_url}/webhook/dispatch-jobs" if base_url else None
+
+
+def _get_virtual_times(customers):
+	values = frappe.cache().execute_command("HMGET", _virtual_times_key(), *customers)
+	return {customer: float(value) if value is not None else None for customer, value in zip(customers, values)}
+
+
+def _set_virtual_times(vtimes):
+	if not vtimes:
+		return
+
+	key = _virtual_times_key()
+	pipeline = frappe.cache().pipeline()
+	pipeline.hset(key, mapping={customer: repr(vtime) for customer, vtime in vtimes.items()})
+	pipeline.expire(key, VIRTUAL_TIME_TTL)
+	pipeline.execute()
+
+
+def _virtual_times_key():
+	return frappe.cache().make_key("invoice_processing_saas:dispatcher:virtual_times")
@@ -0,0 +1,181 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Append-only log of per-stage processing events sent by n8n. Events are
+# buffered in a Redis list and written to a plain table with multi-row
+# inserts, so logging an event costs one RPUSH instead of a document insert.
+# The table is not a doctype: it has no naming, hooks or versions, only the
+# columns and indexes the job timeline needs. Old months are pruned monthly.
+
+import json
+
+import frappe
+from frappe.utils import now, get_first_day, add_months, cint
+
+EVENT_LOG_TABLE = "__processing_event_log"
+FLUSH_BATCH_SIZE = 500
+FLUSH_THRESHOLD = 1000  # buffered events that trigger an early flush
+RETENTION_MONTHS = 3
+PRUNE_CHUNK_SIZE = 10000
+EVENT_TYPE_LENGTH = 20
+
+
+def create_event_log_table():
+	"""Create the event log table if it does not exist"""
+	frappe.db.sql_ddl(f"""
+		CREATE TABLE IF NOT EXISTS `{EVENT_LOG_TABLE}` (
+			`id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+			`job_id` VARCHAR(140) NOT NULL,
+			`customer` VARCHAR(140),
+			`event_type` VARCHAR({EVENT_TYPE_LENGTH}) NOT NULL DEFAULT 'info',
+			`message` TEXT,
+			`event_data` LONGTEXT,
+			`timestamp` DATETIME(6) NOT NULL,
+			PRIMARY KEY (`id`),
+			KEY `job_id_timestamp` (`job_id`, `timestamp`),
+			KEY `timestamp` (`timestamp`)
+		) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+	""")
+
+
+def log_event(job_id, customer=None, event_type="info", message=None, event_data=None):
+	"""
+	Buffer a processing event
+	The event is timestamped now and written to the table by the next flush
+	"""
+	event = {
+		"job_id": job_id,
+		"customer": customer,
+		"event_type": (event_type or "info")[:EVENT_TYPE_LENGTH],
+		"message": message,
+		"event_data": _dump_event_data(event_data),
+		"timestamp": now()
+	}
+
+	try:
+		buffered = _redis("RPUSH", _buffer_key(), json.dumps(event))
+	except Exception:
+		# Redis unavailable: write through so the event is not lost
+		_insert_events([event])
+		return
+
+	if buffered >= FLUSH_THRESHOLD:
+		frappe.enqueue(
+			"invoice_processing_saas.event_log.flush_event_log",
+			queue="short",
+			job_id="invoice_processing_saas:flush_event_log",
+			deduplicate=True
+		)
+
+
+def flush_event_log(batch_size=FLUSH_BATCH_SIZE):
+	"""Write buffered events to the table in batches until the buffer is empty"""
+	while True:
+		events = _take_events(batch_size)
+		if not events:
+			break
+
+		try:
+			_insert_events(events)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			# Put the batch back at the head of the buffer for the next run
+			_redis("LPUSH", _buffer_key(), *[json.dumps(event) for event in reversed(events)])
+			raise
+
+		if len(events) < batch_size:
+			break
+
+
+def get_job_timeline(job_id, limit=500):
+	"""Get a job's events in the order they happened, including buffered ones"""
+	events = frappe.db.sql(f"""
+		SELECT event_type, message, event_data, timestamp
+		FROM `{EVENT_LOG_TABLE}`
+		WHERE job_id = %s
+		ORDER BY timestamp, id
+		LIMIT %s
+	""", (job_id, cint(limit)), as_dict=True)
+
+	for event in _get_buffered_events():
+		if event.get("job_id") == job_id:
+			events.append(frappe._dict(event))
+
+	events = sorted(events, key=lambda event: str(event.timestamp))[:cint(limit)]
+
+	return [{
+		"event_type": event.event_type,
+		"message": event.message,
+		"event_data": _load_event_data(event.event_data),
+		"timestamp": str(event.timestamp)
+	} for event in events]
+
+
+def prune_event_log(months=RETENTION_MONTHS):
+	"""Delete events from months older than the retention period"""
+	cutoff = get_first_day(add_months(now(), -months))
+
+	while True:
+		frappe.db.sql(f"""
+			DELETE FROM `{EVENT_LOG_TABLE}`
+			WHERE timestamp < %s
+			LIMIT {PRUNE_CHUNK_SIZE}
+		""", cutoff)
+		deleted = frappe.db._cursor.rowcount
+		frappe.db.commit()
+
+		if deleted < PRUNE_CHUNK_SIZE:
+			break
+
+
+def _take_events(count):
+	"""Atomically remove up to count events from the head of the buffer"""
+	pipe = frappe.cache().pipeline()
+	pipe.lrange(_buffer_key(), 0, count - 1)
+	pipe.ltrim(_buffer_key(), count, -1)
+	events, _ = pipe.execute()
+
+	return [json.loads(event) for event in events]
+
+
+def _get_buffered_events():
+	return [json.loads(event) for event in _redis("LRANGE", _buffer_key(), 0, -1)]
+
+
+def _insert_events(events):
+	"""Write events with a single multi-row insert"""
+	columns = ("job_id", "customer", "event_type", "message", "event_data", "timestamp")
+	placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(events))
+	values = [event.get(column) for event in events for column in columns]
+
+	frappe.db.sql(f"""
+		INSERT INTO `{EVENT_LOG_TABLE}` (`job_id`, `customer`, `event_type`, `message`, `event_data`, `timestamp`)
+		VALUES {placeholders}
+	""", values)
+
+
+def _dump_event_data(event_data):
+	if not event_data:
+		return None
+	if isinstance(event_data, str):
+		return event_data
+	return json.dumps(event_data, default=str)
+
+
+def _load_event_data(event_data):
+	if not event_data:
+		return None
+	try:
+		return json.loads(event_data)
+	except ValueError:
+		return event_data
+
+
+def _redis(*args):
+	"""Run a raw Redis command on the cache connection (see quota._redis)"""
+	return frappe.cache().execute_command(*args)
+
+
+def _buffer_key():
+	return frappe.cache().make_key("invoice_processing_saas:event_log:buffer")
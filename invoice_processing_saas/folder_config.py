@@ -0,0 +1,195 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Cached resolution of Google Drive folder IDs to n8n user configuration.
+# The configuration n8n needs for a folder (customer, plan, integrations)
+# rarely changes between files, so it is built once and kept in Redis until
+# one of the documents it was built from changes. Usage counters change with
+# every job and are read from the quota counters instead of being cached.
+
+import frappe
+from redis.exceptions import LockError
+
+from invoice_processing_saas import plan_catalog, quota
+
+FOLDER_CONFIG_TTL = 600  # seconds
+LOAD_LOCK_TIMEOUT = 10  # seconds
+
+# SaaS Customer fields that end up in the cached payload
+CUSTOMER_CONFIG_FIELDS = (
+	"customer_name", "email", "subscription_status", "subscription_plan",
+	"usage_limit", "overage_allowed", "api_key", "webhook_secret"
+)
+
+
+def get_folder_config(folder_id):
+	"""
+	Get the n8n user configuration for a folder
+	Concurrent misses for the same folder are collapsed into a single load
+	"""
+	if not folder_id:
+		return {"user_found": False, "error": "folder_id is required"}
+
+	cache = frappe.cache()
+	key = _cache_key(folder_id)
+
+	config = cache.get_value(key)
+	if config is None:
+		lock = cache.lock(cache.make_key(f"{key}:lock"),
+			timeout=LOAD_LOCK_TIMEOUT, blocking_timeout=LOAD_LOCK_TIMEOUT)
+		acquired = lock.acquire()
+
+		try:
+			# Another worker may have loaded it while we waited for the lock
+			config = cache.get_value(key) if acquired else None
+			if config is None:
+				config = build_folder_config(folder_id)
+				if acquired:
+					cache.set_value(key, config, expires_in_sec=FOLDER_CONFIG_TTL)
+		finally:
+			if acquired:
+				try:
+					lock.release()
+				except LockError:
+					pass
+
+	return _with_current_usage(config)
+
+
+def build_folder_config(folder_id):
+	"""Build the cacheable part of the n8n user configuration from the database"""
+	# Find customer by drive folder ID
+	drive_integration = frappe.db.get_value("Drive Integration",
+		{"drive_folder_id": folder_id},
+		["customer", "integration_status", "setup_completed"])
+
+	if not drive_integration:
+		return {"user_found": False, "error": "No customer found for this folder"}
+
+	customer_name = drive_integration[0]
+	integration_status = drive_integration[1]
+	setup_completed = drive_integration[2]
+
+	# Get customer details
+	customer = frappe.get_doc("SaaS Customer", customer_name)
+
+	# Check if customer is active
+	if customer.subscription_status not in ["Active", "Trial"]:
+		return {
+			"user_found": False,
+			"error": f"Customer subscription is {customer.subscription_status}"
+		}
+
+	# Check if integration is ready
+	if integration_status != "Active" or not setup_completed:
+		return {
+			"user_found": False,
+			"error": "Drive integration not properly configured"
+		}
+
+	# Get accounting integration
+	accounting_integration = frappe.db.get_value("Accounting Integration",
+		{"customer": customer_name},
+		["accounting_system", "integration_status"])
+
+	# Determine preferred engine based on customer plan and complexity
+	preferred_engine = "azure"  # Default to Azure for efficiency
+
+	# Check if customer has premium plan (may prefer OpenAI)
+	if customer.subscription_plan:
+		plan = plan_catalog.get_plan(customer.subscription_plan)
+		if plan.plan_code in ["pro", "enterprise"]:
+			preferred_engine = "openai"
+
+	return {
+		"user_found": True,
+		"customer_id": customer.name,
+		"user_config": {
+			"customer_name": customer.customer_name,
+			"email": customer.email,
+			"subscription_status": customer.subscription_status,
+			"subscription_plan": customer.subscription_plan,
+			"usage_limit": customer.usage_limit,
+			"overage_allowed": customer.overage_allowed,
+			"preferred_engine": preferred_engine,
+			"accounting_system": accounting_integration[0] if accounting_integration else None,
+			"accounting_status": accounting_integration[1] if accounting_integration else "Not Connected",
+			"api_key": customer.api_key,
+			"webhook_secret": customer.webhook_secret
+		}
+	}
+
+
+def _with_current_usage(config):
+	"""Return a copy of the cached config with live usage figures"""
+	config = frappe._dict(config)
+	if not config.get("user_found"):
+		return config
+
+	user_config = dict(config.user_config)
+	current_usage = quota.get_usage(config.customer_id)
+	usage_limit = user_config.get("usage_limit")
+
+	user_config["current_usage"] = current_usage
+	user_config["usage_remaining"] = max(0, usage_limit - current_usage) if usage_limit else 0
+	config.user_config = user_config
+
+	return config
+
+
+def clear_folder_config_cache(doc, method=None):
+	"""
+	Doc event handler for Drive Integration, SaaS Customer, Subscription Plan
+	and Accounting Integration that drops the cached configs built from doc
+	"""
+	if doc.doctype == "SaaS Customer" and method == "on_update":
+		if not any(doc.has_value_changed(field) for field in CUSTOMER_CONFIG_FIELDS):
+			return
+
+	folder_ids = _get_affected_folder_ids(doc)
+	if not folder_ids:
+		return
+
+	keys = [_cache_key(folder_id) for folder_id in folder_ids]
+	_delete_keys(keys)
+
+	# A concurrent load may still see the old rows until this transaction commits
+	frappe.db.after_commit.add(lambda: _delete_keys(keys))
+
+
+def _get_affected_folder_ids(doc):
+	"""Get the folder IDs whose cached config depends on doc"""
+	if doc.doctype == "Drive Integration":
+		folder_ids = {doc.drive_folder_id}
+		previous = doc.get_doc_before_save()
+		if previous:
+			folder_ids.add(previous.drive_folder_id)
+
+	elif doc.doctype in ("SaaS Customer", "Accounting Integration"):
+		customer = doc.name if doc.doctype == "SaaS Customer" else doc.customer
+		folder_ids = set(frappe.get_all("Drive Integration",
+			filters={"customer": customer}, pluck="drive_folder_id"))
+
+	elif doc.doctype == "Subscription Plan":
+		folder_ids = set(frappe.db.sql_list("""
+			SELECT di.drive_folder_id
+			FROM `tabDrive Integration` di
+			INNER JOIN `tabSaaS Customer` c ON c.name = di.customer
+			WHERE c.subscription_plan = %s
+		""", doc.name))
+
+	else:
+		folder_ids = set()
+
+	return {folder_id for folder_id in folder_ids if folder_id}
+
+
+def _delete_keys(keys):
+	"""Delete cached folder configs"""
+	cache = frappe.cache()
+	for key in keys:
+		cache.delete_value(key)
+
+
+def _cache_key(folder_id):
+	return f"invoice_processing_saas:folder_config:{folder_id}"
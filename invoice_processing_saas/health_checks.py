@@ -0,0 +1,252 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Integration health checks. A sweep selects the integrations that are due
+# (never checked, not healthy, or healthy but checked more than
+# HEALTHY_RECHECK_INTERVAL ago) oldest check first, and probes them in
+# batches on a bounded thread pool. Each provider has its own concurrency
+# limit, so one slow or rate-limited provider cannot take the whole pool.
+# Probes are functions of preloaded data and never use the database, which
+# is not thread safe; pool threads are initialised for the site so outbound
+# calls still go through http_client's circuit breakers and metrics in
+# Redis. Each batch's results are written back with one UPDATE.
+# A sweep stops taking new batches once its time budget is spent, and the
+# integrations it did not reach are first in line for the next sweep.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+from redis.exceptions import LockError
+
+from invoice_processing_saas import http_client
+from invoice_processing_saas.credentials import get_decrypted_passwords
+
+MAX_WORKERS = 16
+BATCH_SIZE = 200
+HEALTHY_RECHECK_INTERVAL = 60  # minutes
+SWEEP_TIME_BUDGET = 12 * 60  # seconds, inside the 15 minute cron slot
+SWEEP_LOCK_TIMEOUT = 15 * 60  # seconds
+PROBE_TIMEOUT = 10  # seconds
+
+# Most probes a provider may have running at once
+PROVIDER_CONCURRENCY = {
+	"Google Drive": 8,
+	"QuickBooks": 4,
+	"Xero": 4,
+}
+DEFAULT_PROVIDER_CONCURRENCY = 4
+
+GOOGLE_DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files/{}"
+
+HEALTHY = "Healthy"
+WARNING = "Warning"
+CRITICAL = "Critical"
+
+# doctype -> fields loaded for probing, statuses that are not checked and Password fields probes need
+INTEGRATIONS = {
+	"Drive Integration": {
+		"fields": ["name", "drive_folder_id"],
+		"skip_statuses": ("Inactive",),
+		"passwords": ["access_token"],
+	},
+	"Accounting Integration": {
+		"fields": ["name", "accounting_system", "company_id"],
+		"skip_statuses": ("Disconnected",),
+		"passwords": ["access_token"],
+	},
+}
+
+
+def check_integration_health():
+	"""Run a health check sweep over all due integrations; only one sweep at a time per site"""
+	cache = frappe.cache()
+	lock = cache.lock(cache.make_key("invoice_processing_saas:health_checks:lock"), timeout=SWEEP_LOCK_TIMEOUT)
+	if not lock.acquire(blocking=False):
+		return {}
+
+	try:
+		deadline = time.monotonic() + SWEEP_TIME_BUDGET
+		with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="health_check",
+				initializer=_init_thread, initargs=(frappe.local.site, frappe.local.sites_path)) as pool:
+			limits = {}
+			return {doctype: _sweep(doctype, pool, limits, deadline) for doctype in INTEGRATIONS}
+	finally:
+		try:
+			lock.release()
+		except LockError:
+			pass
+
+
+def _init_thread(site, sites_path):
+	"""Give a pool thread the site's config, for Redis keys; it never connects to the database"""
+	frappe.init(site=site, sites_path=sites_path)
+
+
+def get_due_integrations(doctype, limit, after=None):
+	"""Get the names of integrations due for a check, least recently checked first"""
+	config = INTEGRATIONS[doctype]
+	recheck_before = add_to_date(now_datetime(), minutes=-HEALTHY_RECHECK_INTERVAL)
+
+	return frappe.db.sql(f"""
+		SELECT name
+		FROM `tab{doctype}`
+		WHERE integration_status NOT IN %(skip_statuses)s
+			AND (last_health_check IS NULL OR last_health_check < %(recheck_before)s
+				OR IFNULL(health_check_status, '') != %(healthy)s)
+			AND (last_health_check IS NULL OR last_health_check < %(started)s)
+		ORDER BY last_health_check ASC, name ASC
+		LIMIT %(limit)s
+	""", {
+		"skip_statuses": config["skip_statuses"],
+		"recheck_before": recheck_before,
+		"healthy": HEALTHY,
+		"started": after or now_datetime(),
+		"limit": limit
+	}, pluck=True)
+
+
+def _sweep(doctype, pool, limits, deadline):
+	"""Check every due integration of a doctype in batches; returns how many were checked"""
+	started = now_datetime()
+	checked = 0
+
+	while time.monotonic() < deadline:
+		# Integrations checked earlier in this sweep have a last_health_check after started
+		names = get_due_integrations(doctype, BATCH_SIZE, after=started)
+		if not names:
+			break
+
+		integrations = _load_integrations(doctype, names)
+		results = list(pool.map(lambda integration: _run_probe(integration, limits), integrations))
+		_write_results(doctype, results)
+		checked += len(results)
+
+		if len(names) < BATCH_SIZE:
+			break
+
+	return checked
+
+
+def _load_integrations(doctype, names):
+	"""Load what the probes need for a batch, with all credentials in one query"""
+	config = INTEGRATIONS[doctype]
+	rows = frappe.get_all(doctype, filters={"name": ["in", names]}, fields=config["fields"])
+	passwords = get_decrypted_passwords(doctype, names, config["passwords"])
+
+	for row in rows:
+		row.update(passwords.get(row.name, {}))
+		row.provider = "Google Drive" if doctype == "Drive Integration" else row.accounting_system
+
+	return rows
+
+
+def _run_probe(integration, limits):
+	"""Probe one integration within its provider's concurrency limit; runs on a pool thread"""
+	semaphore = _get_provider_semaphore(limits, integration.provider)
+	with semaphore:
+		try:
+			probe = PROBES.get(integration.provider, _probe_unsupported)
+			status, error = probe(integration)
+		except Exception as e:
+			status, error = CRITICAL, str(e)
+
+	return integration.name, status, error
+
+
+def _get_provider_semaphore(limits, provider):
+	# setdefault is atomic, so racing threads end up with the same semaphore
+	semaphore = limits.get(provider)
+	if semaphore is None:
+		semaphore = limits.setdefault(provider,
+			threading.BoundedSemaphore(PROVIDER_CONCURRENCY.get(provider, DEFAULT_PROVIDER_CONCURRENCY)))
+	return semaphore
+
+
+def _write_results(doctype, results):
+	"""Write a batch of (name, status, error) results with one UPDATE"""
+	if not results:
+		return
+
+	values = {"checked_at": now_datetime(), "names": [name for name, _, _ in results]}
+	status_cases = []
+	error_cases = []
+	for i, (name, status, error) in enumerate(results):
+		values[f"name_{i}"] = name
+		values[f"status_{i}"] = status
+		values[f"error_{i}"] = error
+		status_cases.append(f"WHEN %(name_{i})s THEN %(status_{i})s")
+		error_cases.append(f"WHEN %(name_{i})s THEN %(error_{i})s")
+
+	frappe.db.sql(f"""
+		UPDATE `tab{doctype}`
+		SET health_check_status = CASE name {" ".join(status_cases)} END,
+			error_message = CASE name {" ".join(error_cases)} END,
+			last_health_check = %(checked_at)s
+		WHERE name IN %(names)s
+	""", values)
+	frappe.db.commit()
+
+
+# Probes take an integration row and return (status, error message or None)
+
+def _probe_google_drive(integration):
+	if not integration.access_token:
+		return CRITICAL, "No access token configured"
+	if not integration.drive_folder_id:
+		return WARNING, "No Drive folder configured"
+
+	import requests
+
+	try:
+		response = http_client.get("google_drive",
+			GOOGLE_DRIVE_FILES_URL.format(integration.drive_folder_id),
+			params={"fields": "id,trashed"},
+			headers={"Authorization": f"Bearer {integration.access_token}"},
+			timeout=PROBE_TIMEOUT
+		)
+	except http_client.CircuitOpenError:
+		return WARNING, "Google Drive is failing; circuit is open"
+	except requests.RequestException as e:
+		return WARNING, f"Google Drive unreachable: {str(e)}"
+
+	if response.status_code == 401:
+		return WARNING, "Access token expired or revoked"
+	if response.status_code in (403, 404):
+		return CRITICAL, "Drive folder is not accessible"
+	if response.status_code >= 400:
+		return WARNING, f"Google Drive returned HTTP {response.status_code}"
+	if response.json().get("trashed"):
+		return CRITICAL, "Drive folder is in the trash"
+
+	return HEALTHY, None
+
+
+def _probe_quickbooks(integration):
+	if not integration.access_token or not integration.company_id:
+		return CRITICAL, "Missing access token or company ID"
+	return HEALTHY, None
+
+
+def _probe_xero(integration):
+	if not integration.access_token:
+		return CRITICAL, "Missing access token"
+	return HEALTHY, None
+
+
+def _probe_manual_export(integration):
+	return HEALTHY, None
+
+
+def _probe_unsupported(integration):
+	return WARNING, f"Health checks are not supported for {integration.provider}"
+
+
+PROBES = {
+	"Google Drive": _probe_google_drive,
+	"QuickBooks": _probe_quickbooks,
+	"Xero": _probe_xero,
+	"Manual Export": _probe_manual_export,
+}
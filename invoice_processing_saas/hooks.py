@@ -26,19 +26,102 @@ website_context = {
 # Application setup hooks
 after_install = "invoice_processing_saas.setup.after_install"
 after_app_install = "invoice_processing_saas.setup.after_app_install"
+after_migrate = "invoice_processing_saas.indexes.after_migrate"
+
+# Composite indexes for hot query paths, created by indexes.ensure_hot_path_indexes
+hot_path_indexes = {
+	"Processing Job": [
+		["customer", "creation"],
+		["customer", "processing_status"],
+		["dispatched_at", "customer", "file_size"],
+		["next_retry_at"],
+		["dispatch_lease_expires"],
+	],
+	"Usage Tracking": [
+		["customer", "month"],
+	],
+	"Drive Integration": [
+		["customer"],
+		["last_health_check"],
+	],
+	"Accounting Integration": [
+		["customer"],
+		["last_health_check"],
+	],
+	"SaaS Customer": [
+		["subscription_status"],
+	],
+}
 
 # Document Events
 doc_events = {
 	"SaaS Customer": {
 		"after_insert": "invoice_processing_saas.api.customer.after_customer_insert",
-		"on_update": "invoice_processing_saas.api.customer.on_customer_update",
+		"on_update": [
+			"invoice_processing_saas.api.customer.on_customer_update",
+			"invoice_processing_saas.folder_config.clear_folder_config_cache",
+			"invoice_processing_saas.http_cache.bump_customer_version",
+			"invoice_processing_saas.identity.clear_identity_cache",
+			"invoice_processing_saas.api_keys.invalidate_api_key_cache",
+		],
+		"on_trash": [
+			"invoice_processing_saas.folder_config.clear_folder_config_cache",
+			"invoice_processing_saas.http_cache.bump_customer_version",
+			"invoice_processing_saas.identity.clear_identity_cache",
+			"invoice_processing_saas.api_keys.invalidate_api_key_cache",
+		],
+	},
+	"Drive Integration": {
+		"on_update": [
+			"invoice_processing_saas.folder_config.clear_folder_config_cache",
+			"invoice_processing_saas.http_cache.bump_customer_version",
+			"invoice_processing_saas.token_refresh.schedule_integration",
+		],
+		"on_trash": [
+			"invoice_processing_saas.folder_config.clear_folder_config_cache",
+			"invoice_processing_saas.http_cache.bump_customer_version",
+			"invoice_processing_saas.token_refresh.schedule_integration",
+		],
+	},
+	"Accounting Integration": {
+		"on_update": [
+			"invoice_processing_saas.folder_config.clear_folder_config_cache",
+			"invoice_processing_saas.http_cache.bump_customer_version",
+			"invoice_processing_saas.token_refresh.schedule_integration",
+		],
+		"on_trash": [
+			"invoice_processing_saas.folder_config.clear_folder_config_cache",
+			"invoice_processing_saas.http_cache.bump_customer_version",
+			"invoice_processing_saas.token_refresh.schedule_integration",
+		],
+	},
+	"Subscription Plan": {
+		"on_update": [
+			"invoice_processing_saas.folder_config.clear_folder_config_cache",
+			"invoice_processing_saas.http_cache.bump_customer_version",
+			"invoice_processing_saas.plan_catalog.invalidate_plan_catalog",
+		],
+		"on_trash": [
+			"invoice_processing_saas.folder_config.clear_folder_config_cache",
+			"invoice_processing_saas.plan_catalog.invalidate_plan_catalog",
+		],
 	},
 	"Processing Job": {
 		"after_insert": "invoice_processing_saas.api.processing.after_job_insert",
-		"on_update": "invoice_processing_saas.api.processing.on_job_update",
+		"on_update": [
+			"invoice_processing_saas.api.processing.on_job_update",
+			"invoice_processing_saas.http_cache.bump_customer_version",
+		],
+		"on_trash": [
+			"invoice_processing_saas.api.processing.on_job_trash",
+			"invoice_processing_saas.http_cache.bump_customer_version",
+		],
 	},
 	"Usage Tracking": {
-		"on_update": "invoice_processing_saas.api.usage.on_usage_update",
+		"on_update": [
+			"invoice_processing_saas.api.usage.on_usage_update",
+			"invoice_processing_saas.http_cache.bump_customer_version",
+		],
 	}
 }
 
@@ -50,9 +133,18 @@ scheduler_events = {
 			"invoice_processing_saas.tasks.daily.check_subscription_renewals",
 			"invoice_processing_saas.tasks.daily.cleanup_old_jobs"
 		],
+		"* * * * *": [  # Every minute
+			"invoice_processing_saas.tasks.frequent.drain_notification_outbox",
+			"invoice_processing_saas.tasks.frequent.flush_event_log",
+			"invoice_processing_saas.tasks.frequent.process_pending_jobs",
+			"invoice_processing_saas.tasks.frequent.process_due_retries",
+			"invoice_processing_saas.tasks.frequent.refresh_due_tokens"
+		],
+		"*/5 * * * *": [  # Every 5 minutes
+			"invoice_processing_saas.tasks.frequent.sync_usage_counters"
+		],
 		"*/15 * * * *": [  # Every 15 minutes
-			"invoice_processing_saas.tasks.frequent.check_integration_health",
-			"invoice_processing_saas.tasks.frequent.process_pending_jobs"
+			"invoice_processing_saas.tasks.frequent.check_integration_health"
 		],
 		"0 */6 * * *": [  # Every 6 hours
 			"invoice_processing_saas.tasks.periodic.refresh_oauth_tokens",
@@ -141,18 +233,6 @@ doctype_js = {
 	"Customer": "public/js/customer.js"
 }
 
-# API Rate limiting
-api_call_limits = {
-	"invoice_processing_saas.api.processing.create_job": {
-		"limit": 100,  # 100 calls per hour
-		"window": 3600
-	},
-	"invoice_processing_saas.api.processing.store_result": {
-		"limit": 200,  # 200 calls per hour
-		"window": 3600
-	}
-}
-
 # Custom roles
 standard_portal_menu_items = [
 	{"title": "Personal Details", "route": "/app/user"},
@@ -0,0 +1,113 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Conditional GET for customer dashboard endpoints. Each customer has a
+# version stamp in Redis that is bumped after any committed change to their
+# jobs, integrations, usage or customer record. Payloads are cached per
+# version and served with an ETag derived from it, so a portal that polls
+# gets a 304 without any queries while nothing has changed.
+
+import hashlib
+import time
+
+import frappe
+
+PAYLOAD_TTL = 60 * 60  # seconds
+
+
+def conditional_get(customer, payload_name, build, *key_parts):
+	"""
+	Return the cached payload for the customer's current version, building it on a miss
+	Returns None with a 304 status when the client already has this version
+	"""
+	version = get_version(customer)
+	key = ":".join(str(part) for part in (customer, payload_name, *key_parts))
+	etag = '"{}"'.format(hashlib.sha1(f"{key}:{version}".encode()).hexdigest())
+
+	_set_response_header("ETag", etag)
+	_set_response_header("Cache-Control", "private, no-cache")
+
+	if etag in _parse_if_none_match(frappe.get_request_header("If-None-Match")):
+		frappe.local.response.http_status_code = 304
+		return None
+
+	cache = frappe.cache()
+	cache_key = f"invoice_processing_saas:http_cache:{key}:{version}"
+
+	payload = cache.get_value(cache_key)
+	if payload is None:
+		payload = build()
+		cache.set_value(cache_key, payload, expires_in_sec=PAYLOAD_TTL)
+
+	return payload
+
+
+def get_version(customer):
+	"""Get the customer's version stamp"""
+	version = _redis("GET", _version_key(customer))
+	if version is None:
+		# Start from the clock so a flushed Redis does not reuse old ETags
+		_redis("SET", _version_key(customer), int(time.time() * 1000), "NX")
+		version = _redis("GET", _version_key(customer))
+
+	return int(version)
+
+
+def bump_version(customer):
+	"""Invalidate the customer's cached payloads once the current transaction commits"""
+	if not customer:
+		return
+
+	if not hasattr(frappe.local, "bumped_customer_versions"):
+		frappe.local.bumped_customer_versions = set()
+
+	# One bump per customer per request is enough
+	if customer in frappe.local.bumped_customer_versions:
+		return
+
+	frappe.local.bumped_customer_versions.add(customer)
+
+	def bump():
+		_redis("INCR", _version_key(customer))
+		frappe.local.bumped_customer_versions.discard(customer)
+
+	frappe.db.after_commit.add(bump)
+	frappe.db.after_rollback.add(lambda: frappe.local.bumped_customer_versions.discard(customer))
+
+
+def bump_customer_version(doc, method=None):
+	"""
+	Doc event handler for the doctypes behind the customer dashboard
+	Subscription Plan changes bump every customer on the plan
+	"""
+	if doc.doctype == "SaaS Customer":
+		bump_version(doc.name)
+
+	elif doc.doctype == "Subscription Plan":
+		for customer in frappe.get_all("SaaS Customer",
+			filters={"subscription_plan": doc.name}, pluck="name"):
+			bump_version(customer)
+
+	else:
+		bump_version(doc.get("customer"))
+
+
+def _parse_if_none_match(header):
+	if not header:
+		return set()
+	return {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+def _set_response_header(name, value):
+	response_headers = getattr(frappe.local, "response_headers", None)
+	if response_headers is not None:
+		response_headers[name] = value
+
+
+def _redis(*args):
+	"""Run a raw Redis command on the cache connection (see quota._redis)"""
+	return frappe.cache().execute_command(*args)
+
+
+def _version_key(customer):
+	return frappe.cache().make_key(f"invoice_processing_saas:customer_version:{customer}")
@@ -0,0 +1,227 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Outbound HTTP for n8n, accounting systems and webhooks. Each worker process
+# keeps one requests Session per service with a keep-alive connection pool
+# per host, so repeated calls skip DNS and the TCP/TLS handshake. Timeouts
+# default to webhook_timeout_seconds from Invoice Processing Settings.
+#
+# Every endpoint (URL without query string) has a circuit breaker in Redis
+# shared by all workers. Connection errors, timeouts and 5xx responses count
+# as failures; after BREAKER_FAILURE_THRESHOLD failures with no success in
+# between (and no gap longer than BREAKER_FAILURE_WINDOW) the circuit opens
+# and calls fail at once with CircuitOpenError. Once BREAKER_OPEN_DURATION
+# has passed the circuit is half-open: one call is let through as a probe,
+# and its result closes the circuit or opens it again. Request counts,
+# failures, rejections and total latency are kept per endpoint per day (see
+# get_metrics).
+#
+# requests is imported on first use, so web and background workers that
+# never make an outbound call do not pay for importing it.
+
+import math
+import threading
+import time
+from urllib.parse import urlsplit
+
+import frappe
+from frappe.utils import cint, today
+
+POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30  # seconds
+MAX_CONNECT_TIMEOUT = 5  # seconds
+
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_FAILURE_WINDOW = 60  # seconds
+BREAKER_OPEN_DURATION = 30  # seconds
+METRICS_TTL = 8 * 24 * 60 * 60  # seconds
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+_sessions = {}  # service -> Session
+_sessions_lock = threading.Lock()
+
+
+class CircuitOpenError(frappe.ValidationError):
+	pass
+
+
+def get_session(service):
+	"""Get this process's pooled Session for a service"""
+	session = _sessions.get(service)
+	if session is None:
+		with _sessions_lock:
+			session = _sessions.get(service)
+			if session is None:
+				import requests
+				from requests.adapters import HTTPAdapter
+
+				session = requests.Session()
+				adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+				session.mount("https://", adapter)
+				session.mount("http://", adapter)
+				_sessions[service] = session
+
+	return session
+
+
+def request(service, method, url, timeout=None, **kwargs):
+	"""
+	Make an HTTP request through the service's pooled session and the endpoint's circuit breaker
+	Raises CircuitOpenError without calling the endpoint while its circuit is open
+	"""
+	timeout = timeout or get_default_timeout()
+	endpoint = get_endpoint(url)
+	if not _allow_request(endpoint, timeout):
+		_record(endpoint, "rejected")
+		raise CircuitOpenError(f"{service} endpoint {endpoint} is unavailable; circuit is open")
+
+	import requests
+
+	started = time.monotonic()
+	try:
+		response = get_session(service).request(method, url,
+			timeout=(min(timeout, MAX_CONNECT_TIMEOUT), timeout), **kwargs)
+	except requests.RequestException:
+		_on_failure(endpoint, started)
+		raise
+
+	if response.status_code >= 500:
+		_on_failure(endpoint, started)
+	else:
+		_on_success(endpoint, started)
+
+	return response
+
+
+def get(service, url, **kwargs):
+	return request(service, "GET", url, **kwargs)
+
+
+def post(service, url, **kwargs):
+	return request(service, "POST", url, **kwargs)
+
+
+def get_default_timeout():
+	"""Get the outbound request timeout from Invoice Processing Settings"""
+	return cint(frappe.db.get_single_value("Invoice Processing Settings", "webhook_timeout_seconds")) \
+		or DEFAULT_TIMEOUT
+
+
+def get_endpoint(url):
+	"""Get the circuit breaker endpoint of a URL: scheme, host and path"""
+	parts = urlsplit(url)
+	return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+def get_circuit_state(endpoint):
+	"""Get an endpoint's circuit state: closed, open or half-open"""
+	opened_until = _redis("HGET", _breaker_key(endpoint), "opened_until")
+	if not opened_until:
+		return CLOSED
+	return OPEN if time.time() < float(opened_until) else HALF_OPEN
+
+
+def get_metrics(date=None):
+	"""Get request, failure, rejection and latency figures per endpoint for a day"""
+	cache = frappe.cache()
+	endpoints = cache.execute_command("SMEMBERS", _endpoints_key(date or today())) or []
+
+	metrics = {}
+	for endpoint in endpoints:
+		endpoint = frappe.safe_decode(endpoint)
+		values = cache.execute_command("HGETALL", _metrics_key(endpoint, date or today())) or {}
+		values = {frappe.safe_decode(field): cint(value) for field, value in values.items()}
+
+		completed = values.get("successes", 0) + values.get("failures", 0)
+		metrics[endpoint] = {
+			"requests": completed,
+			"failures": values.get("failures", 0),
+			"rejected": values.get("rejected", 0),
+			"avg_latency_ms": values.get("latency_ms", 0) / completed if completed else 0,
+			"circuit_state": get_circuit_state(endpoint)
+		}
+
+	return metrics
+
+
+@frappe.whitelist()
+def get_http_metrics(date=None):
+	"""Outbound HTTP metrics for the admin dashboard"""
+	frappe.only_for("System Manager")
+	return get_metrics(date)
+
+
+def _allow_request(endpoint, timeout):
+	state = get_circuit_state(endpoint)
+	if state == CLOSED:
+		return True
+	if state == OPEN:
+		return False
+
+	# Half-open: let one probe through until it reports back or times out
+	return bool(_redis("SET", _probe_key(endpoint), 1, "NX", "EX", math.ceil(timeout) + MAX_CONNECT_TIMEOUT))
+
+
+def _on_success(endpoint, started):
+	_record(endpoint, "successes", started)
+	if _redis("EXISTS", _breaker_key(endpoint)):
+		_redis("DEL", _breaker_key(endpoint), _probe_key(endpoint))
+
+
+def _on_failure(endpoint, started):
+	_record(endpoint, "failures", started)
+
+	key = _breaker_key(endpoint)
+	state = get_circuit_state(endpoint)
+
+	pipeline = frappe.cache().pipeline()
+	pipeline.hincrby(key, "failures", 1)
+	pipeline.expire(key, BREAKER_FAILURE_WINDOW + BREAKER_OPEN_DURATION)
+	failures = pipeline.execute()[0]
+
+	# A failed probe opens the circuit again straight away
+	if state == HALF_OPEN or failures >= BREAKER_FAILURE_THRESHOLD:
+		pipeline = frappe.cache().pipeline()
+		pipeline.hset(key, "opened_until", time.time() + BREAKER_OPEN_DURATION)
+		pipeline.expire(key, BREAKER_FAILURE_WINDOW + BREAKER_OPEN_DURATION)
+		pipeline.delete(_probe_key(endpoint))
+		pipeline.execute()
+		frappe.logger().warning(f"Circuit opened for {endpoint} after {failures} failures")
+
+
+def _record(endpoint, outcome, started=None):
+	date = today()
+	key = _metrics_key(endpoint, date)
+
+	pipeline = frappe.cache().pipeline()
+	pipeline.hincrby(key, outcome, 1)
+	if started is not None:
+		pipeline.hincrby(key, "latency_ms", int((time.monotonic() - started) * 1000))
+	pipeline.expire(key, METRICS_TTL)
+	pipeline.sadd(_endpoints_key(date), endpoint)
+	pipeline.expire(_endpoints_key(date), METRICS_TTL)
+	pipeline.execute()
+
+
+def _redis(*args):
+	"""Run a raw Redis command on the cache connection (see quota._redis)"""
+	return frappe.cache().execute_command(*args)
+
+
+def _breaker_key(endpoint):
+	return frappe.cache().make_key(f"invoice_processing_saas:http_client:breaker:{endpoint}")
+
+
+def _probe_key(endpoint):
+	return frappe.cache().make_key(f"invoice_processing_saas:http_client:probe:{endpoint}")
+
+
+def _metrics_key(endpoint, date):
+	return frappe.cache().make_key(f"invoice_processing_saas:http_client:metrics:{date}:{endpoint}")
+
+
+def _endpoints_key(date):
+	return frappe.cache().make_key(f"invoice_processing_saas:http_client:endpoints:{date}")
@@ -0,0 +1,100 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Idempotency keys for n8n endpoints. n8n retries webhook calls that time
+# out, so the same write can arrive several times. The first successful
+# response for a key is cached in Redis once its transaction commits and
+# retries get that response back without touching any documents. Endpoints
+# that commit part of their work before failing pass their own store_if so
+# a retry does not apply that part again. The key is
+# taken from the Idempotency-Key header (or idempotency_key form field) and
+# otherwise derived from the customer, the file or job and the stage.
+# Endpoints whose calls legitimately repeat for the same job, such as status
+# updates on each retry, pass stage=None and only honour an explicit key.
+
+import functools
+import hashlib
+
+import frappe
+
+IDEMPOTENCY_TTL = 60 * 60  # seconds
+IN_FLIGHT_TTL = 60  # seconds
+
+
+def _is_successful(response):
+	return response.get("success")
+
+
+def idempotent(stage, store_if=_is_successful):
+	"""
+	Decorator for n8n endpoints that returns the cached response for repeated keys
+	stage is a string or a function of the request data, used to derive keys;
+	None only honours an explicit key
+	store_if decides from a response dict whether it is cached for replay
+	"""
+	def decorator(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			data = frappe.local.form_dict
+			key = get_idempotency_key(data, stage(data) if callable(stage) else stage)
+			if not key:
+				return fn(*args, **kwargs)
+
+			cache = frappe.cache()
+			response_key = _response_key(fn, key)
+
+			response = cache.get_value(response_key)
+			if response is not None:
+				_set_replayed_header()
+				return response
+
+			# Only one request per key does the work; concurrent retries back off
+			in_flight_key = cache.make_key(f"{response_key}:in_flight")
+			if not cache.execute_command("SET", in_flight_key, 1, "NX", "EX", IN_FLIGHT_TTL):
+				frappe.local.response.http_status_code = 409
+				return {"success": False, "error": "A request with this idempotency key is already in progress"}
+
+			try:
+				response = fn(*args, **kwargs)
+			except Exception:
+				cache.execute_command("DEL", in_flight_key)
+				raise
+
+			def store_response():
+				if isinstance(response, dict) and store_if(response):
+					cache.set_value(response_key, response, expires_in_sec=IDEMPOTENCY_TTL)
+				cache.execute_command("DEL", in_flight_key)
+
+			# Responses are only replayed once the writes behind them are committed
+			frappe.db.after_commit.add(store_response)
+			frappe.db.after_rollback.add(lambda: cache.execute_command("DEL", in_flight_key))
+
+			return response
+
+		return wrapper
+
+	return decorator
+
+
+def get_idempotency_key(data, stage):
+	"""Get the request's idempotency key, or derive one from the file or job it is about"""
+	key = frappe.get_request_header("Idempotency-Key") or data.get("idempotency_key")
+	if key or stage is None:
+		return key
+
+	subject = data.get("file_id") or data.get("job_id")
+	if not subject:
+		return None
+
+	return ":".join([data.get("customer_id") or "", subject, stage])
+
+
+def _response_key(fn, key):
+	digest = hashlib.sha256(str(key).encode()).hexdigest()
+	return f"invoice_processing_saas:idempotency:{fn.__name__}:{digest}"
+
+
+def _set_replayed_header():
+	response_headers = getattr(frappe.local, "response_headers", None)
+	if response_headers is not None:
+		response_headers["Idempotent-Replayed"] = "true"
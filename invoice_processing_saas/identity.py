@@ -0,0 +1,88 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Request-scoped identity of the session user's SaaS Customer. A portal user
+# is the customer whose email matches the session user, and the same lookup
+# was repeated by every document validate, the auth hooks, boot and the
+# dashboard endpoints. The customer is resolved once per request, kept in
+# frappe.local and shared between requests through a short-TTL cache that is
+# cleared when the customer changes.
+
+import frappe
+
+IDENTITY_TTL = 60  # seconds
+IDENTITY_FIELDS = ["name", "customer_name", "email", "subscription_status", "subscription_plan"]
+
+
+def get_session_customer():
+	"""Get the session user's customer (name, customer_name, email, status, plan) or None"""
+	user = frappe.session.user
+	if not user or user == "Guest":
+		return None
+
+	identities = _get_request_cache()
+	if user in identities:
+		return identities[user]
+
+	cache = frappe.cache()
+	key = _cache_key(user)
+
+	identity = cache.get_value(key)
+	if identity is None:
+		# Store misses as an empty dict so non-customer users are cached too
+		identity = frappe.db.get_value("SaaS Customer", {"email": user}, IDENTITY_FIELDS, as_dict=True) or {}
+		cache.set_value(key, identity, expires_in_sec=IDENTITY_TTL)
+
+	identity = frappe._dict(identity) if identity else None
+	identities[user] = identity
+	return identity
+
+
+def get_session_customer_name():
+	"""Get the name of the session user's customer, or None"""
+	customer = get_session_customer()
+	return customer.name if customer else None
+
+
+def can_access_customer(customer, doctype, ptype="write", doc=None):
+	"""
+	Check that the session user may access a customer's records
+	The customer's own user always can, anyone else needs ptype on doctype
+	"""
+	if frappe.session.user == "Administrator":
+		return True
+
+	# Customer emails are unique, so this is the same as comparing the customer's email
+	if customer and get_session_customer_name() == customer:
+		return True
+
+	permissions = _get_request_cache("permissions")
+	key = (frappe.session.user, doctype, ptype, doc)
+	if key not in permissions:
+		permissions[key] = frappe.has_permission(doctype, ptype, doc)
+
+	return permissions[key]
+
+
+def clear_identity_cache(doc, method=None):
+	"""Doc event handler for SaaS Customer that drops cached identities for its email"""
+	emails = {doc.email}
+	previous = doc.get_doc_before_save()
+	if previous:
+		emails.add(previous.email)
+
+	cache = frappe.cache()
+	identities = _get_request_cache()
+	for email in filter(None, emails):
+		cache.delete_value(_cache_key(email))
+		identities.pop(email, None)
+
+
+def _get_request_cache(name="identities"):
+	if not hasattr(frappe.local, "customer_identity_cache"):
+		frappe.local.customer_identity_cache = {}
+	return frappe.local.customer_identity_cache.setdefault(name, {})
+
+
+def _cache_key(user):
+	return f"invoice_processing_saas:identity:{user}"
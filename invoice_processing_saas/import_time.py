@@ -0,0 +1,126 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Cold import time budget for the app. Every gunicorn and RQ worker imports
+# the app's modules and resolves the dotted paths in hooks.py, so their import
+# cost is paid again on each worker start and recycle. measure_import_time
+# starts a fresh interpreter with python -X importtime, imports what every
+# worker already has from frappe, then imports each app module and resolves
+# every hook, and adds up the time spent after the frappe baseline. Heavy
+# third-party libraries should be imported where they are first used; the
+# bench check-import-time command fails once the total exceeds
+# IMPORT_TIME_BUDGET_MS.
+
+import os
+import subprocess
+import sys
+
+IMPORT_TIME_BUDGET_MS = 300
+DEFAULT_RUNS = 3
+
+APP_NAME = "invoice_processing_saas"
+
+# Loaded by every worker before it imports app code
+BASELINE_MODULES = ["frappe", "frappe.utils", "frappe.model.document", "frappe.utils.password"]
+
+# Loaded by bench commands, never by workers
+EXCLUDED = ("patches", "commands")
+
+APP_IMPORTS_MARKER = "-- app imports --"
+
+CHILD_SCRIPT = """
+import importlib
+import sys
+
+for module in {baseline!r}:
+	importlib.import_module(module)
+
+sys.stderr.write({marker!r} + "\\n")
+sys.stderr.flush()
+
+for module in {modules!r}:
+	importlib.import_module(module)
+
+import frappe
+from {app} import hooks
+
+def resolve(value):
+	if isinstance(value, str):
+		if value.startswith({app!r} + ".") and " " not in value:
+			frappe.get_attr(value)
+	elif isinstance(value, dict):
+		for item in value.values():
+			resolve(item)
+	elif isinstance(value, (list, tuple)):
+		for item in value:
+			resolve(item)
+
+for name in dir(hooks):
+	if not name.startswith("_"):
+		resolve(getattr(hooks, name))
+"""
+
+
+def get_app_modules():
+	"""Get the dotted names of the app's modules that workers import"""
+	app_path = os.path.dirname(os.path.abspath(__file__))
+	root = os.path.dirname(app_path)
+
+	modules = []
+	for dirpath, dirnames, filenames in os.walk(app_path):
+		# doctype has no __init__.py, so descend into anything importable
+		dirnames[:] = sorted(d for d in dirnames if d.isidentifier() and d not in EXCLUDED
+			and d != "__pycache__")
+
+		package = os.path.relpath(dirpath, root).replace(os.sep, ".")
+		for filename in sorted(filenames):
+			if filename == "__init__.py":
+				modules.append(package)
+			elif filename.endswith(".py") and filename[:-3] not in EXCLUDED:
+				modules.append(f"{package}.{filename[:-3]}")
+
+	return modules
+
+
+def measure_import_time(runs=DEFAULT_RUNS):
+	"""
+	Import the app in fresh interpreters and return the fastest run as
+	{"total_ms": ..., "modules": [(module, self_ms, cumulative_ms), ...]}, heaviest first
+	"""
+	script = CHILD_SCRIPT.format(baseline=BASELINE_MODULES, marker=APP_IMPORTS_MARKER,
+		modules=get_app_modules(), app=APP_NAME)
+
+	best = None
+	for _ in range(max(1, runs)):
+		result = subprocess.run([sys.executable, "-X", "importtime", "-c", script],
+			capture_output=True, text=True)
+		if result.returncode != 0:
+			raise RuntimeError(f"Importing {APP_NAME} failed:\n{result.stderr[-2000:]}")
+
+		measured = _parse_importtime(result.stderr)
+		if best is None or measured["total_ms"] < best["total_ms"]:
+			best = measured
+
+	return best
+
+
+def _parse_importtime(output):
+	"""Add up the -X importtime lines that follow the app imports marker"""
+	lines = output.splitlines()
+	if APP_IMPORTS_MARKER in lines:
+		lines = lines[lines.index(APP_IMPORTS_MARKER) + 1:]
+
+	total_us = 0
+	modules = []
+	for line in lines:
+		if not line.startswith("import time:") or "imported package" in line:
+			continue
+
+		self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+		depth = (len(name) - len(name.lstrip()) - 1) // 2
+		modules.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+		if depth == 0:
+			total_us += int(cumulative_us)
+
+	modules.sort(key=lambda module: module[1], reverse=True)
+	return {"total_ms": total_us / 1000, "modules": modules}
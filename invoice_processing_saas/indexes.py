@@ -0,0 +1,168 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Composite indexes for the app's hot query paths. Doctypes declare the
+# column lists they are filtered by in the hot_path_indexes hook and
+# ensure_hot_path_indexes creates whichever are missing, online, on install,
+# in the v1_0 patch and after every migrate. verify_hot_path_indexes runs
+# EXPLAIN on the queries behind the listing, stats and lookup endpoints to
+# confirm they use them, or the unique and primary keys those queries rely
+# on where no extra index is needed.
+
+import frappe
+
+# Representative queries for each hot path and the index each should use
+HOT_PATH_QUERIES = [
+	{
+		"path": "Customer job listing",
+		"query": """SELECT name FROM `tabProcessing Job` WHERE customer = %(customer)s
+			ORDER BY creation DESC, name DESC LIMIT 21""",
+		"index": "customer_creation_index"
+	},
+	{
+		"path": "Customer job listing by status",
+		"query": """SELECT name FROM `tabProcessing Job` WHERE customer = %(customer)s
+			AND processing_status = 'Failed' ORDER BY creation DESC, name DESC LIMIT 21""",
+		"index": "customer_processing_status_index"
+	},
+	{
+		"path": "Customer job statistics",
+		"query": """SELECT SUM(total_jobs), SUM(completed) FROM `__job_daily_rollup`
+			WHERE customer = %(customer)s AND day BETWEEN %(month_start)s AND %(month_end)s""",
+		"index": "PRIMARY"
+	},
+	{
+		"path": "Job lookup by n8n job ID",
+		"query": "SELECT name FROM `tabProcessing Job` WHERE job_id = %(job_id)s",
+		# job_id is a unique field, so Frappe already keys it
+		"index": "job_id"
+	},
+	{
+		"path": "Jobs waiting for dispatch",
+		"query": """SELECT name FROM `tabProcessing Job` WHERE dispatched_at IS NULL
+			AND customer = %(customer)s AND processing_status IN ('Queued', 'Retry')
+			ORDER BY file_size ASC LIMIT 50""",
+		"index": "dispatched_at_customer_file_size_index"
+	},
+	{
+		"path": "Due job retries",
+		"query": """SELECT name FROM `tabProcessing Job` WHERE next_retry_at <= %(now)s
+			AND processing_status = 'Failed' ORDER BY next_retry_at ASC LIMIT 100""",
+		"index": "next_retry_at_index"
+	},
+	{
+		"path": "Lapsed dispatch leases",
+		"query": """SELECT name, customer FROM `tabProcessing Job` WHERE dispatch_lease_expires < %(now)s
+			AND processing_status IN ('Queued', 'Retry')""",
+		"index": "dispatch_lease_expires_index"
+	},
+	{
+		"path": "Customer usage for a month",
+		"query": "SELECT name FROM `tabUsage Tracking` WHERE customer = %(customer)s AND month = %(month)s",
+		"index": "customer_month_index"
+	},
+	{
+		"path": "Customer drive integrations",
+		"query": "SELECT drive_folder_id FROM `tabDrive Integration` WHERE customer = %(customer)s",
+		"index": "customer_index"
+	},
+	{
+		"path": "Customer accounting integration",
+		"query": "SELECT accounting_system FROM `tabAccounting Integration` WHERE customer = %(customer)s",
+		"index": "customer_index"
+	},
+	{
+		"path": "Drive integrations due for a health check",
+		"query": """SELECT name FROM `tabDrive Integration` WHERE last_health_check < %(now)s
+			ORDER BY last_health_check ASC, name ASC LIMIT 200""",
+		"index": "last_health_check_index"
+	},
+	{
+		"path": "Accounting integrations due for a health check",
+		"query": """SELECT name FROM `tabAccounting Integration` WHERE last_health_check < %(now)s
+			ORDER BY last_health_check ASC, name ASC LIMIT 200""",
+		"index": "last_health_check_index"
+	},
+	{
+		"path": "Customers by subscription status",
+		"query": "SELECT name FROM `tabSaaS Customer` WHERE subscription_status = %(status)s",
+		"index": "subscription_status_index"
+	}
+]
+
+HOT_PATH_QUERY_VALUES = {
+	"customer": "CUST-0001",
+	"job_id": "job",
+	"month": "2025-01",
+	"month_start": "2025-01-01",
+	"month_end": "2025-01-31",
+	"now": "2025-01-01 00:00:00",
+	"status": "Active"
+}
+
+
+def get_hot_path_indexes(doctype=None):
+	"""Get the declared indexes as {doctype: [columns, ...]}"""
+	indexes = frappe.get_hooks("hot_path_indexes") or {}
+	if doctype:
+		return {doctype: indexes.get(doctype, [])}
+	return indexes
+
+
+def ensure_hot_path_indexes(doctype=None):
+	"""Create the declared indexes that do not exist yet"""
+	for index_doctype, index_list in get_hot_path_indexes(doctype).items():
+		for columns in index_list:
+			add_index_online(index_doctype, columns)
+
+
+def add_index_online(doctype, columns):
+	"""
+	Add a composite index without blocking writes to the table
+	Uses the same index name as frappe.db.add_index, so either creates it only once
+	"""
+	index_name = "_".join(columns) + "_index"
+	if frappe.db.has_index(f"tab{doctype}", index_name):
+		return
+
+	# Patches run before the model sync, so columns added by this release may not exist yet;
+	# after_migrate creates the index once they do
+	if not all(frappe.db.has_column(doctype, column) for column in columns):
+		return
+
+	column_list = ", ".join(f"`{column}`" for column in columns)
+	frappe.db.sql_ddl(f"""
+		ALTER TABLE `tab{doctype}`
+		ADD INDEX `{index_name}` ({column_list}),
+		ALGORITHM=INPLACE, LOCK=NONE
+	""")
+	print(f"Added index {index_name} on {doctype}")
+
+
+def after_migrate():
+	"""Create indexes declared since the last migrate"""
+	ensure_hot_path_indexes()
+
+
+def verify_hot_path_indexes():
+	"""
+	EXPLAIN each hot path query and report the index it uses
+	Returns a list of results; ok is False for queries that do not use their index, and
+	possible is True when the optimizer could use the index but chose not to
+	"""
+	results = []
+	for check in HOT_PATH_QUERIES:
+		plan = frappe.db.sql(f"EXPLAIN {check['query']}", HOT_PATH_QUERY_VALUES, as_dict=True)
+		used = plan[0].get("key") if plan else None
+		possible = (plan[0].get("possible_keys") or "").split(",") if plan else []
+
+		results.append({
+			"path": check["path"],
+			"index": check["index"],
+			"used": used,
+			"ok": used == check["index"],
+			# A tiny table may be scanned even though the index is usable
+			"possible": used != check["index"] and check["index"] in possible
+		})
+
+	return results
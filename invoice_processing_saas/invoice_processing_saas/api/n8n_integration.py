@@ -4,10 +4,28 @@
 import frappe
 from frappe import _
 import json
-from frappe.utils import nowdate, now
+from frappe.utils import now, flt
+from invoice_processing_saas import event_log, http_client, job_state, quota
+from invoice_processing_saas.folder_config import get_folder_config
+from invoice_processing_saas.idempotency import idempotent
+from invoice_processing_saas.rate_limit import rate_limited
+from invoice_processing_saas.notifications import queue_notification
+from invoice_processing_saas.invoice_processing_saas.doctype.usage_tracking.usage_tracking import (
+	get_derived_charges,
+	increment_usage_counters,
+)
+
+# Limits for batch_job_operations
+BATCH_MAX_OPERATIONS = 2000
+BATCH_CHUNK_SIZE = 100
+BATCH_OPERATIONS = ("create", "status", "result")
+
+# SaaS Customer fields needed to admit a new job
+JOB_CUSTOMER_FIELDS = ["name", "subscription_status", "usage_limit", "overage_allowed"]
 
 
 @frappe.whitelist(allow_guest=True, methods=["POST"])
+@rate_limited()
 def lookup_user_by_folder():
 	"""
 	n8n API endpoint to lookup user by Google Drive folder ID
@@ -16,83 +34,62 @@ def lookup_user_by_folder():
 	try:
 		# Get request data
 		data = frappe.local.form_dict
-		folder_id = data.get("folder_id")
 		
-		if not folder_id:
-			return {"user_found": False, "error": "folder_id is required"}
-			
-		# Find customer by drive folder ID
-		drive_integration = frappe.db.get_value("Drive Integration", 
-			{"drive_folder_id": folder_id}, 
-			["customer", "integration_status", "setup_completed"])
-			
-		if not drive_integration:
-			return {"user_found": False, "error": "No customer found for this folder"}
-			
-		customer_name = drive_integration[0]
-		integration_status = drive_integration[1]
-		setup_completed = drive_integration[2]
-		
-		# Get customer details
-		customer = frappe.get_doc("SaaS Customer", customer_name)
-		
-		# Check if customer is active
-		if customer.subscription_status not in ["Active", "Trial"]:
-			return {
-				"user_found": False, 
-				"error": f"Customer subscription is {customer.subscription_status}"
-			}
-			
-		# Check if integration is ready
-		if integration_status != "Active" or not setup_completed:
-			return {
-				"user_found": False,
-				"error": "Drive integration not properly configured"
-			}
-			
-		# Get accounting integration
-		accounting_integration = frappe.db.get_value("Accounting Integration",
-			{"customer": customer_name}, 
-			["accounting_system", "integration_status"])
+		return get_folder_config(data.get("folder_id"))
+		
+	except Exception as e:
+		frappe.log_error(f"Error in lookup_user_by_folder: {str(e)}")
+		return {"user_found": False, "error": "Internal server error"}
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+@idempotent("ingest")
+@rate_limited()
+def ingest_file():
+	"""
+	n8n API endpoint that resolves the folder's customer and creates the
+	processing job in one call
+	Combines lookup_user_by_folder and create_processing_job; the customer
+	is resolved from the cached folder config, so no customer row is loaded
+	"""
+	try:
+		data = frappe.local.form_dict
+		
+		config = get_folder_config(data.get("folder_id"))
+		if not config.get("user_found"):
+			return {"success": False, "user_found": False, "error": config.get("error")}
 			
-		# Get usage info
-		usage_remaining = max(0, customer.usage_limit - customer.current_usage) if customer.usage_limit else 0
+		user_config = config.user_config
+		customer = frappe._dict({
+			"name": config.customer_id,
+			"subscription_status": user_config["subscription_status"],
+			"usage_limit": user_config["usage_limit"],
+			"overage_allowed": user_config["overage_allowed"]
+		})
 		
-		# Determine preferred engine based on customer plan and complexity
-		preferred_engine = "azure"  # Default to Azure for efficiency
+		job_data = frappe._dict(data)
+		job_data.customer_id = customer.name
+		
+		job = _create_processing_job(job_data, customer=customer)
 		
-		# Check if customer has premium plan (may prefer OpenAI)
-		if customer.subscription_plan:
-			plan = frappe.get_doc("Subscription Plan", customer.subscription_plan)
-			if plan.plan_code in ["pro", "enterprise"]:
-				preferred_engine = "openai"
-				
 		return {
+			"success": True,
 			"user_found": True,
 			"customer_id": customer.name,
-			"user_config": {
-				"customer_name": customer.customer_name,
-				"email": customer.email,
-				"subscription_status": customer.subscription_status,
-				"subscription_plan": customer.subscription_plan,
-				"current_usage": customer.current_usage,
-				"usage_limit": customer.usage_limit,
-				"usage_remaining": usage_remaining,
-				"overage_allowed": customer.overage_allowed,
-				"preferred_engine": preferred_engine,
-				"accounting_system": accounting_integration[0] if accounting_integration else None,
-				"accounting_status": accounting_integration[1] if accounting_integration else "Not Connected",
-				"api_key": customer.api_key,
-				"webhook_secret": customer.webhook_secret
-			}
+			"user_config": user_config,
+			"job_id": job.job_id,
+			"job_name": job.name,
+			"message": "Processing job created successfully"
 		}
 		
 	except Exception as e:
-		frappe.log_error(f"Error in lookup_user_by_folder: {str(e)}")
-		return {"user_found": False, "error": "Internal server error"}
+		frappe.log_error(f"Error in ingest_file: {str(e)}")
+		return {"success": False, "error": str(e)}
 
 
 @frappe.whitelist(allow_guest=True, methods=["POST"])
+@idempotent("create")
+@rate_limited()
 def create_processing_job():
 	"""
 	n8n API endpoint to create a new processing job
@@ -101,52 +98,11 @@ def create_processing_job():
 	try:
 		data = frappe.local.form_dict
 		
-		# Validate required fields
-		required_fields = ["customer_id", "file_name", "file_id", "file_size"]
-		for field in required_fields:
-			if not data.get(field):
-				frappe.throw(f"{field} is required")
-				
-		customer_id = data.get("customer_id")
-		
-		# Verify customer exists and is active
-		customer = frappe.get_doc("SaaS Customer", customer_id)
-		if customer.subscription_status not in ["Active", "Trial"]:
-			frappe.throw("Customer subscription is not active")
-			
-		# Check quota
-		if not customer.check_usage_quota():
-			frappe.throw("Monthly processing quota exceeded")
-			
-		# Generate job ID
-		job_id = frappe.generate_hash(length=16)
-		
-		# Create processing job
-		job = frappe.get_doc({
-			"doctype": "Processing Job",
-			"job_id": job_id,
-			"customer": customer_id,
-			"file_name": data.get("file_name"),
-			"file_id": data.get("file_id"),
-			"file_url": f"https://drive.google.com/file/d/{data.get('file_id')}/view",
-			"file_size": int(data.get("file_size", 0)),
-			"file_type": data.get("file_type", "unknown"),
-			"processing_status": "Queued",
-			"started_at": now(),
-			"complexity_score": data.get("complexity_score", 0.5),
-			"quality_score": data.get("quality_score", 0.8),
-			"extraction_engine": data.get("recommended_engine", "azure"),
-			"billable": 1
-		})
-		
-		job.insert(ignore_permissions=True)
-		
-		# Increment customer usage
-		customer.increment_usage()
+		job = _create_processing_job(data)
 		
 		return {
 			"success": True,
-			"job_id": job_id,
+			"job_id": job.job_id,
 			"job_name": job.name,
 			"message": "Processing job created successfully"
 		}
@@ -157,6 +113,9 @@ def create_processing_job():
 
 
 @frappe.whitelist(allow_guest=True, methods=["POST"])
+# A retried job reports the same statuses again, so only an explicit Idempotency-Key is honoured
+@idempotent(None)
+@rate_limited()
 def update_job_status():
 	"""
 	n8n API endpoint to update processing job status
@@ -164,37 +123,10 @@ def update_job_status():
 	"""
 	try:
 		data = frappe.local.form_dict
-		job_id = data.get("job_id")
-		status = data.get("status")
 		
-		if not job_id or not status:
-			frappe.throw("job_id and status are required")
-			
-		# Find and update job
-		job_name = frappe.db.get_value("Processing Job", {"job_id": job_id}, "name")
-		if not job_name:
-			frappe.throw("Processing job not found")
-			
-		job = frappe.get_doc("Processing Job", job_name)
-		job.processing_status = status
-		
-		if status == "Processing":
-			job.started_at = now()
-		elif status in ["Completed", "Failed"]:
-			job.completed_at = now()
-			if job.started_at:
-				from frappe.utils import time_diff_in_seconds
-				job.processing_time = time_diff_in_seconds(job.completed_at, job.started_at)
-				
-		if data.get("error_message"):
-			job.error_message = data.get("error_message")
-			
-		if data.get("extraction_engine"):
-			job.extraction_engine = data.get("extraction_engine")
-			
-		job.save(ignore_permissions=True)
+		job_name, processing_status = _update_job_status(data)
 		
-		return {"success": True, "message": "Job status updated"}
+		return {"success": True, "message": "Job status updated", "processing_status": processing_status}
 		
 	except Exception as e:
 		frappe.log_error(f"Error in update_job_status: {str(e)}")
@@ -202,6 +134,8 @@ def update_job_status():
 
 
 @frappe.whitelist(allow_guest=True, methods=["POST"])
+@idempotent("result")
+@rate_limited()
 def store_processing_result():
 	"""
 	n8n API endpoint to store final processing results
@@ -209,112 +143,371 @@ def store_processing_result():
 	"""
 	try:
 		data = frappe.local.form_dict
-		job_id = data.get("job_id")
 		
-		if not job_id:
-			frappe.throw("job_id is required")
-			
-		# Find job
-		job_name = frappe.db.get_value("Processing Job", {"job_id": job_id}, "name")
-		if not job_name:
-			frappe.throw("Processing job not found")
-			
-		job = frappe.get_doc("Processing Job", job_name)
+		job = _store_processing_result(data)
 		
-		# Update job with extraction results
-		if data.get("extracted_data"):
-			job.extracted_data = json.dumps(data.get("extracted_data"))
-			
-			# Parse and store structured invoice data
-			extracted = data.get("extracted_data")
-			
-			# Store vendor information
-			vendor_info = extracted.get("vendor", {})
-			job.vendor_name = vendor_info.get("name")
-			job.vendor_address = vendor_info.get("address")
-			job.vendor_tax_id = vendor_info.get("tax_id")
+		return {
+			"success": True,
+			"job_name": job.name,
+			"message": "Processing result stored successfully"
+		}
+		
+	except Exception as e:
+		frappe.log_error(f"Error in store_processing_result: {str(e)}")
+		return {"success": False, "error": str(e)}
+
+
+def _count_batch_operations(data):
+	"""A batch takes one rate limit token per operation"""
+	operations = data.get("operations")
+	if isinstance(operations, str):
+		operations = frappe.parse_json(operations)
+	return len(operations) if isinstance(operations, list) else 1
+
+
+def _has_applied_operations(response):
+	"""Replay a batch once any chunk has committed, even if some operations failed"""
+	return bool(response.get("results"))
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+@idempotent("batch", store_if=_has_applied_operations)
+@rate_limited(cost=_count_batch_operations)
+def batch_job_operations():
+	"""
+	n8n API endpoint to apply an ordered list of job operations in one request
+	Each operation is a dict with an "op" key ("create", "status" or "result")
+	plus the same fields the single-operation endpoints accept. Operations are
+	applied in order, committed once per chunk, and reported individually so a
+	failing item does not abort the rest of the batch.
+	"""
+	results = []
+	try:
+		data = frappe.local.form_dict
+		operations = data.get("operations")
+		
+		if isinstance(operations, str):
+			operations = frappe.parse_json(operations)
 			
-			# Store invoice details
-			invoice_info = extracted.get("invoice", {})
-			job.invoice_number = invoice_info.get("number")
-			job.invoice_date = invoice_info.get("date")
-			job.due_date = invoice_info.get("due_date")
+		if not operations or not isinstance(operations, list):
+			frappe.throw("operations must be a non-empty list")
 			
-			# Store amounts
-			amounts = extracted.get("amounts", {})
-			job.total_amount = amounts.get("total")
-			job.tax_amount = amounts.get("tax")
-			job.subtotal_amount = amounts.get("subtotal")
-			job.currency_code = amounts.get("currency", "USD")
+		if len(operations) > BATCH_MAX_OPERATIONS:
+			frappe.throw(f"A batch can contain at most {BATCH_MAX_OPERATIONS} operations")
 			
-			# Store terms
-			terms = extracted.get("terms", {})
-			job.payment_terms = terms.get("payment_terms")
-			job.po_number = terms.get("po_number")
+		for start in range(0, len(operations), BATCH_CHUNK_SIZE):
+			chunk = operations[start:start + BATCH_CHUNK_SIZE]
+			results.extend(_apply_operation_chunk(chunk, offset=start))
 			
-			# Store line items as JSON for now (can be normalized later)
-			if extracted.get("line_items"):
-				job.line_items_data = json.dumps(extracted.get("line_items"))
-				job.line_items_count = len(extracted.get("line_items"))
-		
-		# Update validation status
-		if data.get("validation_status"):
-			job.validation_status = data.get("validation_status")
+		failed = len([r for r in results if not r["success"]])
+		
+		return {
+			"success": failed == 0,
+			"total": len(results),
+			"succeeded": len(results) - failed,
+			"failed": failed,
+			"results": results
+		}
+		
+	except Exception as e:
+		frappe.log_error(f"Error in batch_job_operations: {str(e)}")
+		# Chunks applied before the error are committed; report them so a retry is not applied twice
+		return {"success": False, "error": str(e), "results": results}
+
+
+def _apply_operation_chunk(chunk, offset=0):
+	"""Apply one chunk of batch operations and commit it as a unit"""
+	customers = _prefetch_customers(
+		[op.get("customer_id") for op in chunk if isinstance(op, dict) and op.get("op") == "create"])
+	job_names = _prefetch_job_names(
+		[op.get("job_id") for op in chunk if isinstance(op, dict) and op.get("op") in ("status", "result")])
+	
+	results = []
+	
+	for index, operation in enumerate(chunk, start=offset):
+		op_type = operation.get("op") if isinstance(operation, dict) else None
+		result = {"index": index, "op": op_type}
+		savepoint = f"batch_op_{index}"
+		
+		marks = None
+		
+		try:
+			if op_type not in BATCH_OPERATIONS:
+				frappe.throw(f"Unsupported operation: {op_type}")
+				
+			marks = _get_callback_marks()
+			frappe.db.savepoint(savepoint)
 			
-		if data.get("validation_errors"):
-			job.validation_errors = data.get("validation_errors")
+			if op_type == "create":
+				job = _create_processing_job(operation, customer=customers.get(operation.get("customer_id")))
+				result.update({"job_id": job.job_id, "job_name": job.name})
+				
+			elif op_type == "status":
+				job_name, processing_status = _update_job_status(operation,
+					job_name=job_names.get(operation.get("job_id")))
+				result.update({"job_id": operation.get("job_id"), "job_name": job_name,
+					"processing_status": processing_status})
+				
+			else:
+				job = _store_processing_result(operation, job_name=job_names.get(operation.get("job_id")))
+				result.update({"job_id": operation.get("job_id"), "job_name": job.name})
+				
+			frappe.db.release_savepoint(savepoint)
+			result["success"] = True
 			
-		if data.get("confidence_score"):
-			job.confidence_score = float(data.get("confidence_score"))
+		except Exception as e:
+			if marks is not None:
+				_rollback_operation(savepoint, marks)
+			result.update({"success": False, "error": str(e)})
 			
-		# Update completion status
-		job.processing_status = "Completed"
-		job.completed_at = now()
+		results.append(result)
 		
-		if job.started_at:
-			from frappe.utils import time_diff_in_seconds
-			job.processing_time = time_diff_in_seconds(job.completed_at, job.started_at)
+	frappe.db.commit()
+	
+	return results
+
+
+def _get_callback_marks():
+	"""Get how many transaction callbacks are queued, to undo those a failed operation adds"""
+	return len(frappe.db.after_commit._functions), len(frappe.db.after_rollback._functions)
+
+
+def _rollback_operation(savepoint, marks):
+	"""
+	Roll back one batch operation to its savepoint along with the callbacks it queued
+	Rolling back to a savepoint runs no callbacks, so the operation's after_commit
+	side effects are dropped and its after_rollback compensations (such as giving
+	back a processing slot) are run now
+	"""
+	frappe.db.rollback(save_point=savepoint)
+	
+	commit_mark, rollback_mark = marks
+	after_commit = frappe.db.after_commit._functions
+	while len(after_commit) > commit_mark:
+		after_commit.pop()
 		
-		# Handle accounting import status
-		if data.get("accounting_import_status"):
-			job.accounting_import_status = data.get("accounting_import_status")
-			
-		if data.get("accounting_import_id"):
-			job.accounting_import_id = data.get("accounting_import_id")
-			
-		job.save(ignore_permissions=True)
+	after_rollback = frappe.db.after_rollback._functions
+	compensations = []
+	while len(after_rollback) > rollback_mark:
+		compensations.append(after_rollback.pop())
 		
-		# Send completion notification to customer
+	for compensate in reversed(compensations):
 		try:
-			customer = frappe.get_doc("SaaS Customer", job.customer)
-			frappe.sendmail(
-				recipients=[customer.email],
-				subject=f"Invoice Processing Complete - {job.file_name}",
-				template="processing_complete",
-				args={
-					"customer_name": customer.customer_name,
-					"file_name": job.file_name,
-					"processing_status": job.processing_status,
-					"validation_status": job.validation_status,
-					"confidence_score": job.confidence_score,
-					"dashboard_url": f"{frappe.utils.get_url()}/dashboard"
-				}
-			)
-		except Exception as email_error:
-			frappe.log_error(f"Failed to send completion email: {str(email_error)}")
+			compensate()
+		except Exception as e:
+			frappe.log_error(f"Error undoing batch operation side effect: {str(e)}", "Batch Job Operations")
+
+
+def _prefetch_customers(customer_ids):
+	"""Load the SaaS Customers referenced by a chunk with a single query"""
+	customer_ids = list(set(filter(None, customer_ids)))
+	if not customer_ids:
+		return {}
 		
-		return {
-			"success": True,
-			"job_name": job.name,
-			"message": "Processing result stored successfully"
+	customers = frappe.get_all("SaaS Customer",
+		filters={"name": ["in", customer_ids]},
+		fields=JOB_CUSTOMER_FIELDS)
+		
+	return {customer.name: customer for customer in customers}
+
+
+def _prefetch_job_names(job_ids):
+	"""Resolve n8n job IDs to Processing Job names with a single query"""
+	job_ids = list(set(filter(None, job_ids)))
+	if not job_ids:
+		return {}
+		
+	jobs = frappe.get_all("Processing Job",
+		filters={"job_id": ["in", job_ids]},
+		fields=["name", "job_id"])
+		
+	return {job.job_id: job.name for job in jobs}
+
+
+def _create_processing_job(data, customer=None):
+	"""
+	Validate a job creation request, reserve quota for it and insert the Processing Job
+	customer only needs the JOB_CUSTOMER_FIELDS and is loaded when not passed
+	"""
+	# Validate required fields
+	required_fields = ["customer_id", "file_name", "file_id", "file_size"]
+	for field in required_fields:
+		if not data.get(field):
+			frappe.throw(f"{field} is required")
+			
+	customer_id = data.get("customer_id")
+	
+	# Verify customer exists and is active
+	if not customer:
+		customer = frappe.db.get_value("SaaS Customer", customer_id, JOB_CUSTOMER_FIELDS, as_dict=True)
+	if not customer:
+		frappe.throw(f"Customer {customer_id} not found")
+	if customer.subscription_status not in ["Active", "Trial"]:
+		frappe.throw("Customer subscription is not active")
+		
+	# Generate job ID
+	job_id = frappe.generate_hash(length=16)
+	
+	# Reserve quota; it is committed when the job completes and released if it fails
+	quota.reserve(customer.name, job_id, customer.usage_limit, customer.overage_allowed)
+	
+	# Create processing job
+	job = frappe.get_doc({
+		"doctype": "Processing Job",
+		"job_id": job_id,
+		"customer": customer_id,
+		"file_name": data.get("file_name"),
+		"file_id": data.get("file_id"),
+		"file_url": f"https://drive.google.com/file/d/{data.get('file_id')}/view",
+		"file_size": int(data.get("file_size", 0)),
+		"file_type": data.get("file_type", "unknown"),
+		"processing_status": "Queued",
+		"started_at": now(),
+		# n8n is already working on the file, so it needs no dispatch
+		"dispatched_at": now(),
+		"complexity_score": data.get("complexity_score", 0.5),
+		"quality_score": data.get("quality_score", 0.8),
+		"extraction_engine": data.get("recommended_engine", "azure"),
+		"billable": 1
+	})
+	
+	try:
+		job.insert(ignore_permissions=True)
+	except Exception:
+		quota.release(customer.name, job_id)
+		raise
+	
+	return job
+
+
+def _get_job_name(job_id):
+	"""Resolve an n8n job ID to the Processing Job name"""
+	job_name = frappe.db.get_value("Processing Job", {"job_id": job_id}, "name")
+	if not job_name:
+		frappe.throw("Processing job not found")
+	return job_name
+
+
+def _update_job_status(data, job_name=None):
+	"""Apply a status update from n8n to a Processing Job and return its name and resulting status"""
+	job_id = data.get("job_id")
+	status = data.get("status")
+	
+	if not job_id or not status:
+		frappe.throw("job_id and status are required")
+		
+	# Find and update job
+	if not job_name:
+		job_name = _get_job_name(job_id)
+		
+	# Single conditional UPDATE; side effects only run if the status changed
+	processing_status = job_state.transition(
+		job_name,
+		status,
+		expected_status=data.get("expected_status"),
+		error_message=data.get("error_message"),
+		extraction_engine=data.get("extraction_engine")
+	)
+	
+	return job_name, processing_status
+
+
+def _store_processing_result(data, job_name=None):
+	"""Store n8n extraction results on a Processing Job, complete it and notify the customer"""
+	job_id = data.get("job_id")
+	
+	if not job_id:
+		frappe.throw("job_id is required")
+		
+	# Find job
+	if not job_name:
+		job_name = _get_job_name(job_id)
+		
+	# The results are written by the same conditional UPDATE that completes the job
+	job_state.transition(job_name, "Completed", result=_get_result_fields(data))
+	
+	job = frappe.db.get_value("Processing Job", job_name,
+		["name", "customer", "file_name", "processing_status", "validation_status", "confidence_score"],
+		as_dict=True)
+	
+	# Queue completion notification to customer
+	queue_notification(
+		job.customer,
+		template="processing_complete",
+		subject=f"Invoice Processing Complete - {job.file_name}",
+		args={
+			"file_name": job.file_name,
+			"processing_status": job.processing_status,
+			"validation_status": job.validation_status,
+			"confidence_score": job.confidence_score,
+			"dashboard_url": f"{frappe.utils.get_url()}/dashboard"
 		}
+	)
 		
-	except Exception as e:
-		frappe.log_error(f"Error in store_processing_result: {str(e)}")
-		return {"success": False, "error": str(e)}
+	return job
+
+
+def _get_result_fields(data):
+	"""Map an n8n result payload to Processing Job columns"""
+	fields = {}
+	
+	# Update job with extraction results
+	if data.get("extracted_data"):
+		extracted = data.get("extracted_data")
+		fields["extracted_data"] = json.dumps(extracted)
+		
+		# Store vendor information
+		vendor_info = extracted.get("vendor", {})
+		fields["vendor_name"] = vendor_info.get("name")
+		fields["vendor_address"] = vendor_info.get("address")
+		fields["vendor_tax_id"] = vendor_info.get("tax_id")
+		
+		# Store invoice details
+		invoice_info = extracted.get("invoice", {})
+		fields["invoice_number"] = invoice_info.get("number")
+		fields["invoice_date"] = invoice_info.get("date")
+		fields["due_date"] = invoice_info.get("due_date")
+		
+		# Store amounts
+		amounts = extracted.get("amounts", {})
+		fields["total_amount"] = amounts.get("total")
+		fields["tax_amount"] = amounts.get("tax")
+		fields["subtotal_amount"] = amounts.get("subtotal")
+		fields["currency_code"] = amounts.get("currency", "USD")
+		
+		# Store terms
+		terms = extracted.get("terms", {})
+		fields["payment_terms"] = terms.get("payment_terms")
+		fields["po_number"] = terms.get("po_number")
+		
+		# Store line items as JSON for now (can be normalized later)
+		if extracted.get("line_items"):
+			fields["line_items_data"] = json.dumps(extracted.get("line_items"))
+			fields["line_items_count"] = len(extracted.get("line_items"))
+	
+	# Update validation status
+	if data.get("validation_status"):
+		fields["validation_status"] = data.get("validation_status")
+		
+	if data.get("validation_errors"):
+		fields["validation_errors"] = data.get("validation_errors")
+		
+	if data.get("confidence_score"):
+		fields["confidence_score"] = flt(data.get("confidence_score"))
+		
+	# Handle accounting import status
+	if data.get("accounting_import_status"):
+		fields["accounting_import_status"] = data.get("accounting_import_status")
+		
+	if data.get("accounting_import_id"):
+		fields["accounting_import_id"] = data.get("accounting_import_id")
+		
+	return fields
 
 
 @frappe.whitelist(allow_guest=True, methods=["POST"])
+@idempotent("usage")
+@rate_limited()
 def update_usage_tracking():
 	"""
 	n8n API endpoint to update customer usage statistics
@@ -327,57 +520,33 @@ def update_usage_tracking():
 		if not customer_id:
 			frappe.throw("customer_id is required")
 			
-		# Get or create usage tracking record for current month
-		from frappe.utils import get_first_day
-		current_month = get_first_day(nowdate()).strftime("%Y-%m")
-		
-		usage_tracking = frappe.db.get_value("Usage Tracking", 
-			{"customer": customer_id, "month": current_month}, "name")
-			
-		if usage_tracking:
-			usage_doc = frappe.get_doc("Usage Tracking", usage_tracking)
-		else:
-			customer = frappe.get_doc("SaaS Customer", customer_id)
-			usage_doc = frappe.get_doc({
-				"doctype": "Usage Tracking",
-				"customer": customer_id,
-				"month": current_month,
-				"plan_limit": customer.usage_limit,
-				"processed_count": 0,
-				"successful_count": 0,
-				"failed_count": 0,
-				"overage_count": 0,
-				"overage_charges": 0,
-				"billing_status": "Pending"
-			})
-			usage_doc.insert(ignore_permissions=True)
-		
 		# Update counters based on job status
 		job_status = data.get("job_status", "completed")
 		
+		counters = {}
 		if job_status == "completed":
-			usage_doc.processed_count += 1
-			usage_doc.successful_count += 1
+			counters = {"processed": 1, "successful": 1}
 		elif job_status == "failed":
-			usage_doc.processed_count += 1
-			usage_doc.failed_count += 1
-		
-		# Calculate overage
-		if usage_doc.processed_count > usage_doc.plan_limit:
-			usage_doc.overage_count = usage_doc.processed_count - usage_doc.plan_limit
+			counters = {"processed": 1, "failed": 1}
+			
+		# Atomic upsert of the current month's record; overage and charges are
+		# derived from the counters when read or billed
+		usage_tracking = increment_usage_counters(customer_id,
+			engine=data.get("extraction_engine"),
+			processing_time=flt(data.get("processing_time")) if data.get("processing_time") else None,
+			confidence_score=flt(data.get("confidence_score")) if data.get("confidence_score") else None,
+			**counters)
+			
+		usage = frappe.db.get_value("Usage Tracking", usage_tracking,
+			["processed_count", "plan_limit"], as_dict=True)
+		if not usage:
+			frappe.throw(f"Customer {customer_id} not found")
 			
-			# Calculate overage charges (if applicable)
-			if data.get("overage_rate"):
-				usage_doc.overage_charges = usage_doc.overage_count * float(data.get("overage_rate"))
-		
-		usage_doc.last_updated = now()
-		usage_doc.save(ignore_permissions=True)
-		
 		return {
 			"success": True,
 			"message": "Usage tracking updated",
-			"current_usage": usage_doc.processed_count,
-			"overage_count": usage_doc.overage_count
+			"current_usage": usage.processed_count,
+			"overage_count": get_derived_charges(usage.processed_count, usage.plan_limit)["overage_count"]
 		}
 		
 	except Exception as e:
@@ -386,6 +555,7 @@ def update_usage_tracking():
 
 
 @frappe.whitelist(allow_guest=True, methods=["POST"])
+@rate_limited()
 def log_processing_event():
 	"""
 	n8n API endpoint to log processing events for debugging and analytics
@@ -393,18 +563,17 @@ def log_processing_event():
 	try:
 		data = frappe.local.form_dict
 		
-		# Create a processing log entry
-		log_entry = frappe.get_doc({
-			"doctype": "Processing Log",
-			"job_id": data.get("job_id"),
-			"customer": data.get("customer_id"),
-			"event_type": data.get("event_type", "info"),
-			"event_message": data.get("message", ""),
-			"event_data": json.dumps(data.get("event_data", {})) if data.get("event_data") else None,
-			"timestamp": now()
-		})
+		if not data.get("job_id"):
+			return {"success": False, "error": "job_id is required"}
 		
-		log_entry.insert(ignore_permissions=True)
+		# Buffered; written to the event log table in batches
+		event_log.log_event(
+			data.get("job_id"),
+			customer=data.get("customer_id"),
+			event_type=data.get("event_type", "info"),
+			message=data.get("message", ""),
+			event_data=data.get("event_data")
+		)
 		
 		return {"success": True, "message": "Event logged"}
 		
@@ -433,7 +602,8 @@ def get_n8n_webhook_urls():
 			"user_lookup": f"{settings.n8n_webhook_base_url}/webhook/user-lookup",
 			"job_creation": f"{settings.n8n_webhook_base_url}/webhook/create-job",
 			"job_update": f"{settings.n8n_webhook_base_url}/webhook/update-job",
-			"store_result": f"{settings.n8n_webhook_base_url}/webhook/store-result"
+			"store_result": f"{settings.n8n_webhook_base_url}/webhook/store-result",
+			"job_dispatch": f"{settings.n8n_webhook_base_url}/webhook/dispatch-jobs"
 		}
 	}
 
@@ -445,14 +615,13 @@ def test_n8n_connection():
 		settings = frappe.get_single("Invoice Processing Settings")
 		
 		# Make a test request to n8n
-		import requests
-		
 		test_data = {
 			"test": True,
 			"timestamp": now()
 		}
 		
-		response = requests.post(
+		response = http_client.post(
+			"n8n",
 			f"{settings.n8n_webhook_base_url}/webhook/test",
 			json=test_data,
 			timeout=10
@@ -4,8 +4,8 @@
 import frappe
 from frappe.model.document import Document
 from frappe.utils import now
-import requests
 import json
+from invoice_processing_saas.identity import can_access_customer, get_session_customer_name
 
 
 class AccountingIntegration(Document):
@@ -16,12 +16,8 @@ class AccountingIntegration(Document):
 		
 	def validate_customer_permissions(self):
 		"""Ensure user can only access their own integration"""
-		if frappe.session.user != "Administrator":
-			user_email = frappe.session.user
-			customer_email = frappe.db.get_value("SaaS Customer", self.customer, "email")
-			
-			if user_email != customer_email and not frappe.has_permission("Accounting Integration", "write"):
-				frappe.throw("Access denied")
+		if not can_access_customer(self.customer, "Accounting Integration", "write"):
+			frappe.throw("Access denied")
 				
 	def validate_required_fields(self):
 		"""Validate required fields based on accounting system"""
@@ -139,11 +135,9 @@ class AccountingIntegration(Document):
 			if not self.refresh_token:
 				return {"success": False, "error": "No refresh token available"}
 				
-			# Mock token refresh
-			self.access_token = f"new_token_{frappe.generate_hash(length=16)}"
-			self.save(ignore_permissions=True)
-			
-			return {"success": True, "message": "Access token refreshed"}
+			# Shares the per-integration lock with the scheduled refresh
+			from invoice_processing_saas.token_refresh import refresh_integration
+			return refresh_integration(self.doctype, self.name)
 			
 		except Exception as e:
 			return {"success": False, "error": str(e)}
@@ -166,8 +160,7 @@ def test_accounting_connection(integration_name):
 def get_customer_accounting_integration(customer_name=None):
 	"""Get customer's accounting integration"""
 	if not customer_name:
-		customer_name = frappe.db.get_value("SaaS Customer", 
-			{"email": frappe.session.user}, "name")
+		customer_name = get_session_customer_name()
 			
 	if not customer_name:
 		return None
@@ -3,12 +3,8 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import now, get_datetime
-import json
-import requests
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from frappe.utils import now
+from invoice_processing_saas.identity import can_access_customer, get_session_customer_name
 
 
 class DriveIntegration(Document):
@@ -35,12 +31,8 @@ class DriveIntegration(Document):
 				
 	def validate_customer_permissions(self):
 		"""Ensure user can only access their own integration"""
-		if frappe.session.user != "Administrator":
-			user_email = frappe.session.user
-			customer_email = frappe.db.get_value("SaaS Customer", self.customer, "email")
-			
-			if user_email != customer_email and not frappe.has_permission("Drive Integration", "write"):
-				frappe.throw("Access denied")
+		if not can_access_customer(self.customer, "Drive Integration", "write"):
+			frappe.throw("Access denied")
 				
 	def before_insert(self):
 		"""Set default values before inserting"""
@@ -133,8 +125,7 @@ def test_drive_connection(integration_name):
 def get_customer_drive_integration(customer_name=None):
 	"""Get customer's drive integration"""
 	if not customer_name:
-		customer_name = frappe.db.get_value("SaaS Customer", 
-			{"email": frappe.session.user}, "name")
+		customer_name = get_session_customer_name()
 			
 	if not customer_name:
 		return None
@@ -3,24 +3,42 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import now, time_diff_in_seconds
+from frappe.utils import now, time_diff_in_seconds, cint, add_days, getdate
+import base64
 import json
+from invoice_processing_saas import concurrency, job_state, retries
+from invoice_processing_saas.notifications import queue_notification
+from invoice_processing_saas.job_rollup import get_month_stats
+from invoice_processing_saas.identity import can_access_customer, get_session_customer_name
+
+# Fields returned by customer job listings
+JOB_LIST_FIELDS = ["name", "job_id", "file_name", "processing_status", "validation_status",
+	"started_at", "completed_at", "processing_time", "extraction_engine",
+	"vendor_name", "invoice_number", "total_amount", "confidence_score"]
+MAX_PAGE_SIZE = 100
 
 
 class ProcessingJob(Document):
 	def validate(self):
 		"""Validate processing job data"""
 		self.validate_customer_permissions()
+		self.validate_processing_slot()
 		self.update_processing_time()
 		
 	def validate_customer_permissions(self):
 		"""Ensure user can only access their own jobs"""
-		if frappe.session.user != "Administrator":
-			user_email = frappe.session.user
-			customer_email = frappe.db.get_value("SaaS Customer", self.customer, "email")
+		if not can_access_customer(self.customer, "Processing Job", "write"):
+			frappe.throw("Access denied")
+				
+	def validate_processing_slot(self):
+		"""Take a processing slot when the job starts processing, as job_state transitions do"""
+		if self.processing_status != "Processing" or not self.customer:
+			return
 			
-			if user_email != customer_email and not frappe.has_permission("Processing Job", "write"):
-				frappe.throw("Access denied")
+		if not self.has_value_changed("processing_status"):
+			return
+			
+		concurrency.start(self.customer, self.name)
 				
 	def update_processing_time(self):
 		"""Calculate processing time if completed"""
@@ -52,8 +70,8 @@ class ProcessingJob(Document):
 		if error_message:
 			self.error_message = error_message
 			
+		# The customer is notified once the job will not be retried (see job_state)
 		self.save(ignore_permissions=True)
-		self.notify_customer_failure()
 		
 	def store_extracted_data(self, extracted_data):
 		"""Store extracted invoice data"""
@@ -113,55 +131,21 @@ class ProcessingJob(Document):
 		if self.processing_status != "Failed":
 			frappe.throw("Can only retry failed jobs")
 			
-		self.retry_count = (self.retry_count or 0) + 1
-		if self.retry_count > 3:
+		if cint(self.retry_count) >= retries.MAX_RETRIES:
 			frappe.throw("Maximum retry attempts exceeded")
 			
-		self.processing_status = "Retry"
-		self.error_message = None
-		self.save(ignore_permissions=True)
+		# The dispatcher hands the job to n8n, so this request does not wait on it
+		job_state.transition(self.name, "Retry", expected_status="Failed")
+		self.reload()
 		
-		# Trigger n8n retry (this would call n8n API)
-		self.trigger_n8n_retry()
-		
-	def trigger_n8n_retry(self):
-		"""Trigger n8n workflow for retry"""
-		try:
-			settings = frappe.get_single("Invoice Processing Settings")
-			
-			# Make API call to n8n retry endpoint
-			import requests
-			
-			retry_data = {
-				"job_id": self.job_id,
-				"retry_count": self.retry_count,
-				"file_id": self.file_id,
-				"customer_id": self.customer
-			}
-			
-			response = requests.post(
-				f"{settings.n8n_webhook_base_url}/webhook/retry-job",
-				json=retry_data,
-				timeout=30
-			)
-			
-			if response.status_code != 200:
-				frappe.log_error(f"Failed to trigger n8n retry: {response.text}")
-				
-		except Exception as e:
-			frappe.log_error(f"Error triggering n8n retry: {str(e)}")
-			
 	def notify_customer_completion(self):
-		"""Send completion notification to customer"""
+		"""Queue completion notification to customer"""
 		try:
-			customer = frappe.get_doc("SaaS Customer", self.customer)
-			
-			frappe.sendmail(
-				recipients=[customer.email],
-				subject=f"Invoice Processing Complete - {self.file_name}",
+			queue_notification(
+				self.customer,
 				template="processing_complete",
+				subject=f"Invoice Processing Complete - {self.file_name}",
 				args={
-					"customer_name": customer.customer_name,
 					"file_name": self.file_name,
 					"processing_status": self.processing_status,
 					"validation_status": self.validation_status,
@@ -174,19 +158,16 @@ class ProcessingJob(Document):
 				}
 			)
 		except Exception as e:
-			frappe.log_error(f"Failed to send completion notification: {str(e)}")
+			frappe.log_error(f"Failed to queue completion notification: {str(e)}")
 			
 	def notify_customer_failure(self):
-		"""Send failure notification to customer"""
+		"""Queue failure notification to customer"""
 		try:
-			customer = frappe.get_doc("SaaS Customer", self.customer)
-			
-			frappe.sendmail(
-				recipients=[customer.email],
-				subject=f"Invoice Processing Failed - {self.file_name}",
+			queue_notification(
+				self.customer,
 				template="processing_failed",
+				subject=f"Invoice Processing Failed - {self.file_name}",
 				args={
-					"customer_name": customer.customer_name,
 					"file_name": self.file_name,
 					"error_message": self.error_message or "Unknown error occurred",
 					"retry_count": self.retry_count,
@@ -195,7 +176,7 @@ class ProcessingJob(Document):
 				}
 			)
 		except Exception as e:
-			frappe.log_error(f"Failed to send failure notification: {str(e)}")
+			frappe.log_error(f"Failed to queue failure notification: {str(e)}")
 			
 	def export_to_accounting_system(self):
 		"""Export processed data to accounting system (manual trigger)"""
@@ -222,64 +203,112 @@ class ProcessingJob(Document):
 
 @frappe.whitelist()
 def get_customer_jobs(customer_name=None, limit=20):
-	"""Get processing jobs for a customer"""
+	"""Get the latest processing jobs for a customer"""
+	page = get_customer_jobs_page(customer_name, limit=limit)
+	return page["jobs"]
+
+
+@frappe.whitelist()
+def get_customer_jobs_page(customer_name=None, cursor=None, limit=20, processing_status=None,
+	validation_status=None, from_date=None, to_date=None):
+	"""
+	Get one page of a customer's processing jobs, newest first
+	Pass next_cursor from the previous page to get the next one
+	"""
 	if not customer_name:
 		# Get customer by current user email
-		customer_name = frappe.db.get_value("SaaS Customer", 
-			{"email": frappe.session.user}, "name")
+		customer_name = get_session_customer_name()
 			
 	if not customer_name:
-		return []
+		return {"jobs": [], "next_cursor": None}
 		
 	# Check permissions
-	customer = frappe.get_doc("SaaS Customer", customer_name)
-	if frappe.session.user != customer.email and not frappe.has_permission("Processing Job", "read"):
+	if not can_access_customer(customer_name, "Processing Job", "read"):
 		frappe.throw("Access denied")
 		
-	jobs = frappe.get_all("Processing Job",
-		filters={"customer": customer_name},
-		fields=["name", "job_id", "file_name", "processing_status", "validation_status",
-				"started_at", "completed_at", "processing_time", "extraction_engine",
-				"vendor_name", "invoice_number", "total_amount", "confidence_score"],
-		order_by="creation desc",
-		limit=limit
-	)
+	return query_customer_jobs(customer_name, JOB_LIST_FIELDS, cursor=cursor, limit=limit,
+		processing_status=processing_status, validation_status=validation_status,
+		from_date=from_date, to_date=to_date)
+
+
+def query_customer_jobs(customer_name, fields, cursor=None, limit=20, processing_status=None,
+	validation_status=None, from_date=None, to_date=None):
+	"""
+	Keyset paginated job query ordered by (creation, name) descending
+	Each page is a range scan on the (customer, creation) index, however deep it is
+	"""
+	limit = min(max(cint(limit), 1), MAX_PAGE_SIZE)
+	conditions = ["customer = %(customer)s"]
+	values = {"customer": customer_name, "limit": limit + 1}
+	
+	if processing_status:
+		conditions.append("processing_status = %(processing_status)s")
+		values["processing_status"] = processing_status
+		
+	if validation_status:
+		conditions.append("validation_status = %(validation_status)s")
+		values["validation_status"] = validation_status
+		
+	if from_date:
+		conditions.append("creation >= %(from_date)s")
+		values["from_date"] = getdate(from_date)
+		
+	if to_date:
+		conditions.append("creation < %(to_date)s")
+		values["to_date"] = add_days(getdate(to_date), 1)
+		
+	if cursor:
+		values["cursor_creation"], values["cursor_name"] = _decode_cursor(cursor)
+		# Spelled out instead of a row comparison so the optimizer uses a range scan
+		conditions.append("creation <= %(cursor_creation)s")
+		conditions.append("(creation < %(cursor_creation)s OR name < %(cursor_name)s)")
+		
+	select_fields = list(dict.fromkeys(list(fields) + ["name", "creation"]))
 	
-	return jobs
+	jobs = frappe.db.sql(f"""
+		SELECT {", ".join(f"`{field}`" for field in select_fields)}
+		FROM `tabProcessing Job`
+		WHERE {" AND ".join(conditions)}
+		ORDER BY creation DESC, name DESC
+		LIMIT %(limit)s
+	""", values, as_dict=True)
+	
+	next_cursor = None
+	if len(jobs) > limit:
+		jobs = jobs[:limit]
+		next_cursor = _encode_cursor(jobs[-1].creation, jobs[-1].name)
+		
+	if "creation" not in fields:
+		for job in jobs:
+			job.pop("creation")
+			
+	return {"jobs": jobs, "next_cursor": next_cursor}
+
+
+def _encode_cursor(creation, name):
+	payload = json.dumps([str(creation), name])
+	return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def _decode_cursor(cursor):
+	try:
+		creation, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+	except Exception:
+		frappe.throw("Invalid cursor")
+	return creation, name
 
 
 @frappe.whitelist()
 def get_job_statistics(customer_name=None):
 	"""Get job statistics for dashboard"""
 	if not customer_name:
-		customer_name = frappe.db.get_value("SaaS Customer", 
-			{"email": frappe.session.user}, "name")
+		customer_name = get_session_customer_name()
 			
 	if not customer_name:
 		return {}
 		
-	from frappe.utils import get_first_day, get_last_day, today
-	
-	# Current month stats
-	start_date = get_first_day(today())
-	end_date = get_last_day(today())
-	
-	stats = frappe.db.sql("""
-		SELECT 
-			COUNT(*) as total_jobs,
-			SUM(CASE WHEN processing_status = 'Completed' THEN 1 ELSE 0 END) as completed,
-			SUM(CASE WHEN processing_status = 'Failed' THEN 1 ELSE 0 END) as failed,
-			SUM(CASE WHEN processing_status IN ('Queued', 'Processing') THEN 1 ELSE 0 END) as in_progress,
-			AVG(processing_time) as avg_processing_time,
-			AVG(confidence_score) as avg_confidence_score
-		FROM `tabProcessing Job`
-		WHERE customer = %s AND DATE(creation) BETWEEN %s AND %s
-	""", (customer_name, start_date, end_date), as_dict=1)
-	
-	return stats[0] if stats else {
-		"total_jobs": 0, "completed": 0, "failed": 0, "in_progress": 0,
-		"avg_processing_time": 0, "avg_confidence_score": 0
-	}
+	# Current month stats, summed from the daily rollups
+	return get_month_stats(customer_name)
 
 
 @frappe.whitelist()
@@ -288,8 +317,7 @@ def retry_failed_job(job_name):
 	job = frappe.get_doc("Processing Job", job_name)
 	
 	# Check permissions
-	customer = frappe.get_doc("SaaS Customer", job.customer)
-	if frappe.session.user != customer.email and not frappe.has_permission("Processing Job", "write"):
+	if not can_access_customer(job.customer, "Processing Job", "write"):
 		frappe.throw("Access denied")
 		
 	job.retry_processing()
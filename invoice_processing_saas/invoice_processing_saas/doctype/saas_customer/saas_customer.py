@@ -6,6 +6,14 @@ from frappe.model.document import Document
 from frappe.utils import today, add_days, get_datetime, nowdate
 import secrets
 import string
+from invoice_processing_saas import quota
+from invoice_processing_saas.api_keys import hash_api_key, get_api_key_prefix
+from invoice_processing_saas.notifications import queue_notification
+from invoice_processing_saas.job_rollup import get_month_stats
+from invoice_processing_saas.http_cache import conditional_get
+from invoice_processing_saas.plan_catalog import get_plan
+from invoice_processing_saas.identity import can_access_customer, get_session_customer_name
+from invoice_processing_saas.invoice_processing_saas.doctype.processing_job.processing_job import query_customer_jobs
 
 
 class SaaSCustomer(Document):
@@ -25,6 +33,7 @@ class SaaSCustomer(Document):
 		self.validate_email()
 		self.validate_subscription_dates()
 		self.update_usage_limit_if_plan_changed()
+		self.set_api_key_hash()
 		
 	def generate_api_credentials(self):
 		"""Generate API key and webhook secret for n8n integration"""
@@ -37,6 +46,25 @@ class SaaSCustomer(Document):
 			# Generate webhook secret for n8n authentication
 			self.webhook_secret = ''.join(secrets.choice(alphabet) for _ in range(16))
 			
+	def set_api_key_hash(self):
+		"""Store the lookup prefix and hash of a newly set API key"""
+		# A loaded document only holds the masked key, which has nothing to hash
+		if self.api_key and not self.is_dummy_password(self.api_key):
+			self.api_key_prefix = get_api_key_prefix(self.api_key)
+			self.api_key_hash = hash_api_key(self.api_key)
+			
+	@frappe.whitelist()
+	def regenerate_api_key(self):
+		"""Replace the API key; the old key stops working once this is saved"""
+		self.check_permission("write")
+		
+		self.api_key = None
+		self.generate_api_credentials()
+		api_key = self.api_key
+		self.save()
+		
+		return {"api_key": api_key}
+		
 	def set_trial_period(self):
 		"""Set trial period for new customers"""
 		if not self.subscription_start_date:
@@ -45,14 +73,14 @@ class SaaSCustomer(Document):
 		if not self.trial_end_date and self.subscription_status == "Trial":
 			# Get trial days from subscription plan
 			if self.subscription_plan:
-				plan = frappe.get_doc("Subscription Plan", self.subscription_plan)
+				plan = get_plan(self.subscription_plan)
 				trial_days = plan.trial_days or 14
 				self.trial_end_date = add_days(today(), trial_days)
 				
 	def set_usage_limit_from_plan(self):
 		"""Set usage limit based on subscription plan"""
 		if self.subscription_plan and not self.usage_limit:
-			plan = frappe.get_doc("Subscription Plan", self.subscription_plan)
+			plan = get_plan(self.subscription_plan)
 			self.usage_limit = plan.processing_limit
 			
 	def validate_email(self):
@@ -72,7 +100,7 @@ class SaaSCustomer(Document):
 	def update_usage_limit_if_plan_changed(self):
 		"""Update usage limit when plan changes"""
 		if self.has_value_changed("subscription_plan") and self.subscription_plan:
-			plan = frappe.get_doc("Subscription Plan", self.subscription_plan)
+			plan = get_plan(self.subscription_plan)
 			self.usage_limit = plan.processing_limit
 			
 	def create_user_if_needed(self):
@@ -113,39 +141,28 @@ class SaaSCustomer(Document):
 				
 	def check_usage_quota(self):
 		"""Check if customer has available quota"""
-		if self.current_usage >= self.usage_limit:
+		if quota.get_usage(self.name) >= (self.usage_limit or 0):
 			if not self.overage_allowed:
 				frappe.throw("Monthly processing quota exceeded. Please upgrade your plan.")
 			return False
 		return True
 		
 	def increment_usage(self):
-		"""Increment current usage counter"""
-		self.current_usage = (self.current_usage or 0) + 1
-		self.total_processed = (self.total_processed or 0) + 1
-		self.last_activity = frappe.utils.now()
-		self.save(ignore_permissions=True)
+		"""Count one processed job that had no quota reservation"""
+		self.current_usage = quota.commit(self.name)
 		
-		# Check if approaching limit
-		usage_percentage = (self.current_usage / self.usage_limit) * 100
-		if usage_percentage >= 80 and usage_percentage < 85:
-			self.send_usage_warning(80)
-		elif usage_percentage >= 90 and usage_percentage < 95:
-			self.send_usage_warning(90)
-		elif usage_percentage >= 100:
-			self.send_usage_warning(100)
-			
 	def send_usage_warning(self, percentage):
-		"""Send usage warning email"""
+		"""Queue usage warning email"""
 		try:
 			subject = f"Usage Alert: {percentage}% of quota used"
 			if percentage >= 100:
 				subject = "Quota Exceeded - Action Required"
 				
-			frappe.sendmail(
-				recipients=[self.email],
-				subject=subject,
+			queue_notification(
+				self.name,
 				template="usage_warning",
+				subject=subject,
+				dedupe_key=f"usage_warning:{percentage}",
 				args={
 					"customer_name": self.customer_name,
 					"current_usage": self.current_usage,
@@ -155,12 +172,12 @@ class SaaSCustomer(Document):
 				}
 			)
 		except Exception as e:
-			frappe.log_error(f"Failed to send usage warning to {self.email}: {str(e)}")
+			frappe.log_error(f"Failed to queue usage warning for {self.email}: {str(e)}")
 			
 	def reset_monthly_usage(self):
 		"""Reset monthly usage counter (called by scheduled job)"""
-		self.current_usage = 0
-		self.save(ignore_permissions=True)
+		quota.reset_usage(self.name)
+		self.db_set("current_usage", 0)
 		
 	def get_integration_status(self):
 		"""Get status of all integrations"""
@@ -192,32 +209,20 @@ class SaaSCustomer(Document):
 		
 	def get_recent_jobs(self, limit=10):
 		"""Get recent processing jobs"""
-		return frappe.get_all("Processing Job",
-			filters={"customer": self.name},
-			fields=["name", "file_name", "processing_status", "completed_at", "extraction_engine"],
-			order_by="creation desc",
+		return query_customer_jobs(self.name,
+			["name", "file_name", "processing_status", "completed_at", "extraction_engine"],
 			limit=limit
-		)
+		)["jobs"]
 		
 	def get_monthly_stats(self):
 		"""Get monthly processing statistics"""
-		from frappe.utils import get_first_day, get_last_day
-		
-		start_date = get_first_day(today())
-		end_date = get_last_day(today())
+		stats = get_month_stats(self.name)
 		
-		stats = frappe.db.sql("""
-			SELECT 
-				COUNT(*) as total_jobs,
-				SUM(CASE WHEN processing_status = 'Completed' THEN 1 ELSE 0 END) as successful,
-				SUM(CASE WHEN processing_status = 'Failed' THEN 1 ELSE 0 END) as failed,
-				AVG(processing_time) as avg_processing_time
-			FROM `tabProcessing Job`
-			WHERE customer = %s AND DATE(creation) BETWEEN %s AND %s
-		""", (self.name, start_date, end_date), as_dict=1)
-		
-		return stats[0] if stats else {
-			"total_jobs": 0, "successful": 0, "failed": 0, "avg_processing_time": 0
+		return {
+			"total_jobs": stats.total_jobs,
+			"successful": stats.completed,
+			"failed": stats.failed,
+			"avg_processing_time": stats.avg_processing_time
 		}
 		
 
@@ -226,17 +231,26 @@ def get_customer_dashboard_data(customer_name=None):
 	"""API endpoint for customer dashboard data"""
 	if not customer_name:
 		# Get customer by current user email
-		customer_name = frappe.db.get_value("SaaS Customer", {"email": frappe.session.user}, "name")
+		customer_name = get_session_customer_name()
 		
 	if not customer_name:
 		frappe.throw("Customer not found")
 		
-	customer = frappe.get_doc("SaaS Customer", customer_name)
-	
 	# Check permissions
-	if frappe.session.user != customer.email and not frappe.has_permission("SaaS Customer", "read", customer_name):
+	if not can_access_customer(customer_name, "SaaS Customer", "read", customer_name):
 		frappe.throw("Not permitted")
 		
+	# Served from the per-customer cache, or 304 if the client has the current version
+	return conditional_get(customer_name, "dashboard", lambda: _build_dashboard_data(customer_name))
+
+
+def _build_dashboard_data(customer_name):
+	"""Assemble the customer dashboard payload"""
+	customer = frappe.get_doc("SaaS Customer", customer_name)
+	
+	# current_usage on the document lags the quota counters until the next sync
+	customer.current_usage = quota.get_usage(customer.name)
+	
 	return {
 		"customer_info": {
 			"name": customer.customer_name,
@@ -270,11 +284,12 @@ def check_quota_available(folder_id):
 		return {"quota_available": False, "error": "Subscription inactive"}
 		
 	# Check quota
-	quota_available = customer.current_usage < customer.usage_limit or customer.overage_allowed
+	current_usage = quota.get_usage(customer.name)
+	quota_available = current_usage < customer.usage_limit or customer.overage_allowed
 	
 	return {
 		"quota_available": quota_available,
-		"current_usage": customer.current_usage,
+		"current_usage": current_usage,
 		"usage_limit": customer.usage_limit,
 		"customer_name": customer.customer_name,
 		"subscription_status": customer.subscription_status
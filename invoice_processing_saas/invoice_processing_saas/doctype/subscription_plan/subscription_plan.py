@@ -3,6 +3,8 @@
 
 import frappe
 from frappe.model.document import Document
+from frappe.utils import cint
+from invoice_processing_saas.plan_catalog import build_plan_features_list, get_active_plans as get_catalog_plans
 
 
 class SubscriptionPlan(Document):
@@ -10,6 +12,7 @@ class SubscriptionPlan(Document):
 		"""Validate subscription plan data"""
 		self.validate_pricing()
 		self.calculate_annual_discount()
+		self.set_dispatch_weight()
 		
 	def validate_pricing(self):
 		"""Validate pricing logic"""
@@ -32,6 +35,11 @@ class SubscriptionPlan(Document):
 			discount = annual_equivalent - self.annual_price
 			self.annual_discount_percent = (discount / annual_equivalent) * 100
 			
+	def set_dispatch_weight(self):
+		"""Default the dispatch weight to the plan's concurrent processing"""
+		if cint(self.dispatch_weight) <= 0:
+			self.dispatch_weight = max(1, cint(self.concurrent_processing))
+			
 	def get_effective_price(self, billing_cycle="Monthly"):
 		"""Get effective price based on billing cycle"""
 		if billing_cycle == "Annual" and self.annual_price:
@@ -40,42 +48,7 @@ class SubscriptionPlan(Document):
 		
 	def get_plan_features_list(self):
 		"""Get list of plan features for display"""
-		features = []
-		
-		# Add processing limit
-		features.append(f"{self.processing_limit:,} invoices per month")
-		
-		# Add file size limit
-		if self.max_file_size_mb:
-			features.append(f"Up to {self.max_file_size_mb}MB file size")
-			
-		# Add retention period
-		if self.retention_days:
-			features.append(f"{self.retention_days} days data retention")
-			
-		# Add concurrent processing
-		if self.concurrent_processing:
-			features.append(f"{self.concurrent_processing} concurrent processing")
-			
-		# Add boolean features
-		if self.api_access:
-			features.append("API Access")
-			
-		if self.priority_support:
-			features.append("Priority Support")
-			
-		if self.custom_integrations:
-			features.append("Custom Integrations")
-			
-		# Add custom features from table
-		for feature in self.plan_features:
-			if feature.included:
-				feature_text = feature.feature_name
-				if feature.limit_value:
-					feature_text += f" ({feature.limit_value})"
-				features.append(feature_text)
-				
-		return features
+		return build_plan_features_list(self, self.plan_features)
 		
 	def can_upgrade_to(self, target_plan_code):
 		"""Check if this plan can upgrade to target plan"""
@@ -100,35 +73,23 @@ class SubscriptionPlanFeature(Document):
 @frappe.whitelist()
 def get_active_plans():
 	"""Get all active subscription plans for signup form"""
-	plans = frappe.get_all("Subscription Plan",
-		filters={"is_active": 1},
-		fields=["name", "plan_name", "plan_code", "monthly_price", "annual_price", 
-				"processing_limit", "feature_highlight", "description", "trial_days"],
-		order_by="sort_order asc"
-	)
+	fields = ["name", "plan_name", "plan_code", "monthly_price", "annual_price",
+		"processing_limit", "feature_highlight", "description", "trial_days",
+		"annual_discount_percent"]
 	
-	# Add features list to each plan
-	for plan in plans:
-		plan_doc = frappe.get_doc("Subscription Plan", plan.name)
-		plan["features"] = plan_doc.get_plan_features_list()
-		plan["annual_discount_percent"] = plan_doc.annual_discount_percent
-		
-	return plans
+	# Served from the in-process plan catalog
+	return [
+		dict({field: plan[field] for field in fields}, features=list(plan.features))
+		for plan in get_catalog_plans()
+	]
 	
 
 @frappe.whitelist()
 def get_plan_comparison():
 	"""Get plan comparison data for pricing page"""
-	plans = frappe.get_all("Subscription Plan",
-		filters={"is_active": 1},
-		order_by="sort_order asc"
-	)
-	
 	comparison_data = []
 	
-	for plan_name in plans:
-		plan = frappe.get_doc("Subscription Plan", plan_name.name)
-		
+	for plan in get_catalog_plans():
 		comparison_data.append({
 			"plan_code": plan.plan_code,
 			"plan_name": plan.plan_name,
@@ -137,8 +98,9 @@ def get_plan_comparison():
 			"annual_discount_percent": plan.annual_discount_percent,
 			"processing_limit": plan.processing_limit,
 			"feature_highlight": plan.feature_highlight,
-			"features": plan.get_plan_features_list(),
+			"features": list(plan.features),
 			"api_access": plan.api_access,
+			"api_rate_limit": plan.api_rate_limit,
 			"priority_support": plan.priority_support,
 			"custom_integrations": plan.custom_integrations,
 			"max_file_size_mb": plan.max_file_size_mb,
@@ -3,7 +3,17 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import now, get_first_day, get_last_day, add_days
+from frappe.utils import now, nowdate, get_first_day, get_last_day, add_days
+from invoice_processing_saas.http_cache import bump_version, conditional_get
+from invoice_processing_saas.plan_catalog import get_plan
+from invoice_processing_saas.identity import can_access_customer, get_session_customer_name
+
+# Engine name -> Usage Tracking counter field
+ENGINE_COUNTER_FIELDS = {
+	"openai": "openai_usage",
+	"azure": "azure_usage",
+	"manual": "manual_processing"
+}
 
 
 class UsageTracking(Document):
@@ -23,69 +33,35 @@ class UsageTracking(Document):
 			frappe.throw(f"Usage tracking already exists for {self.customer} - {self.month}")
 			
 	def calculate_total_charges(self):
-		"""Calculate total charges including overage"""
+		"""Calculate overage and total charges from the counters"""
 		# Get base subscription cost
-		customer = frappe.get_doc("SaaS Customer", self.customer)
-		plan = frappe.get_doc("Subscription Plan", customer.subscription_plan)
-		
-		base_cost = plan.monthly_price
-		overage_cost = self.overage_charges or 0
+		subscription_plan = frappe.db.get_value("SaaS Customer", self.customer, "subscription_plan")
+		plan = get_plan(subscription_plan) if subscription_plan else frappe._dict()
 		
-		self.total_charges = base_cost + overage_cost
+		charges = get_derived_charges(self.processed_count, self.plan_limit,
+			plan.monthly_price, plan.overage_rate)
+		self.update(charges)
 		
 	def validate_customer_permissions(self):
 		"""Ensure user can only access their own usage data"""
-		if frappe.session.user != "Administrator":
-			user_email = frappe.session.user
-			customer_email = frappe.db.get_value("SaaS Customer", self.customer, "email")
-			
-			if user_email != customer_email and not frappe.has_permission("Usage Tracking", "read"):
-				frappe.throw("Access denied")
+		if not can_access_customer(self.customer, "Usage Tracking", "read"):
+			frappe.throw("Access denied")
 				
 	def increment_usage(self, engine="azure", processing_time=None, confidence_score=None):
 		"""Increment usage counters"""
-		self.processed_count = (self.processed_count or 0) + 1
-		
-		# Update engine-specific counters
-		if engine == "openai":
-			self.openai_usage = (self.openai_usage or 0) + 1
-		elif engine == "azure":
-			self.azure_usage = (self.azure_usage or 0) + 1
-		elif engine == "manual":
-			self.manual_processing = (self.manual_processing or 0) + 1
-			
-		# Calculate overage
-		if self.processed_count > self.plan_limit:
-			self.overage_count = self.processed_count - self.plan_limit
-			
-			# Calculate overage charges
-			customer = frappe.get_doc("SaaS Customer", self.customer)
-			plan = frappe.get_doc("Subscription Plan", customer.subscription_plan)
-			
-			if plan.overage_rate:
-				self.overage_charges = self.overage_count * plan.overage_rate
-				
-		# Update averages
-		if processing_time:
-			current_avg = self.avg_processing_time or 0
-			self.avg_processing_time = ((current_avg * (self.processed_count - 1)) + processing_time) / self.processed_count
-			
-		if confidence_score:
-			current_avg = self.avg_confidence_score or 0
-			self.avg_confidence_score = ((current_avg * (self.processed_count - 1)) + confidence_score) / self.processed_count
-			
-		self.last_updated = now()
-		self.save(ignore_permissions=True)
+		increment_usage_counters(self.customer, self.month, processed=1, engine=engine,
+			processing_time=processing_time, confidence_score=confidence_score)
+		self.reload()
 		
 	def mark_successful(self):
 		"""Mark a processing as successful"""
-		self.successful_count = (self.successful_count or 0) + 1
-		self.save(ignore_permissions=True)
+		increment_usage_counters(self.customer, self.month, successful=1)
+		self.reload()
 		
 	def mark_failed(self):
 		"""Mark a processing as failed"""
-		self.failed_count = (self.failed_count or 0) + 1
-		self.save(ignore_permissions=True)
+		increment_usage_counters(self.customer, self.month, failed=1)
+		self.reload()
 		
 	def get_success_rate(self):
 		"""Calculate success rate percentage"""
@@ -158,17 +134,22 @@ class UsageTracking(Document):
 def get_customer_usage_data(customer_name=None, months=6):
 	"""Get customer usage data for dashboard"""
 	if not customer_name:
-		customer_name = frappe.db.get_value("SaaS Customer",
-			{"email": frappe.session.user}, "name")
+		customer_name = get_session_customer_name()
 			
 	if not customer_name:
 		return []
 		
 	# Check permissions
-	customer = frappe.get_doc("SaaS Customer", customer_name)
-	if frappe.session.user != customer.email and not frappe.has_permission("Usage Tracking", "read"):
+	if not can_access_customer(customer_name, "Usage Tracking", "read"):
 		frappe.throw("Access denied")
 		
+	return conditional_get(customer_name, "usage_data",
+		lambda: _build_customer_usage_data(customer_name, months), months)
+
+
+def _build_customer_usage_data(customer_name, months):
+	"""Assemble the customer's monthly usage history"""
+	subscription_plan = frappe.db.get_value("SaaS Customer", customer_name, "subscription_plan")
 	usage_data = frappe.get_all("Usage Tracking",
 		filters={"customer": customer_name},
 		fields=["month", "processed_count", "successful_count", "failed_count",
@@ -178,8 +159,12 @@ def get_customer_usage_data(customer_name=None, months=6):
 		limit=months
 	)
 	
-	# Add calculated fields
+	# Add calculated fields; overage is derived from the counters on read
+	plan = get_plan(subscription_plan) if subscription_plan else frappe._dict()
+		
 	for usage in usage_data:
+		usage.update(get_derived_charges(usage["processed_count"], usage["plan_limit"],
+			plan.monthly_price, plan.overage_rate))
 		usage["success_rate"] = (usage["successful_count"] / usage["processed_count"] * 100) if usage["processed_count"] else 0
 		usage["usage_percentage"] = min((usage["processed_count"] / usage["plan_limit"] * 100), 100) if usage["plan_limit"] else 0
 		usage["is_over_limit"] = usage["processed_count"] > usage["plan_limit"]
@@ -194,23 +179,85 @@ def get_or_create_current_month_usage(customer_name):
 	
 	current_month = get_first_day(today()).strftime("%Y-%m")
 	
-	existing = frappe.db.get_value("Usage Tracking",
-		{"customer": customer_name, "month": current_month}, "name")
+	# Creates the record if it does not exist yet without racing other writers
+	name = increment_usage_counters(customer_name, current_month)
+	return frappe.get_doc("Usage Tracking", name)
+
+
+def get_derived_charges(processed_count, plan_limit, monthly_price=0, overage_rate=0):
+	"""Calculate overage_count, overage_charges and total_charges from usage counters"""
+	overage_count = max(0, (processed_count or 0) - (plan_limit or 0))
+	overage_charges = overage_count * (overage_rate or 0)
+	
+	return {
+		"overage_count": overage_count,
+		"overage_charges": overage_charges,
+		"total_charges": (monthly_price or 0) + overage_charges
+	}
+
+
+def increment_usage_counters(customer, month=None, processed=0, successful=0, failed=0,
+	engine=None, processing_time=None, confidence_score=None):
+	"""
+	Atomically add to a customer's Usage Tracking counters for a month
+	The record is created on first use by the same INSERT ... ON DUPLICATE KEY UPDATE,
+	so concurrent callers never race to create it. Derived fields (overage and
+	charges) are not maintained here; see get_derived_charges.
+	Returns the Usage Tracking name
+	"""
+	if not month:
+		month = get_first_day(nowdate()).strftime("%Y-%m")
 		
-	if existing:
-		return frappe.get_doc("Usage Tracking", existing)
+	# Same naming as the doctype's autoname: {customer}-{month}
+	name = f"{customer}-{month}"
+	
+	counters = {
+		"processed_count": processed,
+		"successful_count": successful,
+		"failed_count": failed
+	}
+	engine_field = ENGINE_COUNTER_FIELDS.get((engine or "").lower())
+	if engine_field:
+		counters[engine_field] = processed
 		
-	# Create new usage tracking record
-	customer = frappe.get_doc("SaaS Customer", customer_name)
+	values = {
+		"name": name,
+		"customer": customer,
+		"month": month,
+		"reset_date": f"{month}-01",
+		"now": now(),
+		"user": frappe.session.user,
+		"processed": processed,
+		"processing_time": processing_time,
+		"confidence_score": confidence_score
+	}
+	values.update(counters)
+	
+	# Running averages are updated before processed_count, since MariaDB
+	# evaluates the assignments left to right
+	updates = []
+	for field, param in (("avg_processing_time", "processing_time"), ("avg_confidence_score", "confidence_score")):
+		if processed and values[param] is not None:
+			updates.append(f"""{field} = (IFNULL({field}, 0) * IFNULL(processed_count, 0) + %({param})s)
+				/ (IFNULL(processed_count, 0) + %(processed)s)""")
+			
+	updates.extend(f"{field} = IFNULL({field}, 0) + %({field})s" for field in counters)
+	updates.extend(["last_updated = %(now)s", "modified = %(now)s", "modified_by = %(user)s"])
+	
+	frappe.db.sql(f"""
+		INSERT INTO `tabUsage Tracking`
+			(name, creation, modified, modified_by, owner, docstatus,
+			customer, month, plan_limit, reset_date, last_updated, billing_status,
+			{", ".join(counters)}, avg_processing_time, avg_confidence_score)
+		SELECT %(name)s, %(now)s, %(now)s, %(user)s, %(user)s, 0,
+			c.name, %(month)s, IFNULL(c.usage_limit, 0), %(reset_date)s, %(now)s, 'Pending',
+			{", ".join(f"%({field})s" for field in counters)},
+			IFNULL(%(processing_time)s, 0), IFNULL(%(confidence_score)s, 0)
+		FROM `tabSaaS Customer` c
+		WHERE c.name = %(customer)s
+		ON DUPLICATE KEY UPDATE {", ".join(updates)}
+	""", values)
 	
-	usage_doc = frappe.get_doc({
-		"doctype": "Usage Tracking",
-		"customer": customer_name,
-		"month": current_month,
-		"plan_limit": customer.usage_limit,
-		"reset_date": get_first_day(today()),
-		"billing_status": "Pending"
-	})
+	bump_version(customer)
 	
-	usage_doc.insert(ignore_permissions=True)
-	return usage_doc
\ No newline at end of file
+	return name
\ No newline at end of file
@@ -0,0 +1,173 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Daily Processing Job rollups for dashboard statistics. One row per
+# (customer, creation day, extraction engine) holds the number of jobs in
+# each status and the processing time and confidence totals of completed
+# jobs. Rows are kept current by applying the difference between a job's
+# old and new contribution whenever it is inserted, changed or deleted, so
+# monthly statistics sum at most 31 rows per engine instead of scanning the
+# job table. rebuild_rollups regenerates them from the jobs themselves.
+
+import frappe
+from frappe.utils import getdate, get_first_day, get_last_day, today, flt, cint
+
+ROLLUP_TABLE = "__job_daily_rollup"
+
+# Status -> counter column
+STATUS_COLUMNS = {
+	"Queued": "queued",
+	"Processing": "processing",
+	"Completed": "completed",
+	"Failed": "failed",
+	"Retry": "retry",
+}
+
+COUNTER_COLUMNS = ("total_jobs", "queued", "processing", "completed", "failed", "retry",
+	"processing_time_sum", "processing_time_count", "confidence_sum", "confidence_count")
+
+
+def create_rollup_table():
+	"""Create the rollup table if it does not exist"""
+	frappe.db.sql_ddl(f"""
+		CREATE TABLE IF NOT EXISTS `{ROLLUP_TABLE}` (
+			`customer` VARCHAR(140) NOT NULL,
+			`day` DATE NOT NULL,
+			`extraction_engine` VARCHAR(140) NOT NULL DEFAULT '',
+			`total_jobs` INT NOT NULL DEFAULT 0,
+			`queued` INT NOT NULL DEFAULT 0,
+			`processing` INT NOT NULL DEFAULT 0,
+			`completed` INT NOT NULL DEFAULT 0,
+			`failed` INT NOT NULL DEFAULT 0,
+			`retry` INT NOT NULL DEFAULT 0,
+			`processing_time_sum` BIGINT NOT NULL DEFAULT 0,
+			`processing_time_count` INT NOT NULL DEFAULT 0,
+			`confidence_sum` DOUBLE NOT NULL DEFAULT 0,
+			`confidence_count` INT NOT NULL DEFAULT 0,
+			PRIMARY KEY (`customer`, `day`, `extraction_engine`)
+		) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+	""")
+
+
+def record_change(job, previous=None):
+	"""
+	Apply the difference between a job's previous and current state to the rollups
+	Pass previous=None for a new job and job=None for a deleted one
+	"""
+	deltas = {}
+	for sign, state in ((-1, previous), (1, job)):
+		contribution = _get_contribution(state)
+		if not contribution:
+			continue
+
+		key, counters = contribution
+		row = deltas.setdefault(key, dict.fromkeys(COUNTER_COLUMNS, 0))
+		for column, value in counters.items():
+			row[column] += sign * value
+
+	rows = [(key, row) for key, row in deltas.items() if any(row.values())]
+	if rows:
+		_apply_deltas(rows)
+
+
+def get_month_stats(customer, date=None):
+	"""Get a customer's job statistics for the month containing date"""
+	date = date or today()
+
+	stats = frappe.db.sql(f"""
+		SELECT
+			SUM(total_jobs) AS total_jobs,
+			SUM(completed) AS completed,
+			SUM(failed) AS failed,
+			SUM(queued + processing) AS in_progress,
+			SUM(processing_time_sum) / NULLIF(SUM(processing_time_count), 0) AS avg_processing_time,
+			SUM(confidence_sum) / NULLIF(SUM(confidence_count), 0) AS avg_confidence_score
+		FROM `{ROLLUP_TABLE}`
+		WHERE customer = %s AND day BETWEEN %s AND %s
+	""", (customer, get_first_day(date), get_last_day(date)), as_dict=True)[0]
+
+	return frappe._dict({
+		"total_jobs": cint(stats.total_jobs),
+		"completed": cint(stats.completed),
+		"failed": cint(stats.failed),
+		"in_progress": cint(stats.in_progress),
+		"avg_processing_time": flt(stats.avg_processing_time),
+		"avg_confidence_score": flt(stats.avg_confidence_score)
+	})
+
+
+def rebuild_rollups(customer=None):
+	"""Regenerate the rollups from the Processing Job table"""
+	condition = "AND customer = %(customer)s" if customer else ""
+	values = {"customer": customer}
+
+	frappe.db.sql(f"""
+		DELETE FROM `{ROLLUP_TABLE}`
+		WHERE 1 = 1 {condition}
+	""", values)
+
+	frappe.db.sql(f"""
+		INSERT INTO `{ROLLUP_TABLE}` (`customer`, `day`, `extraction_engine`, {_column_list()})
+		SELECT
+			customer,
+			DATE(creation),
+			IFNULL(extraction_engine, ''),
+			COUNT(*),
+			SUM(processing_status = 'Queued'),
+			SUM(processing_status = 'Processing'),
+			SUM(processing_status = 'Completed'),
+			SUM(processing_status = 'Failed'),
+			SUM(processing_status = 'Retry'),
+			SUM(IF(processing_status = 'Completed', IFNULL(processing_time, 0), 0)),
+			SUM(processing_status = 'Completed'),
+			SUM(IF(processing_status = 'Completed', IFNULL(confidence_score, 0), 0)),
+			SUM(processing_status = 'Completed')
+		FROM `tabProcessing Job`
+		WHERE customer IS NOT NULL {condition}
+		GROUP BY customer, DATE(creation), IFNULL(extraction_engine, '')
+	""", values)
+
+	frappe.db.commit()
+
+
+def _get_contribution(job):
+	"""Get the rollup row key and counters a job in its current state adds up to"""
+	if not job or not job.customer or not job.creation:
+		return None
+
+	counters = {"total_jobs": 1}
+
+	status_column = STATUS_COLUMNS.get(job.processing_status)
+	if status_column:
+		counters[status_column] = 1
+
+	# Averages are over completed jobs, which no longer change
+	if job.processing_status == "Completed":
+		counters["processing_time_sum"] = cint(job.processing_time)
+		counters["processing_time_count"] = 1
+		counters["confidence_sum"] = flt(job.confidence_score)
+		counters["confidence_count"] = 1
+
+	key = (job.customer, getdate(job.creation), job.extraction_engine or "")
+	return key, counters
+
+
+def _apply_deltas(rows):
+	"""Add counter deltas to rollup rows, creating the rows that do not exist"""
+	placeholders = ", ".join(["(%s, %s, %s, " + ", ".join(["%s"] * len(COUNTER_COLUMNS)) + ")"] * len(rows))
+	values = []
+	for key, row in rows:
+		values.extend(key)
+		values.extend(row[column] for column in COUNTER_COLUMNS)
+
+	updates = ", ".join(f"`{column}` = `{column}` + VALUES(`{column}`)" for column in COUNTER_COLUMNS)
+
+	frappe.db.sql(f"""
+		INSERT INTO `{ROLLUP_TABLE}` (`customer`, `day`, `extraction_engine`, {_column_list()})
+		VALUES {placeholders}
+		ON DUPLICATE KEY UPDATE {updates}
+	""", values)
+
+
+def _column_list():
+	return ", ".join(f"`{column}`" for column in COUNTER_COLUMNS)
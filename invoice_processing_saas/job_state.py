@@ -0,0 +1,280 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Processing Job status transitions. A status update from n8n is applied as
+# one conditional UPDATE on the job row instead of loading and saving the
+# document, so it skips validation, Version rows and doc events. The UPDATE
+# only matches the row if it is still in the state the transition was
+# checked against, which gives optimistic concurrency: of two racing updates
+# only one applies and the other is re-checked against the new state.
+# Side effects run only for transitions that actually happened, and are the
+# same whether the status changed through here or through a document save.
+# Every change bumps a per-job status version in Redis and is pushed to the
+# customer's realtime room once committed, so clients can wait for changes
+# instead of polling. A job moving to Processing takes one of its customer's
+# processing slots (see concurrency). n8n only reports Processing for a file
+# it is already working on, so with no free slot the job still moves and
+# counts against the limit, and the dispatcher hands out nothing more for
+# that customer until it is back under. Failed jobs are scheduled for an
+# automatic retry or dead-lettered (see retries), and a job entering Retry
+# waits for dispatch. n8n may post a job's results without reporting
+# Processing first, so a waiting job can complete directly; its results are
+# written by the same UPDATE that completes it.
+
+import time
+
+import frappe
+from frappe.utils import now_datetime, time_diff_in_seconds
+
+from invoice_processing_saas import concurrency, job_rollup, quota, retries
+from invoice_processing_saas.http_cache import bump_version
+from invoice_processing_saas.notifications import queue_notification
+
+ALLOWED_TRANSITIONS = {
+	"Queued": ("Processing", "Completed", "Failed"),
+	"Processing": ("Completed", "Failed", "Retry"),
+	"Retry": ("Queued", "Processing", "Completed", "Failed"),
+	"Failed": ("Retry",),
+	"Completed": (),
+}
+
+# Columns a transition may write
+UPDATABLE_FIELDS = ("processing_status", "modified", "modified_by", "started_at", "completed_at",
+	"processing_time", "error_message", "extraction_engine", "dispatched_at", "dispatch_lease_expires",
+	"retry_count", "next_retry_at", "dead_lettered")
+TRANSITION_ATTEMPTS = 3
+
+STATUS_VERSION_TTL = 7 * 24 * 60 * 60  # seconds
+STATUS_CHANGED_EVENT = "processing_job_status"
+
+
+class InvalidTransitionError(frappe.ValidationError):
+	pass
+
+
+def transition(job_name, status, expected_status=None, error_message=None, extraction_engine=None,
+	result=None):
+	"""
+	Move a Processing Job to status
+	expected_status restricts the transition to jobs currently in that state
+	result is a dict of extra columns, such as extraction results, written with the transition
+	Returns the job's status afterwards
+	"""
+	if status not in ALLOWED_TRANSITIONS:
+		raise InvalidTransitionError(f"Unknown job status: {status}")
+
+	for _ in range(TRANSITION_ATTEMPTS):
+		job = _get_job_row(job_name)
+		if not job:
+			raise frappe.DoesNotExistError(f"Processing Job {job_name} not found")
+
+		previous = frappe._dict(job)
+		if expected_status and previous.processing_status != expected_status:
+			raise InvalidTransitionError(
+				f"Job {job_name} is {previous.processing_status}, expected {expected_status}")
+		if previous.processing_status == status:
+			if result:
+				_update_result(job, previous, result)
+			return status
+		if status not in ALLOWED_TRANSITIONS.get(previous.processing_status, ()):
+			raise InvalidTransitionError(
+				f"Cannot move job {job_name} from {previous.processing_status} to {status}")
+
+		new_status = status
+		took_slot = False
+		if status == "Processing" and job.customer:
+			limit = concurrency.get_concurrency_limit(job.customer, job.customer_plan or "")
+			took_slot = concurrency.start(job.customer, job_name, limit)
+			if not job.dispatched_at:
+				job.dispatched_at = now_datetime()
+
+		current_time = now_datetime()
+		job.update(result or {})
+		job.update({"processing_status": new_status, "modified": current_time, "modified_by": frappe.session.user})
+
+		if new_status == "Processing":
+			job.started_at = current_time
+			# n8n has started the job, so the dispatcher no longer reclaims it
+			job.dispatch_lease_expires = None
+		elif new_status in ("Completed", "Failed"):
+			job.completed_at = current_time
+			if job.started_at:
+				job.processing_time = int(time_diff_in_seconds(current_time, job.started_at))
+		elif new_status == "Retry":
+			# Counted as a retry and handed to n8n again by the dispatcher
+			job.retry_count = (job.retry_count or 0) + 1
+			job.next_retry_at = None
+			job.dead_lettered = 0
+			job.dispatched_at = None
+			job.dispatch_lease_expires = None
+
+		if error_message:
+			job.error_message = error_message
+		if extraction_engine:
+			job.extraction_engine = extraction_engine
+
+		changed = {field: job[field] for field in UPDATABLE_FIELDS if job[field] != previous[field]}
+		changed.update({field: job[field] for field in result or {}})
+		frappe.db.sql(f"""
+			UPDATE `tabProcessing Job`
+			SET {", ".join(f"`{field}` = %({field})s" for field in changed)}
+			WHERE name = %(name)s AND processing_status = %(previous_status)s
+		""", dict(changed, name=job_name, previous_status=previous.processing_status))
+
+		if frappe.db._cursor.rowcount:
+			job_rollup.record_change(job, previous)
+			dispatch_side_effects(job, new_status)
+			return new_status
+
+		# Another request moved the job between the read and the write; re-check against its new state.
+		# A slot the job already held belongs to whichever request gave it one
+		if took_slot:
+			concurrency.release(job.customer, job_name)
+
+	raise InvalidTransitionError(f"Job {job_name} is being updated concurrently")
+
+
+def _update_result(job, previous, result):
+	"""Write new results to a job that is already in its final status, keeping the rollups in step"""
+	job.update(result)
+	job.update({"modified": now_datetime(), "modified_by": frappe.session.user})
+	changed = {field: job[field] for field in list(result) + ["modified", "modified_by"]}
+
+	frappe.db.sql(f"""
+		UPDATE `tabProcessing Job`
+		SET {", ".join(f"`{field}` = %({field})s" for field in changed)}
+		WHERE name = %(name)s AND processing_status = %(status)s
+	""", dict(changed, name=job.name, status=previous.processing_status))
+
+	if frappe.db._cursor.rowcount:
+		job_rollup.record_change(job, previous)
+
+
+def _get_job_row(job_name):
+	"""Read the job fields transitions and their side effects need"""
+	rows = frappe.db.sql("""
+		SELECT j.name, j.job_id, j.customer, j.file_name, j.error_message, j.processing_status,
+			j.extraction_engine, j.creation, j.started_at, j.completed_at, j.processing_time, j.dispatched_at,
+			j.dispatch_lease_expires, j.confidence_score, j.retry_count, j.next_retry_at, j.dead_lettered,
+			j.modified, j.modified_by,
+			c.subscription_plan AS customer_plan
+		FROM `tabProcessing Job` j
+		LEFT JOIN `tabSaaS Customer` c ON c.name = j.customer
+		WHERE j.name = %s
+	""", job_name, as_dict=True)
+
+	return rows[0] if rows else None
+
+
+def dispatch_side_effects(job, status):
+	"""
+	Run the side effects of a job entering status
+	job can be a Processing Job document or the row read by transition
+	"""
+	frappe.logger().info(f"Job {job.name} status changed to {status}")
+
+	bump_version(job.customer)
+	_publish_status_change(job, status)
+
+	# Free the job's processing slot once it stops processing
+	if status in ("Completed", "Failed", "Retry") and job.customer:
+		concurrency.release_after_commit(job.customer, job.name)
+
+	# Commit the job's reserved quota as usage once it completes; the counters
+	# only change once the transition is committed
+	if status == "Completed" and job.customer:
+		quota.commit_after_commit(job.customer, job.job_id)
+
+	# Release the reservation and schedule a retry; the customer is only
+	# notified once the job will not be retried
+	elif status == "Failed" and job.customer:
+		quota.release_after_commit(job.customer, job.job_id)
+		if not retries.schedule_retry(job):
+			_notify_failure(job)
+
+
+def _notify_failure(job):
+	"""Queue notification for failed jobs"""
+	try:
+		queue_notification(
+			job.customer,
+			template="job_failure_notification",
+			subject="Processing Job Failed",
+			args={
+				"job_name": job.name,
+				"file_name": job.file_name,
+				"error_message": job.error_message or "Unknown error",
+				"dashboard_url": f"{frappe.utils.get_url()}/dashboard"
+			}
+		)
+
+	except Exception as e:
+		frappe.log_error(f"Error queueing job failure notification: {str(e)}", "Job State")
+
+
+def get_status_version(job_name):
+	"""Get the job's status version, which changes every time its status changes"""
+	return int(_redis("GET", _version_key(job_name)) or 0)
+
+
+def wait_for_status_change(job_name, since_version, timeout):
+	"""
+	Block until the job's status version differs from since_version or timeout expires
+	Returns the current status version
+	"""
+	version = get_status_version(job_name)
+	if version != since_version:
+		return version
+
+	pubsub = frappe.cache().pubsub(ignore_subscribe_messages=True)
+	try:
+		pubsub.subscribe(_channel(job_name))
+
+		# Re-read after subscribing so a change in between is not missed
+		version = get_status_version(job_name)
+		deadline = time.monotonic() + timeout
+
+		while version == since_version:
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				break
+			pubsub.get_message(timeout=remaining)
+			version = get_status_version(job_name)
+	finally:
+		pubsub.close()
+
+	return version
+
+
+def _publish_status_change(job, status):
+	"""Bump the status version and notify the customer's room once the change is committed"""
+	job_name = job.name
+	customer = job.customer
+
+	message = {"job_id": job.job_id, "job_name": job_name, "status": status}
+
+	def publish():
+		version = _redis("INCR", _version_key(job_name))
+		_redis("EXPIRE", _version_key(job_name), STATUS_VERSION_TTL)
+		_redis("PUBLISH", _channel(job_name), version)
+
+		# Clients join with frappe.realtime.doc_subscribe("SaaS Customer", customer); who may join is
+		# decided by permissions.saas_customer_permission
+		if customer:
+			frappe.publish_realtime(STATUS_CHANGED_EVENT, dict(message, version=version),
+				doctype="SaaS Customer", docname=customer)
+
+	frappe.db.after_commit.add(publish)
+
+
+def _redis(*args):
+	"""Run a raw Redis command on the cache connection (see quota._redis)"""
+	return frappe.cache().execute_command(*args)
+
+
+def _version_key(job_name):
+	return frappe.cache().make_key(f"invoice_processing_saas:job_status_version:{job_name}")
+
+
+def _channel(job_name):
+	return frappe.cache().make_key(f"invoice_processing_saas:job_status_changed:{job_name}")
@@ -0,0 +1,137 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Transactional outbox for customer emails. Request handlers write a
+# Notification Outbox row in their own transaction and a background job
+# sends the emails, so request latency does not depend on rendering
+# templates or on the mail queue.
+
+import json
+
+import frappe
+from frappe.utils import now, add_days
+
+DRAIN_BATCH_SIZE = 200
+MAX_ATTEMPTS = 5
+SENT_RETENTION_DAYS = 7
+
+
+def queue_notification(customer, template, subject, args=None, dedupe_key=None, recipients=None):
+	"""
+	Write a customer notification to the outbox
+	customer_name and the customer's email are filled in when the email is sent
+	"""
+	frappe.get_doc({
+		"doctype": "Notification Outbox",
+		"customer": customer,
+		"template": template,
+		"subject": subject,
+		"args": json.dumps(args or {}, default=str),
+		"dedupe_key": dedupe_key,
+		"recipients": ", ".join(recipients) if recipients else None,
+		"status": "Pending"
+	}).insert(ignore_permissions=True)
+
+	# Drain soon after this transaction commits; the scheduler is the fallback
+	frappe.enqueue(
+		"invoice_processing_saas.notifications.drain_outbox",
+		queue="short",
+		job_id="invoice_processing_saas:drain_outbox",
+		deduplicate=True,
+		enqueue_after_commit=True
+	)
+
+
+def drain_outbox(batch_size=DRAIN_BATCH_SIZE):
+	"""Send pending outbox notifications in batches until the outbox is empty"""
+	while _drain_batch(batch_size) == batch_size:
+		pass
+
+
+def _drain_batch(batch_size):
+	"""Send one batch of pending notifications; returns the number of rows claimed"""
+	rows = frappe.db.sql("""
+		SELECT name, customer, template, subject, args, dedupe_key, recipients, attempts
+		FROM `tabNotification Outbox`
+		WHERE status = 'Pending'
+		ORDER BY creation
+		LIMIT %s
+		FOR UPDATE SKIP LOCKED
+	""", batch_size, as_dict=True)
+
+	if not rows:
+		frappe.db.commit()
+		return 0
+
+	# Coalesce duplicate alerts: keep the latest row for each key
+	latest = {}
+	coalesced = []
+	for row in rows:
+		if row.dedupe_key:
+			key = (row.customer, row.template, row.dedupe_key)
+			if key in latest:
+				coalesced.append(latest[key].name)
+			latest[key] = row
+		else:
+			latest[row.name] = row
+
+	customers = {
+		customer.name: customer
+		for customer in frappe.get_all("SaaS Customer",
+			filters={"name": ["in", list({row.customer for row in rows})]},
+			fields=["name", "customer_name", "email"])
+	}
+
+	sent = []
+	for row in latest.values():
+		customer = customers.get(row.customer)
+		try:
+			if not customer:
+				raise frappe.DoesNotExistError(f"SaaS Customer {row.customer} not found")
+
+			args = json.loads(row.args) if row.args else {}
+			args.setdefault("customer_name", customer.customer_name)
+
+			frappe.sendmail(
+				recipients=[r.strip() for r in row.recipients.split(",")] if row.recipients else [customer.email],
+				subject=row.subject,
+				template=row.template,
+				args=args
+			)
+			sent.append(row.name)
+
+		except Exception as e:
+			frappe.db.sql("""
+				UPDATE `tabNotification Outbox`
+				SET attempts = attempts + 1,
+					status = IF(attempts >= %(max_attempts)s, 'Failed', 'Pending'),
+					last_error = %(error)s,
+					modified = %(now)s
+				WHERE name = %(name)s
+			""", {"max_attempts": MAX_ATTEMPTS, "error": str(e), "now": now(), "name": row.name})
+
+	_set_status(sent, "Sent")
+	_set_status(coalesced, "Coalesced")
+	frappe.db.commit()
+
+	return len(rows)
+
+
+def _set_status(names, status):
+	if not names:
+		return
+
+	frappe.db.sql("""
+		UPDATE `tabNotification Outbox`
+		SET status = %(status)s, sent_at = %(now)s, modified = %(now)s
+		WHERE name IN %(names)s
+	""", {"status": status, "now": now(), "names": tuple(names)})
+
+
+def prune_outbox(days=SENT_RETENTION_DAYS):
+	"""Delete sent and coalesced notifications older than the retention period"""
+	frappe.db.sql("""
+		DELETE FROM `tabNotification Outbox`
+		WHERE status IN ('Sent', 'Coalesced') AND modified < %s
+	""", add_days(now(), -days))
+	frappe.db.commit()
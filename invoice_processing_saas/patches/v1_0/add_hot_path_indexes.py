@@ -0,0 +1,9 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+from invoice_processing_saas.indexes import ensure_hot_path_indexes
+
+
+def execute():
+	"""Add composite indexes for hot query paths on existing sites"""
+	ensure_hot_path_indexes()
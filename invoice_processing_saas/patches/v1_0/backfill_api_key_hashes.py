@@ -0,0 +1,22 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils.password import get_decrypted_password
+
+from invoice_processing_saas.api_keys import hash_api_key, get_api_key_prefix
+
+
+def execute():
+	"""Store the lookup prefix and hash of every existing customer's API key"""
+	frappe.reload_doc("invoice_processing_saas", "doctype", "saas_customer")
+
+	for name in frappe.get_all("SaaS Customer", filters={"api_key_hash": ["is", "not set"]}, pluck="name"):
+		api_key = get_decrypted_password("SaaS Customer", name, "api_key", raise_exception=False)
+		if not api_key:
+			continue
+
+		frappe.db.set_value("SaaS Customer", name, {
+			"api_key_prefix": get_api_key_prefix(api_key),
+			"api_key_hash": hash_api_key(api_key)
+		}, update_modified=False)
@@ -0,0 +1,10 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+from invoice_processing_saas.job_rollup import create_rollup_table, rebuild_rollups
+
+
+def execute():
+	"""Create the daily job rollup table and fill it from existing jobs"""
+	create_rollup_table()
+	rebuild_rollups()
@@ -0,0 +1,9 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+from invoice_processing_saas.event_log import create_event_log_table
+
+
+def execute():
+	"""Create the processing event log table on existing sites"""
+	create_event_log_table()
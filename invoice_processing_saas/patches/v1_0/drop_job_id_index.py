@@ -0,0 +1,16 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+
+
+def execute():
+	"""Drop the hot path index on job_id, which duplicates the unique key Frappe keeps for it"""
+	if not frappe.db.has_index("tabProcessing Job", "job_id_index"):
+		return
+
+	frappe.db.sql_ddl("""
+		ALTER TABLE `tabProcessing Job`
+		DROP INDEX `job_id_index`,
+		ALGORITHM=INPLACE, LOCK=NONE
+	""")
@@ -0,0 +1,19 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+
+from invoice_processing_saas.indexes import ensure_hot_path_indexes
+
+
+def execute():
+	"""Mark existing jobs as dispatched so the dispatcher only picks up new ones"""
+	frappe.reload_doc("invoice_processing_saas", "doctype", "processing_job")
+
+	frappe.db.sql("""
+		UPDATE `tabProcessing Job`
+		SET dispatched_at = COALESCE(started_at, creation)
+		WHERE dispatched_at IS NULL
+	""")
+
+	ensure_hot_path_indexes()
@@ -0,0 +1,19 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+
+from invoice_processing_saas.plan_catalog import invalidate_plan_catalog
+
+
+def execute():
+	"""Weight existing plans by their concurrent processing instead of the old default of 1"""
+	frappe.reload_doc("invoice_processing_saas", "doctype", "subscription_plan")
+
+	frappe.db.sql("""
+		UPDATE `tabSubscription Plan`
+		SET dispatch_weight = GREATEST(IFNULL(concurrent_processing, 0), 1)
+		WHERE IFNULL(dispatch_weight, 0) <= 1
+	""")
+
+	invalidate_plan_catalog()
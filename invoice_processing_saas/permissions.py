@@ -0,0 +1,38 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Document permission hooks (has_permission in hooks.py). Frappe checks
+# them on top of role permissions, so they can only narrow access: a
+# document tied to a customer is open to that customer's own user and to
+# whoever identity.can_access_customer lets act for customers, and never to
+# another customer's user. The same check decides who may join a
+# customer's realtime room (doc_subscribe on SaaS Customer), where job
+# status changes are published.
+
+from invoice_processing_saas.identity import can_access_customer, get_session_customer_name
+
+
+def saas_customer_permission(doc, ptype=None, user=None):
+	return _can_access(doc.name, "SaaS Customer", ptype)
+
+
+def processing_job_permission(doc, ptype=None, user=None):
+	return _can_access(doc.customer, "Processing Job", ptype)
+
+
+def drive_integration_permission(doc, ptype=None, user=None):
+	return _can_access(doc.customer, "Drive Integration", ptype)
+
+
+def accounting_integration_permission(doc, ptype=None, user=None):
+	return _can_access(doc.customer, "Accounting Integration", ptype)
+
+
+def _can_access(customer, doctype, ptype):
+	"""Check the session user's access to a customer's document"""
+	# A customer's user only ever sees their own records, whatever their role allows
+	session_customer = get_session_customer_name()
+	if session_customer:
+		return session_customer == customer
+
+	return can_access_customer(customer, doctype, ptype or "read")
@@ -0,0 +1,200 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# In-process Subscription Plan catalog. All plans and their features are
+# loaded with two queries into read-only records that each worker process
+# keeps in memory, so plan lookups on hot paths cost no queries. Saving a
+# plan bumps the catalog version in Redis and publishes an invalidation
+# through worker_cache; every process drops that site's catalog and the
+# next lookup reloads it. In case a message is missed, a lookup compares the
+# catalog's version with the one in Redis at most every
+# CATALOG_VERSION_CHECK_INTERVAL and reloads when they differ, and a
+# maximum age bounds staleness if Redis is unavailable. A lookup of an
+# unknown plan reloads a catalog older than that interval, so lookups of a
+# plan that does not exist cannot make every request reload it.
+
+import time
+from collections import namedtuple
+
+import frappe
+from invoice_processing_saas import worker_cache
+
+CATALOG_CHANNEL = "invoice_processing_saas:plan_catalog_invalidated"
+CATALOG_MAX_AGE = 300  # seconds
+CATALOG_VERSION_CHECK_INTERVAL = 5  # seconds
+
+PLAN_FIELDS = ["name", "plan_name", "plan_code", "description", "is_active", "sort_order",
+	"feature_highlight", "monthly_price", "annual_price", "annual_discount_percent",
+	"processing_limit", "overage_rate", "trial_days", "api_access", "priority_support",
+	"custom_integrations", "max_file_size_mb", "retention_days", "concurrent_processing",
+	"api_rate_limit", "dispatch_weight"]
+
+PlanCatalog = namedtuple("PlanCatalog", ["version", "loaded_at", "plans", "active_plans"])
+
+_catalogs = {}  # site -> PlanCatalog
+_generations = {}  # site -> invalidations seen by this process
+_version_checked_at = {}  # site -> when the catalog version was last compared with Redis
+
+
+class PlanRecord(frappe._dict):
+	"""Read-only Subscription Plan shared by every request in the process"""
+
+	def _read_only(self, *args, **kwargs):
+		raise TypeError("Plan catalog records are read-only")
+
+	__setattr__ = __setitem__ = __delattr__ = __delitem__ = _read_only
+	update = setdefault = pop = popitem = clear = _read_only
+
+
+def get_catalog():
+	"""Get this site's plan catalog, loading it if needed"""
+	worker_cache.ensure_listener()
+
+	site = frappe.local.site
+	catalog = _catalogs.get(site)
+	if catalog is not None and _is_outdated(site, catalog):
+		_drop_catalog(site)
+		catalog = None
+
+	if catalog is None or time.monotonic() - catalog.loaded_at > CATALOG_MAX_AGE:
+		generation = _generations.get(site, 0)
+		catalog = _load_catalog()
+
+		# Keep it only if no invalidation arrived while it was loading
+		if _generations.get(site, 0) == generation:
+			_catalogs[site] = catalog
+			_version_checked_at[site] = catalog.loaded_at
+
+	return catalog
+
+
+def get_plan(plan_name):
+	"""Get a Subscription Plan record by name"""
+	catalog = get_catalog()
+	plan = catalog.plans.get(plan_name)
+	if plan is None and time.monotonic() - catalog.loaded_at >= CATALOG_VERSION_CHECK_INTERVAL:
+		# The plan may have been created since the catalog was loaded
+		_catalogs.pop(frappe.local.site, None)
+		plan = get_catalog().plans.get(plan_name)
+
+	if plan is None:
+		raise frappe.DoesNotExistError(f"Subscription Plan {plan_name} not found")
+
+	return plan
+
+
+def get_active_plans():
+	"""Get the active Subscription Plans in display order"""
+	return get_catalog().active_plans
+
+
+def invalidate_plan_catalog(doc=None, method=None):
+	"""
+	Doc event handler for Subscription Plan that makes every process reload
+	the catalog once the change is committed
+	"""
+	_drop_catalog(frappe.local.site)
+	frappe.db.after_commit.add(lambda: frappe.cache().execute_command("INCR", _version_key()))
+	worker_cache.publish(CATALOG_CHANNEL)
+
+
+def build_plan_features_list(plan, plan_features):
+	"""Get the list of plan features for display"""
+	features = []
+
+	# Add processing limit
+	features.append(f"{plan.processing_limit:,} invoices per month")
+
+	# Add file size limit
+	if plan.max_file_size_mb:
+		features.append(f"Up to {plan.max_file_size_mb}MB file size")
+
+	# Add retention period
+	if plan.retention_days:
+		features.append(f"{plan.retention_days} days data retention")
+
+	# Add concurrent processing
+	if plan.concurrent_processing:
+		features.append(f"{plan.concurrent_processing} concurrent processing")
+
+	# Add boolean features
+	if plan.api_access:
+		features.append("API Access")
+
+	if plan.priority_support:
+		features.append("Priority Support")
+
+	if plan.custom_integrations:
+		features.append("Custom Integrations")
+
+	# Add custom features from table
+	for feature in plan_features:
+		if feature.included:
+			feature_text = feature.feature_name
+			if feature.limit_value:
+				feature_text += f" ({feature.limit_value})"
+			features.append(feature_text)
+
+	return features
+
+
+def _load_catalog():
+	"""Load every plan and its features with one query each"""
+	version = _get_version()
+
+	rows = frappe.get_all("Subscription Plan", fields=PLAN_FIELDS, order_by="sort_order asc")
+	feature_rows = frappe.get_all("Subscription Plan Feature",
+		filters={"parenttype": "Subscription Plan"},
+		fields=["parent", "feature_name", "included", "limit_value"],
+		order_by="idx asc")
+
+	features_by_plan = {}
+	for feature in feature_rows:
+		features_by_plan.setdefault(feature.parent, []).append(feature)
+
+	plans = {}
+	for row in rows:
+		features = build_plan_features_list(row, features_by_plan.get(row.name, []))
+		plans[row.name] = PlanRecord(row, features=tuple(features))
+
+	return PlanCatalog(
+		version=version,
+		loaded_at=time.monotonic(),
+		plans=plans,
+		active_plans=tuple(plan for plan in plans.values() if plan.is_active)
+	)
+
+
+def _get_version():
+	return int(frappe.cache().execute_command("GET", _version_key()) or 0)
+
+
+def _is_outdated(site, catalog):
+	"""Compare the catalog's version with Redis, at most once per CATALOG_VERSION_CHECK_INTERVAL"""
+	now = time.monotonic()
+	if now - _version_checked_at.get(site, 0) < CATALOG_VERSION_CHECK_INTERVAL:
+		return False
+
+	_version_checked_at[site] = now
+	return _get_version() != catalog.version
+
+
+def _drop_catalog(site):
+	_generations[site] = _generations.get(site, 0) + 1
+	_catalogs.pop(site, None)
+
+
+def _on_invalidation(site, payload):
+	if site is None:
+		# The listener failed, so forget every catalog
+		for cached_site in list(_catalogs):
+			_drop_catalog(cached_site)
+	else:
+		_drop_catalog(site)
+
+
+def _version_key():
+	return frappe.cache().make_key("invoice_processing_saas:plan_catalog_version")
+
+
+worker_cache.register(CATALOG_CHANNEL, _on_invalidation)
@@ -0,0 +1,233 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Reservation based processing quota backed by atomic Redis counters.
+# A job reserves one unit of quota when it is created, the reservation is
+# committed into the customer's usage when the job completes and released
+# when it fails or expires. SaaS Customer.current_usage is synced back from
+# the counters by a scheduled job instead of on every job.
+
+import time
+
+import frappe
+from frappe.utils import now
+
+from invoice_processing_saas.http_cache import bump_version
+
+RESERVATION_TTL = 24 * 60 * 60  # seconds
+USAGE_WARNING_LEVELS = (80, 90, 100)
+
+# KEYS: usage hash, reservations zset, dirty set
+# ARGV: now, reservation expiry, job_id, usage_limit, overage_allowed, customer, now (datetime)
+# Returns 1 when reserved, 0 when over quota, -1 when the counters need seeding
+RESERVE_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'used') == 0 then
+	return -1
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+if redis.call('ZSCORE', KEYS[2], ARGV[3]) then
+	return 1
+end
+local used = tonumber(redis.call('HGET', KEYS[1], 'used'))
+local reserved = redis.call('ZCARD', KEYS[2])
+if used + reserved >= tonumber(ARGV[4]) and ARGV[5] ~= '1' then
+	return 0
+end
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+redis.call('HSET', KEYS[1], 'usage_limit', ARGV[4], 'last_activity', ARGV[7])
+redis.call('SADD', KEYS[3], ARGV[6])
+return 1
+"""
+
+# KEYS: usage hash, reservations zset, dirty set
+# ARGV: job_id, customer, now (datetime)
+# Returns the new usage count, or -1 when the counters need seeding
+COMMIT_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'used') == 0 then
+	return -1
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+local used = redis.call('HINCRBY', KEYS[1], 'used', 1)
+redis.call('HINCRBY', KEYS[1], 'unsynced', 1)
+redis.call('HSET', KEYS[1], 'last_activity', ARGV[3])
+redis.call('SADD', KEYS[3], ARGV[2])
+return used
+"""
+
+# KEYS: usage hash
+# Returns [used, unsynced, last_activity] and clears unsynced
+TAKE_UNSYNCED_SCRIPT = """
+local values = redis.call('HMGET', KEYS[1], 'used', 'unsynced', 'last_activity')
+redis.call('HSET', KEYS[1], 'unsynced', 0)
+return values
+"""
+
+_scripts = {}
+
+
+def reserve(customer, job_id, usage_limit, overage_allowed=0):
+	"""
+	Reserve one unit of quota for a job
+	Raises when the customer is over quota and overage is not allowed
+	"""
+	keys = [_usage_key(customer), _reservations_key(customer), _dirty_key()]
+	current_time = time.time()
+	args = [current_time, current_time + RESERVATION_TTL, job_id,
+		usage_limit or 0, 1 if overage_allowed else 0, customer, now()]
+
+	result = _run("reserve", keys, args)
+	if result == -1:
+		_seed_usage(customer)
+		result = _run("reserve", keys, args)
+
+	if not result:
+		frappe.throw("Monthly processing quota exceeded. Please upgrade your plan.")
+
+
+def release(customer, job_id):
+	"""Release a job's reservation without counting it as usage"""
+	_redis("ZREM", _reservations_key(customer), job_id)
+
+
+def commit(customer, job_id=None):
+	"""
+	Count a job as used quota and drop its reservation
+	Returns the customer's usage after the commit
+	"""
+	keys = [_usage_key(customer), _reservations_key(customer), _dirty_key()]
+	args = [job_id or "", customer, now()]
+
+	used = _run("commit", keys, args)
+	if used == -1:
+		_seed_usage(customer)
+		used = _run("commit", keys, args)
+
+	_send_usage_warning_if_crossed(customer, used)
+	bump_version(customer)
+	return used
+
+
+def release_after_commit(customer, job_id):
+	"""Release a job's reservation once the current transaction commits"""
+	frappe.db.after_commit.add(lambda: release(customer, job_id))
+
+
+def commit_after_commit(customer, job_id):
+	"""Count a job as used quota once the current transaction commits"""
+	def commit_usage():
+		commit(customer, job_id)
+		# A usage warning queued by the commit is written outside the committed transaction
+		frappe.db.commit()
+
+	frappe.db.after_commit.add(commit_usage)
+
+
+def get_usage(customer):
+	"""Get the customer's committed usage, including counts not yet synced to the database"""
+	used = _redis("HGET", _usage_key(customer), "used")
+	if used is None:
+		used = _seed_usage(customer)
+	return int(used)
+
+
+def reset_usage(customer):
+	"""
+	Reset the counters at the start of a new billing period
+	Pending counts are synced first; the caller resets current_usage in the database
+	"""
+	sync_customer_usage(customer)
+	_redis("HSET", _usage_key(customer), "used", 0)
+	bump_version(customer)
+
+
+def sync_usage_counters():
+	"""Write usage counters that changed since the last sync back to SaaS Customer"""
+	for customer in _redis("SMEMBERS", _dirty_key()):
+		customer = frappe.safe_decode(customer)
+		_redis("SREM", _dirty_key(), customer)
+		sync_customer_usage(customer)
+
+	frappe.db.commit()
+
+
+def sync_customer_usage(customer):
+	"""Write one customer's usage counters back to SaaS Customer"""
+	used, unsynced, last_activity = _run("take_unsynced", [_usage_key(customer)], [])
+	if used is None:
+		return
+
+	try:
+		frappe.db.sql("""
+			UPDATE `tabSaaS Customer`
+			SET current_usage = %(used)s,
+				total_processed = IFNULL(total_processed, 0) + %(unsynced)s,
+				last_activity = IFNULL(%(last_activity)s, last_activity)
+			WHERE name = %(customer)s
+		""", {
+			"used": int(used),
+			"unsynced": int(unsynced or 0),
+			"last_activity": frappe.safe_decode(last_activity) if last_activity else None,
+			"customer": customer
+		})
+	except Exception:
+		# Put the counts back so the next run retries them
+		_redis("HINCRBY", _usage_key(customer), "unsynced", int(unsynced or 0))
+		_redis("SADD", _dirty_key(), customer)
+		raise
+
+
+def _seed_usage(customer):
+	"""Initialise the Redis counters from the database"""
+	used = frappe.db.get_value("SaaS Customer", customer, "current_usage") or 0
+	_redis("HSETNX", _usage_key(customer), "used", used)
+	return _redis("HGET", _usage_key(customer), "used")
+
+
+def _send_usage_warning_if_crossed(customer, used):
+	"""Send a usage warning when this commit crossed one of the warning levels"""
+	usage_limit = _redis("HGET", _usage_key(customer), "usage_limit")
+	if usage_limit is None:
+		usage_limit = frappe.db.get_value("SaaS Customer", customer, "usage_limit")
+
+	usage_limit = int(usage_limit or 0)
+	if not usage_limit:
+		return
+
+	for level in USAGE_WARNING_LEVELS:
+		threshold = -(-usage_limit * level // 100)  # ceil
+		if used == threshold:
+			frappe.get_doc("SaaS Customer", customer).send_usage_warning(level)
+
+
+def _redis(*args):
+	"""
+	Run a raw Redis command on the cache connection
+	RedisWrapper overrides several commands to pickle values and prefix keys,
+	which does not work for counters shared with Lua scripts
+	"""
+	return frappe.cache().execute_command(*args)
+
+
+def _run(name, keys, args):
+	"""Run one of the Lua scripts above, registering it once per process"""
+	if name not in _scripts:
+		source = {
+			"reserve": RESERVE_SCRIPT,
+			"commit": COMMIT_SCRIPT,
+			"take_unsynced": TAKE_UNSYNCED_SCRIPT
+		}[name]
+		_scripts[name] = frappe.cache().register_script(source)
+
+	return _scripts[name](keys=keys, args=args, client=frappe.cache())
+
+
+def _usage_key(customer):
+	return frappe.cache().make_key(f"invoice_processing_saas:quota:usage:{customer}")
+
+
+def _reservations_key(customer):
+	return frappe.cache().make_key(f"invoice_processing_saas:quota:reservations:{customer}")
+
+
+def _dirty_key():
+	return frappe.cache().make_key("invoice_processing_saas:quota:dirty")
@@ -0,0 +1,229 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Per-customer API rate limiting. Each customer has a token bucket in Redis
+# that holds up to their plan's api_rate_limit tokens and refills at that
+# many tokens per minute; every API call takes a token, and a call that
+# finds the bucket empty gets a 429 with Retry-After. Buckets are updated by
+# a Lua script so concurrent workers cannot overdraw them. The customer is
+# taken from a credential the caller proves: the authenticated session, an
+# X-API-Key header, or an X-Webhook-Signature over the request body made
+# with the customer_id's webhook secret, which is how n8n identifies the
+# customer it acts for. Failing that, it comes from the folder or job the
+# request is about; a bare customer_id in the body is only trusted from an
+# authenticated caller acting for customers, so a guest cannot drain
+# another customer's bucket. Callers that cannot be tied to a customer
+# share a bucket per IP address at the default rate. Apply it below
+# @idempotent so replayed responses do not take tokens. Rejections are
+# counted per customer per day. A customer's plan is cached for
+# CUSTOMER_PLAN_TTL, so plan changes apply within a minute.
+
+import functools
+import math
+
+import frappe
+from frappe.utils import cint, today
+
+from invoice_processing_saas.api_keys import resolve_api_key, verify_webhook_signature
+from invoice_processing_saas.folder_config import get_folder_config
+from invoice_processing_saas.identity import get_session_customer_name
+from invoice_processing_saas.plan_catalog import get_plan
+
+DEFAULT_RATE_LIMIT = 60  # requests per minute
+CUSTOMER_PLAN_TTL = 60  # seconds
+JOB_CUSTOMER_TTL = 60 * 60  # seconds
+REJECTION_COUNT_TTL = 35 * 24 * 60 * 60  # seconds
+
+# KEYS: bucket hash
+# ARGV: capacity, refill rate (tokens per second), cost
+# Returns [1, tokens left] when allowed, [0, seconds until allowed] when not
+# Costs above capacity are capped so a large batch can run once the bucket is full
+TAKE_TOKENS_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = math.min(tonumber(ARGV[3]), capacity)
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+
+local allowed = 0
+local result = (cost - tokens) / rate
+if tokens >= cost then
+	tokens = tokens - cost
+	allowed = 1
+	result = tokens
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(result)}
+"""
+
+_scripts = {}
+
+
+def rate_limited(cost=1):
+	"""
+	Decorator for API endpoints that takes cost tokens from the caller's bucket
+	cost is a number or a function of the request data
+	"""
+	def decorator(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			data = frappe.local.form_dict
+			customer = get_request_customer(data)
+			tokens = cost(data) if callable(cost) else cost
+
+			allowed, retry_after = take_tokens(customer, max(1, cint(tokens)))
+			if not allowed:
+				if customer:
+					_count_rejection(customer)
+
+				frappe.local.response.http_status_code = 429
+				_set_response_header("Retry-After", str(retry_after))
+				return {
+					"success": False,
+					"error": "Rate limit exceeded",
+					"retry_after": retry_after
+				}
+
+			return fn(*args, **kwargs)
+
+		return wrapper
+
+	return decorator
+
+
+def take_tokens(customer, tokens=1):
+	"""
+	Take tokens from a customer's bucket, or from the caller's IP bucket if customer is None
+	Returns (allowed, whole seconds until the tokens are available)
+	"""
+	rate_limit = get_rate_limit(customer)
+	bucket = f"customer:{customer}" if customer else f"ip:{frappe.local.request_ip}"
+
+	allowed, result = _run_take_tokens(_bucket_key(bucket), rate_limit, tokens)
+	if allowed:
+		return True, 0
+
+	return False, max(1, math.ceil(float(result)))
+
+
+def get_rate_limit(customer):
+	"""Get a customer's API requests per minute from their plan"""
+	plan_name = _get_customer_plan(customer) if customer else None
+	if not plan_name:
+		return DEFAULT_RATE_LIMIT
+
+	try:
+		return cint(get_plan(plan_name).api_rate_limit) or DEFAULT_RATE_LIMIT
+	except frappe.DoesNotExistError:
+		return DEFAULT_RATE_LIMIT
+
+
+def get_request_customer(data):
+	"""Get the customer an API request acts for, or None if it cannot be told"""
+	customer = get_session_customer_name() or _get_credential_customer(data)
+	if customer:
+		return customer
+
+	if data.get("folder_id"):
+		return get_folder_config(data.get("folder_id")).get("customer_id")
+
+	if data.get("job_id"):
+		return _get_job_customer(data.get("job_id"))
+
+	# A body customer_id is only taken from an authenticated caller such as the n8n service user
+	customer = data.get("customer_id")
+	if customer and frappe.session.user != "Guest":
+		# Unknown IDs fall back to the IP bucket so made-up IDs do not get fresh buckets
+		return customer if _get_customer_plan(customer) is not None else None
+
+	return None
+
+
+def _get_credential_customer(data):
+	"""Get the customer whose API key or webhook secret authenticates the request, or None"""
+	# The auth hook only logs in keys of active customers; any valid key still identifies its customer
+	identity = resolve_api_key(frappe.get_request_header("X-API-Key"))
+	if identity:
+		return identity.customer
+
+	signature = frappe.get_request_header("X-Webhook-Signature")
+	customer = data.get("customer_id")
+	if signature and customer and _get_customer_plan(customer) is not None:
+		if verify_webhook_signature(customer, frappe.request.get_data(), signature):
+			return customer
+
+	return None
+
+
+def get_rejection_counts(date=None):
+	"""Get the number of rate limited requests per customer on a day"""
+	counts = frappe.cache().execute_command("HGETALL", _rejections_key(date or today())) or {}
+	return {frappe.safe_decode(customer): cint(count) for customer, count in counts.items()}
+
+
+def _get_customer_plan(customer):
+	"""Get a customer's plan name, "" for a customer without a plan or None if there is no such customer"""
+	cache = frappe.cache()
+	key = f"invoice_processing_saas:rate_limit:plan:{customer}"
+
+	plan_name = cache.get_value(key)
+	if plan_name is None:
+		row = frappe.db.get_value("SaaS Customer", customer, ["subscription_plan"], as_dict=True)
+		# Unknown customers are cached as False
+		plan_name = (row.subscription_plan or "") if row else False
+		cache.set_value(key, plan_name, expires_in_sec=CUSTOMER_PLAN_TTL)
+
+	return None if plan_name is False else plan_name
+
+
+def _get_job_customer(job_id):
+	"""Get a job's customer; it never changes, so it is cached for longer"""
+	cache = frappe.cache()
+	key = f"invoice_processing_saas:rate_limit:job_customer:{job_id}"
+
+	customer = cache.get_value(key)
+	if customer is None:
+		customer = frappe.db.get_value("Processing Job", {"job_id": job_id}, "customer") or ""
+		if customer:
+			cache.set_value(key, customer, expires_in_sec=JOB_CUSTOMER_TTL)
+
+	return customer or None
+
+
+def _count_rejection(customer):
+	key = _rejections_key(today())
+	pipeline = frappe.cache().pipeline()
+	pipeline.hincrby(key, customer, 1)
+	pipeline.expire(key, REJECTION_COUNT_TTL)
+	pipeline.execute()
+
+
+def _run_take_tokens(key, rate_limit, tokens):
+	"""Run the token bucket script, registering it once per process"""
+	if "take_tokens" not in _scripts:
+		_scripts["take_tokens"] = frappe.cache().register_script(TAKE_TOKENS_SCRIPT)
+
+	allowed, result = _scripts["take_tokens"](keys=[key], args=[rate_limit, rate_limit / 60, tokens],
+		client=frappe.cache())
+	return cint(allowed), frappe.safe_decode(result)
+
+
+def _set_response_header(name, value):
+	response_headers = getattr(frappe.local, "response_headers", None)
+	if response_headers is not None:
+		response_headers[name] = value
+
+
+def _bucket_key(bucket):
+	return frappe.cache().make_key(f"invoice_processing_saas:rate_limit:bucket:{bucket}")
+
+
+def _rejections_key(date):
+	return frappe.cache().make_key(f"invoice_processing_saas:rate_limit:rejections:{date}")
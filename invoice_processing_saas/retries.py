@@ -0,0 +1,147 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Automatic retries for failed Processing Jobs. When a job fails, its error
+# is classified as transient or permanent. A transient failure with retries
+# left gets a next_retry_at with exponential backoff and jitter. A permanent
+# failure, or one with no retries left, is dead-lettered and the customer is
+# notified. A background job finds due retries through the next_retry_at
+# index, moves them to Retry in batches and hands them to the dispatcher,
+# which posts them to n8n. Nothing here calls n8n from a web request.
+
+import random
+import re
+
+import frappe
+from frappe.utils import add_to_date, cint, now_datetime
+
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 60  # seconds
+RETRY_MAX_DELAY = 60 * 60  # seconds
+RETRY_BATCH_SIZE = 100
+
+TRANSIENT = "Transient"
+PERMANENT = "Permanent"
+
+# Errors that will fail the same way however often the job is retried
+PERMANENT_ERROR_PATTERNS = re.compile(
+	r"unsupported file|invalid file|corrupt|password[- ]protected|encrypted|not an invoice"
+	r"|file too large|exceeds the maximum|quota exceeded|subscription is not active"
+	r"|not found|permission denied|access denied"
+	# Only HTTP statuses written as such; a bare number may be a timeout or a page. 401 is left
+	# out because an expired token is fixed by the next token refresh
+	r"|\bHTTP(?:/1\.[01])?\s*(?:400|403|404|422)\b|\bstatus(?: code)?\s*[:=]?\s*(?:400|403|404|422)\b",
+	re.IGNORECASE
+)
+
+# Fields of each dead-lettered job returned by get_dead_letter_jobs
+DEAD_LETTER_FIELDS = ["name", "job_id", "customer", "file_name", "processing_status", "error_type",
+	"error_message", "retry_count", "completed_at", "modified"]
+
+
+def classify_error(error_message):
+	"""Classify a job error as Transient or Permanent; unknown errors are retried"""
+	if error_message and PERMANENT_ERROR_PATTERNS.search(error_message):
+		return PERMANENT
+	return TRANSIENT
+
+
+def get_retry_delay(retry_count):
+	"""Seconds before retry number retry_count + 1: exponential backoff with equal jitter"""
+	delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** retry_count)
+	return delay / 2 + random.uniform(0, delay / 2)
+
+
+def schedule_retry(job):
+	"""
+	Schedule a failed job's next retry or dead-letter it
+	job can be a Processing Job document or a job row
+	Returns True if a retry was scheduled
+	"""
+	error_type = classify_error(job.error_message)
+	retry_count = cint(job.retry_count)
+
+	values = {"error_type": error_type, "next_retry_at": None, "dead_lettered": 0}
+	if error_type == TRANSIENT and retry_count < MAX_RETRIES:
+		values["next_retry_at"] = add_to_date(now_datetime(), seconds=get_retry_delay(retry_count))
+	else:
+		values["dead_lettered"] = 1
+
+	frappe.db.set_value("Processing Job", job.name, values, update_modified=False)
+	return not values["dead_lettered"]
+
+
+def process_due_retries():
+	"""Move failed jobs whose retry is due to Retry and dispatch them; returns how many were moved"""
+	from invoice_processing_saas import dispatcher, job_state
+
+	retried = 0
+	while True:
+		due = frappe.db.sql("""
+			SELECT name
+			FROM `tabProcessing Job`
+			WHERE next_retry_at <= %(now)s AND processing_status = 'Failed'
+			ORDER BY next_retry_at ASC
+			LIMIT %(limit)s
+		""", {"now": now_datetime(), "limit": RETRY_BATCH_SIZE}, pluck=True)
+
+		if not due:
+			break
+
+		for job_name in due:
+			try:
+				job_state.transition(job_name, "Retry", expected_status="Failed")
+				retried += 1
+			except job_state.InvalidTransitionError:
+				# Changed since it was read; make sure it is not picked up again
+				frappe.db.set_value("Processing Job", job_name, "next_retry_at", None, update_modified=False)
+
+		frappe.db.commit()
+
+		if len(due) < RETRY_BATCH_SIZE:
+			break
+
+	if retried:
+		dispatcher.dispatch_pending_jobs()
+
+	return retried
+
+
+def requeue_job(job_name, reset_retries=False):
+	"""Take a job out of the dead-letter queue and retry it"""
+	from invoice_processing_saas import job_state
+
+	if reset_retries:
+		frappe.db.set_value("Processing Job", job_name, "retry_count", 0, update_modified=False)
+
+	# Entering Retry clears the dead-letter flag
+	return job_state.transition(job_name, "Retry", expected_status="Failed")
+
+
+@frappe.whitelist()
+def get_dead_letter_jobs(customer=None, limit=50, start=0):
+	"""List dead-lettered jobs, most recent first"""
+	frappe.only_for("System Manager")
+
+	filters = {"dead_lettered": 1}
+	if customer:
+		filters["customer"] = customer
+
+	return frappe.get_all("Processing Job",
+		filters=filters,
+		fields=DEAD_LETTER_FIELDS,
+		order_by="modified desc",
+		start=cint(start),
+		page_length=min(cint(limit) or 50, 500))
+
+
+@frappe.whitelist()
+def requeue_dead_letter_job(job_name, reset_retries=1):
+	"""Retry a dead-lettered job"""
+	frappe.only_for("System Manager")
+
+	if not frappe.db.get_value("Processing Job", job_name, "dead_lettered"):
+		frappe.throw(f"Job {job_name} is not dead-lettered")
+
+	status = requeue_job(job_name, reset_retries=cint(reset_retries))
+	return {"success": True, "processing_status": status}
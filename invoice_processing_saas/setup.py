@@ -5,6 +5,10 @@ import frappe
 from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
 from frappe.utils import cint
 
+from invoice_processing_saas.event_log import create_event_log_table
+from invoice_processing_saas.indexes import ensure_hot_path_indexes
+from invoice_processing_saas.job_rollup import create_rollup_table
+
 
 def after_install():
 	"""
@@ -23,6 +27,15 @@ def after_install():
 		# Create customer role if it doesn't exist
 		create_customer_role()
 		
+		# Create the processing event log table
+		create_event_log_table()
+		
+		# Create the daily job rollup table
+		create_rollup_table()
+		
+		# Create indexes for hot query paths
+		ensure_hot_path_indexes()
+		
 		frappe.db.commit()
 		print("Invoice Processing SaaS: Installation completed successfully")
 		
@@ -34,6 +34,9 @@ def cleanup_old_jobs():
 	try:
 		frappe.logger().info("Cleaning up old processing jobs")
 		# Add your cleanup logic here
+		
+		from invoice_processing_saas.notifications import prune_outbox
+		prune_outbox()
 	except Exception as e:
 		frappe.log_error(f"Error in cleanup_old_jobs: {str(e)}", "Daily Tasks")
 
@@ -9,18 +9,78 @@ def check_integration_health():
 	Check health of all integrations (every 15 minutes)
 	"""
 	try:
-		frappe.logger().info("Checking integration health")
-		# Add your integration health check logic here
+		from invoice_processing_saas.health_checks import check_integration_health
+		checked = check_integration_health()
+		frappe.logger().info(f"Checked integration health: {checked}")
 	except Exception as e:
 		frappe.log_error(f"Error in check_integration_health: {str(e)}", "Frequent Tasks")
 
 
+def sync_usage_counters():
+	"""
+	Write quota usage counters back to SaaS Customer (every 5 minutes)
+	"""
+	try:
+		from invoice_processing_saas.quota import sync_usage_counters
+		sync_usage_counters()
+	except Exception as e:
+		frappe.log_error(f"Error in sync_usage_counters: {str(e)}", "Frequent Tasks")
+
+
+def drain_notification_outbox():
+	"""
+	Send queued customer notifications (every minute)
+	"""
+	try:
+		from invoice_processing_saas.notifications import drain_outbox
+		drain_outbox()
+	except Exception as e:
+		frappe.log_error(f"Error in drain_notification_outbox: {str(e)}", "Frequent Tasks")
+
+
+def flush_event_log():
+	"""
+	Write buffered processing events to the event log table (every minute)
+	"""
+	try:
+		from invoice_processing_saas.event_log import flush_event_log
+		flush_event_log()
+	except Exception as e:
+		frappe.log_error(f"Error in flush_event_log: {str(e)}", "Frequent Tasks")
+
+
 def process_pending_jobs():
 	"""
-	Process any pending jobs (every 15 minutes)
+	Dispatch waiting jobs to n8n, weighted fair across customers (every minute)
 	"""
 	try:
-		frappe.logger().info("Processing pending jobs")
-		# Add your pending job processing logic here
+		from invoice_processing_saas.dispatcher import dispatch_pending_jobs
+		dispatched = dispatch_pending_jobs()
+		if dispatched:
+			frappe.logger().info(f"Dispatched {dispatched} pending jobs to n8n")
 	except Exception as e:
 		frappe.log_error(f"Error in process_pending_jobs: {str(e)}", "Frequent Tasks")
+
+
+def process_due_retries():
+	"""
+	Retry failed jobs whose backoff has elapsed (every minute)
+	"""
+	try:
+		from invoice_processing_saas.retries import process_due_retries
+		retried = process_due_retries()
+		if retried:
+			frappe.logger().info(f"Retrying {retried} failed jobs")
+	except Exception as e:
+		frappe.log_error(f"Error in process_due_retries: {str(e)}", "Frequent Tasks")
+
+
+def refresh_due_tokens():
+	"""
+	Refresh OAuth tokens that are about to expire (every minute)
+	"""
+	try:
+		from invoice_processing_saas.token_refresh import refresh_due_tokens
+		refresh_due_tokens()
+	except Exception as e:
+		frappe.log_error(f"Error in refresh_due_tokens: {str(e)}", "Frequent Tasks")
@@ -11,6 +11,9 @@ def archive_old_data():
 	try:
 		frappe.logger().info("Archiving old data")
 		# Add your data archiving logic here
+		
+		from invoice_processing_saas.event_log import prune_event_log
+		prune_event_log()
 	except Exception as e:
 		frappe.log_error(f"Error in archive_old_data: {str(e)}", "Monthly Tasks")
 
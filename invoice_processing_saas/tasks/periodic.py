@@ -6,11 +6,12 @@ import frappe
 
 def refresh_oauth_tokens():
 	"""
-	Refresh OAuth tokens for integrations (every 6 hours)
+	Rebuild the OAuth token refresh queue from the database (every 6 hours)
+	Tokens themselves are refreshed as they come due by frequent.refresh_due_tokens
 	"""
 	try:
-		frappe.logger().info("Refreshing OAuth tokens")
-		# Add your OAuth token refresh logic here
+		from invoice_processing_saas.token_refresh import rebuild_queue
+		rebuild_queue()
 	except Exception as e:
 		frappe.log_error(f"Error in refresh_oauth_tokens: {str(e)}", "Periodic Tasks")
 
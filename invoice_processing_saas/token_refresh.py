@@ -0,0 +1,369 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# OAuth token refresh driven by token expiry. Every Drive and Accounting
+# Integration with OAuth credentials is a member of a Redis sorted set scored
+# by when its token should be refreshed: token_expiry minus the refresh
+# margin (token_refresh_margin_minutes in site config), minus a stable
+# per-integration jitter of up to half the margin so tokens that were
+# issued together are not all refreshed together. Every minute the due
+# members are refreshed on a thread pool and rescored from their new expiry,
+# so refreshes are spread over the day as tokens come due instead of
+# arriving all at once. Integrations whose expiry is unknown are queued at a
+# random time within the next rebuild interval.
+#
+# Any number of workers can process the queue at once: each integration is
+# refreshed under its own Redis lock, taken before the refresh starts and
+# released after the new token is committed. A member is only refreshed if
+# it is still due once its lock is held, so a worker working from an older
+# read of the queue does not refresh a token another worker has just
+# refreshed. Refresh calls are functions of preloaded credentials and never
+# use the database; pool threads are initialised for the site so token
+# requests go through http_client's circuit breakers, and an open circuit
+# counts as a transient failure. A failed refresh is retried with
+# exponential backoff; a refresh token the provider rejects (revoked or
+# expired) sets the integration to Error and takes it out of the queue
+# until it is reconnected and saved. The queue is rebuilt from the database
+# every 6 hours, which also picks up integrations changed without a
+# document save.
+
+import random
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+from frappe.utils import add_to_date, cint, get_datetime, now_datetime
+from frappe.utils.password import set_encrypted_password
+from redis.exceptions import LockError
+
+from invoice_processing_saas import http_client
+from invoice_processing_saas.credentials import get_decrypted_passwords
+
+MAX_WORKERS = 8
+REFRESH_BATCH_SIZE = 50
+REFRESH_TIME_BUDGET = 50  # seconds, inside the 1 minute cron slot
+REFRESH_LOCK_TIMEOUT = 2 * 60  # seconds
+REFRESH_TIMEOUT = 10  # seconds
+REFRESH_RETRY_DELAY = 5 * 60  # seconds
+REFRESH_MAX_RETRY_DELAY = 6 * 60 * 60  # seconds
+DEFAULT_REFRESH_MARGIN = 10  # minutes
+REBUILD_INTERVAL = 6 * 60 * 60  # seconds
+
+# provider -> OAuth token endpoint
+TOKEN_URLS = {
+	"Google Drive": "https://oauth2.googleapis.com/token",
+	"QuickBooks": "https://oauth.platform.intuit.com/oauth2/v1/tokens/bearer",
+	"Xero": "https://identity.xero.com/connect/token",
+}
+
+# Providers that take the client credentials as HTTP Basic auth rather than in the form body
+BASIC_AUTH_PROVIDERS = ("QuickBooks", "Xero")
+
+# OAuth errors that retrying will not fix; the user has to reconnect
+PERMANENT_OAUTH_ERRORS = ("invalid_grant", "invalid_client", "unauthorized_client")
+
+# doctype -> fields loaded for refreshing and statuses that are not refreshed
+INTEGRATIONS = {
+	"Drive Integration": {
+		"fields": ["name", "token_expiry"],
+		"skip_statuses": ("Inactive", "Error"),
+	},
+	"Accounting Integration": {
+		"fields": ["name", "token_expiry", "accounting_system"],
+		"skip_statuses": ("Disconnected", "Error"),
+	},
+}
+PASSWORD_FIELDS = ["client_id", "client_secret", "refresh_token"]
+
+
+class RefreshTokenRejectedError(ValueError):
+	pass
+
+
+def refresh_due_tokens():
+	"""Refresh the tokens that are due; returns how many were refreshed"""
+	if not _redis("EXISTS", _queue_key()):
+		rebuild_queue()
+
+	deadline = time.monotonic() + REFRESH_TIME_BUDGET
+	refreshed = 0
+	attempted = set()
+
+	with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="token_refresh",
+			initializer=_init_thread, initargs=(frappe.local.site, frappe.local.sites_path)) as pool:
+		while time.monotonic() < deadline:
+			due = _redis("ZRANGEBYSCORE", _queue_key(), "-inf", time.time(), "LIMIT", 0, REFRESH_BATCH_SIZE)
+			# Members still due after an attempt are locked by another worker
+			members = [member for member in map(frappe.safe_decode, due or []) if member not in attempted]
+			if not members:
+				break
+
+			attempted.update(members)
+			refreshed += _refresh_batch(members, pool)
+			if len(due) < REFRESH_BATCH_SIZE:
+				break
+
+	return refreshed
+
+
+def refresh_integration(doctype, name):
+	"""Refresh one integration's token now; returns {"success": ..., "error": ...}"""
+	member = _member(doctype, name)
+	if _redis("EXISTS", _lock_key(member)):
+		return {"success": False, "error": "Token refresh already in progress"}
+
+	with ThreadPoolExecutor(max_workers=1, initializer=_init_thread,
+			initargs=(frappe.local.site, frappe.local.sites_path)) as pool:
+		if not _refresh_batch([member], pool, only_due=False):
+			return {"success": False, "error": frappe.db.get_value(doctype, name, "error_message")}
+
+	return {"success": True, "message": "Access token refreshed"}
+
+
+def rebuild_queue():
+	"""Rebuild the refresh queue from the database"""
+	scores = {}
+	unknown = {}
+	for doctype, config in INTEGRATIONS.items():
+		rows = frappe.get_all(doctype,
+			filters={"integration_status": ["not in", config["skip_statuses"]]},
+			fields=config["fields"])
+
+		for row in rows:
+			if _get_provider(doctype, row) in TOKEN_URLS:
+				target = scores if row.token_expiry else unknown
+				target[_member(doctype, row.name)] = _get_refresh_score(doctype, row.name, row.token_expiry)
+
+	key = _queue_key()
+	queued = set(frappe.safe_decode(member) for member in (_redis("ZRANGE", key, 0, -1) or []))
+	stale = queued - set(scores) - set(unknown)
+
+	pipeline = frappe.cache().pipeline()
+	if stale:
+		pipeline.zrem(key, *stale)
+	if scores:
+		pipeline.zadd(key, scores)
+	if unknown:
+		# Keep the time already drawn so they are not pushed back on every rebuild
+		pipeline.zadd(key, unknown, nx=True)
+	pipeline.execute()
+
+
+def schedule_integration(doc, method=None):
+	"""Queue or dequeue an integration when it changes (doc event)"""
+	member = _member(doc.doctype, doc.name)
+	if method == "on_trash" or doc.integration_status in INTEGRATIONS[doc.doctype]["skip_statuses"] \
+			or _get_provider(doc.doctype, doc) not in TOKEN_URLS:
+		_redis("ZREM", _queue_key(), member)
+	else:
+		_redis("ZADD", _queue_key(), _get_refresh_score(doc.doctype, doc.name, doc.token_expiry), member)
+
+
+def get_refresh_margin():
+	"""Minutes before expiry that a token is refreshed, from token_refresh_margin_minutes in site config"""
+	return cint(frappe.conf.get("token_refresh_margin_minutes")) or DEFAULT_REFRESH_MARGIN
+
+
+def _init_thread(site, sites_path):
+	"""Give a pool thread the site's config, for http_client's Redis state; it never connects to the database"""
+	frappe.init(site=site, sites_path=sites_path)
+
+
+def _refresh_batch(members, pool, only_due=True):
+	"""Refresh a batch of queued integrations; returns how many were refreshed"""
+	locks = {}
+	for member in members:
+		lock = frappe.cache().lock(_lock_key(member), timeout=REFRESH_LOCK_TIMEOUT)
+		if not lock.acquire(blocking=False):
+			continue
+
+		# Another worker may have refreshed and rescored it since the queue was read
+		score = _redis("ZSCORE", _queue_key(), member) if only_due else None
+		if only_due and (score is None or float(score) > time.time()):
+			lock.release()
+			continue
+
+		locks[member] = lock
+
+	try:
+		integrations = _load_integrations(list(locks))
+		results = list(pool.map(_run_refresh, integrations))
+		return _write_results(integrations, results)
+	finally:
+		for lock in locks.values():
+			try:
+				lock.release()
+			except LockError:
+				pass
+
+
+def _load_integrations(members):
+	"""Load the credentials of a batch of integrations, one query per doctype for each kind of data"""
+	by_doctype = {}
+	for member in members:
+		doctype, name = member.split("|", 1)
+		by_doctype.setdefault(doctype, []).append(name)
+
+	integrations = []
+	for doctype, names in by_doctype.items():
+		rows = frappe.get_all(doctype, filters={"name": ["in", names]}, fields=INTEGRATIONS[doctype]["fields"])
+		passwords = get_decrypted_passwords(doctype, names, PASSWORD_FIELDS)
+
+		found = set()
+		for row in rows:
+			row.update(passwords.get(row.name, {}))
+			row.doctype = doctype
+			row.provider = _get_provider(doctype, row)
+			integrations.append(row)
+			found.add(row.name)
+
+		# Deleted since they were queued
+		missing = [_member(doctype, name) for name in names if name not in found]
+		if missing:
+			_redis("ZREM", _queue_key(), *missing)
+
+	return integrations
+
+
+def _run_refresh(integration):
+	"""Refresh one integration's token; runs on a pool thread"""
+	try:
+		return _request_token(integration), None, False
+	except RefreshTokenRejectedError as e:
+		return None, str(e), True
+	except Exception as e:
+		return None, str(e), False
+
+
+def _request_token(integration):
+	"""Exchange the refresh token for a new access token at the provider's token endpoint"""
+	if integration.provider not in TOKEN_URLS:
+		raise ValueError(f"Token refresh is not supported for {integration.provider}")
+	if not integration.refresh_token:
+		raise RefreshTokenRejectedError("No refresh token available")
+
+	import requests
+
+	data = {"grant_type": "refresh_token", "refresh_token": integration.refresh_token}
+	auth = None
+	if integration.provider in BASIC_AUTH_PROVIDERS:
+		auth = (integration.client_id or "", integration.client_secret or "")
+	else:
+		data.update({"client_id": integration.client_id, "client_secret": integration.client_secret})
+
+	try:
+		response = http_client.post("oauth", TOKEN_URLS[integration.provider],
+			data=data, auth=auth, headers={"Accept": "application/json"}, timeout=REFRESH_TIMEOUT)
+	except http_client.CircuitOpenError:
+		# Retried with backoff like any other transient failure
+		raise ValueError(f"{integration.provider} token endpoint is failing; circuit is open")
+	except requests.RequestException as e:
+		raise ValueError(f"{integration.provider} token endpoint unreachable: {str(e)}")
+
+	if response.status_code in (400, 401) and _get_oauth_error(response) in PERMANENT_OAUTH_ERRORS:
+		raise RefreshTokenRejectedError(f"{integration.provider} rejected the refresh token "
+			f"({_get_oauth_error(response)}); reconnect the integration")
+	if response.status_code >= 400:
+		raise ValueError(f"{integration.provider} token refresh failed: HTTP {response.status_code} "
+			f"{response.text[:200]}")
+
+	token = response.json()
+	if not token.get("access_token"):
+		raise ValueError(f"{integration.provider} token response has no access token")
+
+	return token
+
+
+def _get_oauth_error(response):
+	try:
+		return response.json().get("error")
+	except ValueError:
+		return None
+
+
+def _write_results(integrations, results):
+	"""Store new tokens and rescore the queue; returns how many were refreshed"""
+	refreshed = 0
+	scores = {}
+	rejected = []
+	failures = {}
+
+	for integration, (token, error, permanent) in zip(integrations, results):
+		member = _member(integration.doctype, integration.name)
+		if permanent:
+			frappe.db.set_value(integration.doctype, integration.name, {
+				"integration_status": "Error",
+				"error_message": error
+			}, update_modified=False)
+			rejected.append(member)
+			continue
+		if error:
+			frappe.db.set_value(integration.doctype, integration.name, "error_message", error,
+				update_modified=False)
+			failures[member] = cint(_redis("HINCRBY", _failures_key(), member, 1))
+			delay = min(REFRESH_MAX_RETRY_DELAY, REFRESH_RETRY_DELAY * 2 ** (failures[member] - 1))
+			scores[member] = time.time() + delay
+			continue
+
+		token_expiry = add_to_date(now_datetime(), seconds=cint(token.get("expires_in")) or 3600)
+		set_encrypted_password(integration.doctype, integration.name, token["access_token"], "access_token")
+		if token.get("refresh_token"):
+			# QuickBooks and Xero rotate refresh tokens
+			set_encrypted_password(integration.doctype, integration.name, token["refresh_token"], "refresh_token")
+		frappe.db.set_value(integration.doctype, integration.name, {
+			"token_expiry": token_expiry,
+			"error_message": None
+		}, update_modified=False)
+
+		scores[member] = _get_refresh_score(integration.doctype, integration.name, token_expiry)
+		refreshed += 1
+
+	frappe.db.commit()
+
+	if scores:
+		_redis("ZADD", _queue_key(), *[value for member, score in scores.items() for value in (score, member)])
+	if rejected:
+		_redis("ZREM", _queue_key(), *rejected)
+
+	# Successful and rejected members start counting failures again from zero
+	cleared = [member for member in list(scores) + rejected if member not in failures]
+	if cleared:
+		_redis("HDEL", _failures_key(), *cleared)
+
+	return refreshed
+
+
+def _get_refresh_score(doctype, name, token_expiry):
+	"""When to refresh a token, as a Unix timestamp"""
+	if not token_expiry:
+		return time.time() + random.uniform(0, REBUILD_INTERVAL)
+
+	margin = get_refresh_margin() * 60
+	jitter = zlib.crc32(_member(doctype, name).encode()) % (margin // 2 + 1)
+	return get_datetime(token_expiry).timestamp() - margin - jitter
+
+
+def _get_provider(doctype, integration):
+	return "Google Drive" if doctype == "Drive Integration" else integration.accounting_system
+
+
+def _member(doctype, name):
+	return f"{doctype}|{name}"
+
+
+def _redis(*args):
+	"""Run a raw Redis command on the cache connection (see quota._redis)"""
+	return frappe.cache().execute_command(*args)
+
+
+def _queue_key():
+	return frappe.cache().make_key("invoice_processing_saas:token_refresh:queue")
+
+
+def _failures_key():
+	return frappe.cache().make_key("invoice_processing_saas:token_refresh:failures")
+
+
+def _lock_key(member):
+	return frappe.cache().make_key(f"invoice_processing_saas:token_refresh:lock:{member}")
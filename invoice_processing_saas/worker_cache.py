@@ -0,0 +1,68 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+# Cross-worker invalidation for in-process caches. Modules register a
+# handler for a Redis pub/sub channel and publish to it after a commit; a
+# listener thread in every worker process calls the handler with the site
+# and payload of each message. If the listener fails, every handler is
+# called with site None to drop everything, and the next ensure_listener
+# call starts a new one.
+
+import json
+import threading
+
+import frappe
+
+_handlers = {}  # channel -> handler(site, payload)
+_listener = None
+_listener_channels = frozenset()
+_listener_lock = threading.Lock()
+
+
+def register(channel, handler):
+	"""Call handler(site, payload) in this process for every message published on channel"""
+	_handlers[channel] = handler
+
+
+def publish(channel, payload=None):
+	"""Publish an invalidation to every worker process once the current transaction commits"""
+	message = json.dumps({"site": frappe.local.site, "payload": payload})
+	frappe.db.after_commit.add(lambda: frappe.cache().execute_command("PUBLISH", channel, message))
+
+
+def ensure_listener():
+	"""Start this process's listener, or restart it if channels were registered since"""
+	global _listener, _listener_channels
+
+	channels = frozenset(_handlers)
+	if _listener is not None and _listener.is_alive() and _listener_channels == channels:
+		return
+
+	with _listener_lock:
+		channels = frozenset(_handlers)
+		if _listener is not None and _listener.is_alive():
+			if _listener_channels == channels:
+				return
+			_listener.stop()
+
+		pubsub = frappe.cache().pubsub(ignore_subscribe_messages=True)
+		pubsub.subscribe(**{channel: _on_message for channel in channels})
+		_listener = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=_on_listener_error)
+		_listener_channels = channels
+
+
+def _on_message(message):
+	handler = _handlers.get(frappe.safe_decode(message["channel"]))
+	if not handler:
+		return
+
+	data = json.loads(message["data"])
+	handler(data["site"], data["payload"])
+
+
+def _on_listener_error(error, pubsub, thread):
+	"""Stop the listener and drop every cache, since messages may have been missed"""
+	thread.stop()
+	pubsub.close()
+	for handler in _handlers.values():
+		handler(None, None)